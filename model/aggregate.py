@@ -0,0 +1,288 @@
+"""
+Out-of-core statistics across the runs of an ensemble.
+
+aggregate reads the final_metrics series of many run files one block
+of iterations at a time, spread over a pool of processes, and writes a
+single summary file:
+
+/quantiles                          (n_q,) probability levels
+/runs/file                          (n_runs,)
+/<series>/count                     (n_iterations,) runs which reached each iteration
+/<series>/mean, variance            (n_iterations,) across runs
+/<series>/quantiles                 (n_q, n_iterations) across runs
+/<series>/pooled_count, pooled_mean,
+/<series>/pooled_variance           over every run and iteration
+/<series>/pooled_quantiles          (n_q,) over every run and iteration
+/<series>/histogram                 pooled count of each value, integer series only
+
+<series> is the path of a series under final_metrics, e.g.
+subregions/subregion-3-flux or avg_age. A worker holds one block of
+every run at a time, so memory is bounded by block_size x n_runs
+whatever the length of the runs. The per-iteration quantiles are exact;
+the pooled quantiles come from a QuantileSketch, which merges across
+blocks and is accurate to relative_accuracy. Runs may differ in length
+(e.g. runs stopped early); iterations a run did not reach are left out.
+So are the entries of a swmr file past its last flush (/live/iteration),
+which hold the fill values (0 flux, -1 ages) rather than results.
+"""
+import argparse
+import warnings
+import multiprocessing
+from collections import Counter
+import numpy as np
+import h5py
+
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+class QuantileSketch():
+    """ Mergeable quantile sketch with bounded relative error.
+
+    Values are counted in logarithmic buckets (as in DDSketch) so that
+    any quantile is returned within relative_accuracy of a value of
+    the right rank. Zero and negative values are supported, nan is ignored.
+
+    Keyword arguments:
+        relative_accuracy -- relative error of the quantiles
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zeros = 0
+
+    @property
+    def count(self):
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zeros
+
+    def add(self, values):
+        """ Add an array of values """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.zeros += int(np.count_nonzero(values == 0))
+        for buckets, magnitudes in [(self.positive, values[values > 0]),
+                                    (self.negative, -values[values < 0])]:
+            if magnitudes.size:
+                keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma)
+                                            .astype(np.int64), return_counts=True)
+                buckets.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def merge(self, other):
+        """ Add the values counted by another sketch of the same accuracy """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches of the same relative accuracy can be merged')
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+
+    def quantile(self, quantiles):
+        """ Return the value at each quantile, nan if the sketch is empty """
+        quantiles = np.atleast_1d(np.asarray(quantiles, dtype=float))
+        count = self.count
+        if count == 0:
+            return np.full(quantiles.size, np.nan)
+        # Buckets in ascending order of value: negatives from the largest
+        # magnitude, zero, then positives
+        negative_keys = sorted(self.negative, reverse=True)
+        positive_keys = sorted(self.positive)
+        values = np.concatenate([-self.bucket_value(np.array(negative_keys, dtype=float)),
+                                 [0.0],
+                                 self.bucket_value(np.array(positive_keys, dtype=float))])
+        counts = np.array([self.negative[key] for key in negative_keys] + [self.zeros]
+                          + [self.positive[key] for key in positive_keys])
+        ranks = quantiles * (count - 1)
+        return values[np.searchsorted(np.cumsum(counts), ranks, side='right')]
+
+    def bucket_value(self, keys):
+        """ The value a bucket stands for, within relative_accuracy of
+        every magnitude in it """
+        return 2 * self.gamma ** keys / (self.gamma + 1)
+
+
+def aggregate(run_files, summary_path, processes=1, block_size=10000, quantiles=QUANTILES,
+                                                                    relative_accuracy=0.01):
+    """ Summarise the final_metrics series of run_files into summary_path.
+
+    Keyword arguments:
+        run_files -- list of paths to per-run hdf5 output files
+        summary_path -- path of the summary file to write
+        processes -- number of processes reading blocks
+        block_size -- iterations read from every run at a time
+        quantiles -- probability levels of the quantiles
+        relative_accuracy -- relative error of the pooled quantiles
+
+    Returns:
+        summary_path -- path of the summary file
+    """
+    series = scan_series(run_files)
+    n_iterations = max(length for length, _ in series.values())
+    names = sorted(series)
+    integer_names = [name for name in names if series[name][1]]
+    tasks = [(run_files, names, integer_names, start, min(start + block_size, n_iterations),
+                    quantiles, relative_accuracy)
+                    for start in range(0, n_iterations, block_size)]
+
+    pooled = {name: {'moments': [0, 0.0, 0.0],
+                     'sketch': QuantileSketch(relative_accuracy),
+                     'histogram': np.zeros(0, dtype=np.int64)} for name in names}
+    with h5py.File(summary_path, 'w') as summary:
+        summary['quantiles'] = np.asarray(quantiles, dtype=float)
+        summary.create_dataset('runs/file', data=np.array(run_files, dtype=object),
+                                dtype=h5py.special_dtype(vlen=str))
+        for name in names:
+            grp = summary.create_group(name)
+            grp.create_dataset('count', shape=(n_iterations,), dtype=np.int64)
+            for key in ['mean', 'variance']:
+                grp.create_dataset(key, shape=(n_iterations,), dtype=float)
+            grp.create_dataset('quantiles', shape=(len(quantiles), n_iterations), dtype=float)
+
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            blocks = pool.imap_unordered(aggregate_block_task, tasks)
+        else:
+            pool = None
+            blocks = map(aggregate_block_task, tasks)
+        try:
+            # Blocks are written as they arrive, so only a few are held at once
+            for start, stop, block in blocks:
+                for name, stats in block.items():
+                    grp = summary[name]
+                    for key in ['count', 'mean', 'variance']:
+                        grp[key][start:stop] = stats[key]
+                    grp['quantiles'][:, start:stop] = stats['quantiles']
+                    merge_pooled(pooled[name], stats)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        for name in names:
+            grp = summary[name]
+            count, mean, m2 = pooled[name]['moments']
+            grp['pooled_count'] = count
+            grp['pooled_mean'] = mean if count > 0 else np.nan
+            grp['pooled_variance'] = m2 / (count - 1) if count > 1 else np.nan
+            grp['pooled_quantiles'] = pooled[name]['sketch'].quantile(quantiles)
+            if series[name][1]:
+                grp['histogram'] = pooled[name]['histogram']
+    return summary_path
+
+
+def aggregate_block_task(task):
+    return aggregate_block(*task)
+
+
+def aggregate_block(run_files, names, integer_names, start, stop, quantiles, relative_accuracy):
+    """ Statistics of iterations start to stop-1 of every series across
+    run_files, with a histogram of the series in integer_names.
+    Returns (start, stop, {name: statistics}). """
+    block = {}
+    files = [h5py.File(path, 'r') for path in run_files]
+    try:
+        for name in names:
+            values = read_block(files, name, start, stop)
+            valid = ~np.isnan(values)
+            count = valid.sum(axis=0)
+            filled = np.where(valid, values, 0.0)
+            mean = np.divide(filled.sum(axis=0), count, out=np.full(count.size, np.nan),
+                             where=count > 0)
+            m2 = np.where(valid, np.square(values - mean), 0.0).sum(axis=0)
+            variance = np.divide(m2, count - 1, out=np.full(count.size, np.nan),
+                                 where=count > 1)
+            if valid.all():
+                block_quantiles = np.quantile(values, quantiles, axis=0)
+            else:
+                with warnings.catch_warnings():
+                    # Iterations no run reached have no quantiles
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    block_quantiles = np.nanquantile(values, quantiles, axis=0)
+
+            present = values[valid]
+            sketch = QuantileSketch(relative_accuracy)
+            sketch.add(present)
+            pooled_mean = present.mean() if present.size else 0.0
+            block[name] = {'count': count, 'mean': mean, 'variance': variance,
+                           'quantiles': block_quantiles, 'sketch': sketch,
+                           'moments': [present.size, pooled_mean,
+                                       float(np.sum(np.square(present - pooled_mean)))]}
+            if name in integer_names:
+                block[name]['histogram'] = np.bincount(present[present >= 0].astype(np.int64))
+    finally:
+        for f in files:
+            f.close()
+    return start, stop, block
+
+
+#############################################################################
+# Helper functions
+#############################################################################
+
+def scan_series(run_files):
+    """ Return {name: (length, integer)} for every final_metrics series
+    of run_files, with the longest length seen and whether the series
+    holds integers """
+    series = {}
+    for path in run_files:
+        with h5py.File(path, 'r') as f:
+            def add_series(name, obj):
+                if isinstance(obj, h5py.Dataset) and obj.ndim == 1:
+                    length, integer = series.get(name, (0, True))
+                    series[name] = (max(length, obj.shape[0]),
+                                    integer and obj.dtype.kind in 'iu')
+            f['final_metrics'].visititems(add_series)
+    return series
+
+
+def read_block(files, name, start, stop):
+    """ Return entries start:stop of final_metrics/name of every file as
+    a (n_runs, stop - start) float array, nan where a run is too short,
+    lacks the series or (a swmr file) has not flushed the entries """
+    values = np.full((len(files), stop - start), np.nan)
+    for row, f in enumerate(files):
+        path = f'final_metrics/{name}'
+        if path in f:
+            end = stop
+            if 'live/iteration' in f:
+                end = max(start, min(stop, int(f['live/iteration'][0]) + 1))
+            segment = f[path][start:end]
+            values[row, :segment.size] = segment
+    return values
+
+
+def merge_pooled(pooled, stats):
+    """ Merge the pooled moments, sketch and histogram of a block into pooled """
+    count, mean, m2 = pooled['moments']
+    block_count, block_mean, block_m2 = stats['moments']
+    total = count + block_count
+    if block_count > 0:
+        delta = block_mean - mean
+        pooled['moments'] = [total, mean + delta * block_count / total,
+                             m2 + block_m2 + delta ** 2 * count * block_count / total]
+    pooled['sketch'].merge(stats['sketch'])
+    if 'histogram' not in stats:
+        return
+    histogram, block_histogram = pooled['histogram'], stats['histogram']
+    size = max(histogram.size, block_histogram.size)
+    pooled['histogram'] = (np.pad(histogram, (0, size - histogram.size))
+                           + np.pad(block_histogram, (0, size - block_histogram.size)))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Summarise the flux and age series of many run files in bounded memory')
+    parser.add_argument('summary', help='Path of the summary file to write')
+    parser.add_argument('run_files', nargs='+', help='Per-run hdf5 output files')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes reading blocks')
+    parser.add_argument('--block-size', type=int, default=10000, help='Iterations read from every run at a time')
+    parser.add_argument('--quantiles', type=float, nargs='+', default=QUANTILES, help='Probability levels of the quantiles')
+    parser.add_argument('--relative-accuracy', type=float, default=0.01, help='Relative error of the pooled quantiles')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    aggregate(args.run_files, args.summary, args.processes, args.block_size,
+              args.quantiles, args.relative_accuracy)
+    print(f'Wrote summary of {len(args.run_files)} runs to {args.summary}')
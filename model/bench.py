@@ -0,0 +1,241 @@
+"""
+End-to-end throughput benchmark of the model.
+
+Runs a fixed set of canonical, fixed-seed parameter sets through the
+full run.py pipeline, one process per case, and reports for each:
+
+    iterations_per_second -- throughput of the entrainment loop
+    wall_time             -- wall time of the whole run (seconds)
+    peak_rss              -- peak resident memory of the run (bytes)
+    output_bytes          -- size of everything the run wrote (bytes)
+
+The report is written as JSON. Given a baseline report, every case is
+compared against it and the command exits with status 1 if any case
+regressed by more than the tolerance:
+
+    python bench.py --output bench.json
+    python bench.py --baseline bench.json --tolerance 0.1
+"""
+import os
+import sys
+import json
+import yaml
+import tempfile
+import platform
+import argparse
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from shortuuid import uuid
+
+import catalog as catalog_module
+from progress import path_size
+
+
+PARAM_PATH = Path(__file__).parent / 'parameters/param.yaml'
+RUN_PATH = Path(__file__).parent / 'run.py'
+
+SEED = 20200101
+
+# Overrides of param.yaml for each canonical case
+CASES = {
+    'small-bed': {'x_max': 20, 'num_subregions': 2, 'n_iterations': 2000,
+                  'data_save_interval': 100},
+    'param-yaml': {},
+    'large-bed': {'x_max': 1000, 'num_subregions': 4, 'n_iterations': 200,
+                  'data_save_interval': 100},
+    'height-dependent': {'height_dependancy': True, 'data_save_interval': 100},
+    'dense-save': {'data_save_interval': 1, 'output_sinks': ['hdf5', 'compact']},
+}
+
+# Metrics compared against the baseline and whether larger is better
+METRICS = {'iterations_per_second': True,
+           'peak_rss': False,
+           'output_bytes': False}
+
+
+def case_parameters(overrides):
+    """ Return the parameters of a case: param.yaml with the case's
+    overrides, a fixed seed and output kept inside the working dir. """
+    with open(PARAM_PATH, 'r') as p:
+        parameters = yaml.safe_load(p.read())
+    parameters.update(overrides)
+    parameters.update({'seed': SEED,
+                       'filename_prefix': 'bench',
+                       'output_dir': 'output',
+                       'catalog': True,
+                       'catalog_path': 'catalog.sqlite'})
+    return parameters
+
+
+def run_case(name, overrides, work_dir):
+    """ Run one case through run.py in its own process.
+
+    Keyword arguments:
+        name -- name of the case, the prefix of its run ID
+        overrides -- parameters replacing those in param.yaml
+        work_dir -- directory for the case's parameter file and output.
+                    Each invocation gets a new run ID, so a reused
+                    directory (e.g. --keep) only adds runs to it.
+
+    Returns:
+        result -- dictionary of the case's measurements
+    """
+    case_dir = Path(work_dir) / name
+    os.makedirs(case_dir, exist_ok=True)
+    param_path = case_dir / 'param.yaml'
+    with open(param_path, 'w') as p:
+        yaml.safe_dump(case_parameters(overrides), p)
+    run_id = f'{name}-{uuid()}'
+
+    process = subprocess.Popen([sys.executable, str(RUN_PATH), str(param_path), '--run-id', run_id],
+                               cwd=Path(__file__).parent, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True)
+    stderr = process.stderr.read()
+    process.stderr.close()
+    peak_rss = wait_for_child(process)
+    if process.returncode != 0:
+        raise RuntimeError(f'Case {name} failed with exit code {process.returncode}:\n{stderr}')
+
+    catalog = catalog_module.Catalog(case_dir / 'catalog.sqlite')
+    try:
+        runs = catalog.query([f'run_id={run_id}'])
+    finally:
+        catalog.close()
+    if len(runs) != 1:
+        raise RuntimeError(f'Case {name} registered {len(runs)} runs as {run_id} '
+                           f'in {case_dir / "catalog.sqlite"}, expected 1')
+    run = runs[0]
+    return {'run_id': run_id,
+            'iterations_per_second': run['iterations_per_second'],
+            'wall_time': run['wall_time'],
+            'peak_rss': peak_rss,
+            'output_bytes': sum(path_size(path) for path in run['outputs']),
+            'n_iterations': run['params']['n_iterations'],
+            'code_version': run['code_version']}
+
+
+def wait_for_child(process):
+    """ Wait for the process to exit and set its returncode.
+
+    The peak RSS of this child alone needs wait4: Popen.wait() reaps
+    the child without its resource usage, and the ru_maxrss of
+    getrusage(RUSAGE_CHILDREN) is the largest peak of every child so
+    far, which cannot be differenced between cases. Popen is given the
+    exit code so that it does not try to reap the child again. Where
+    there is no wait4 (Windows), the peak RSS is not measured.
+
+    Returns:
+        peak_rss -- peak resident memory of the child in bytes, or None
+    """
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    _, status, usage = os.wait4(process.pid, 0)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def compare(report, baseline, tolerance):
+    """ Compare every case in report with the same case in baseline.
+
+    A metric regressed if it is worse than the baseline by more than
+    tolerance (a fraction of the baseline value). Metrics which were
+    not measured in either report are skipped.
+
+    Returns:
+        comparison -- list of dictionaries, one per case and metric
+    """
+    comparison = []
+    for name, result in report['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        for metric, larger_is_better in METRICS.items():
+            old, new = baseline['cases'][name].get(metric), result[metric]
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            worse = -change if larger_is_better else change
+            comparison.append({'case': name, 'metric': metric, 'baseline': old, 'value': new,
+                               'change': change, 'regressed': worse > tolerance})
+    return comparison
+
+
+def main(case_names, work_dir, baseline=None, tolerance=0.1):
+    """ Run the named cases and compare them with baseline.
+
+    Keyword arguments:
+        case_names -- names of the CASES to run
+        work_dir -- directory for the parameter files and output
+        baseline -- optional report of an earlier benchmark
+        tolerance -- allowed fractional regression per metric
+
+    Returns:
+        report -- dictionary of the results (and the comparison)
+    """
+    report = {'created': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'machine': platform.platform(),
+              'seed': SEED,
+              'cases': {}}
+    for name in case_names:
+        print(f'Running {name}...')
+        report['cases'][name] = run_case(name, CASES[name], work_dir)
+        result = report['cases'][name]
+        peak_rss = 'n/a' if result['peak_rss'] is None else f'{result["peak_rss"] / 2**20:.1f} MiB'
+        print(f'    {result["iterations_per_second"]:.1f} it/s, '
+              f'peak RSS {peak_rss}, '
+              f'output {result["output_bytes"] / 2**20:.2f} MiB')
+    if baseline is not None:
+        report['tolerance'] = tolerance
+        report['comparison'] = compare(report, baseline, tolerance)
+    return report
+
+
+def format_comparison(comparison):
+    """ Return a table of the comparison with a baseline """
+    lines = [f'{"case":<20}{"metric":<24}{"baseline":>14}{"value":>14}{"change":>10}']
+    for row in comparison:
+        flag = '  REGRESSED' if row['regressed'] else ''
+        lines.append(f'{row["case"]:<20}{row["metric"]:<24}{row["baseline"]:>14.1f}'
+                     f'{row["value"]:>14.1f}{row["change"]:>10.1%}{flag}')
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the throughput of canonical model runs')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES),
+                        help='Cases to run (default: all)')
+    parser.add_argument('--output', default=Path(__file__).parent / 'output/bench.json',
+                        help='JSON report to write (default: model/output/bench.json)')
+    parser.add_argument('--baseline', default=None, help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed fractional regression of each metric (default: 0.1)')
+    parser.add_argument('--keep', default=None,
+                        help='Keep the parameter files and output of the runs in this directory')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    if args.keep is not None:
+        report = main(args.cases, args.keep, baseline, args.tolerance)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = main(args.cases, work_dir, baseline, args.tolerance)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output}')
+    if baseline is not None:
+        print(format_comparison(report['comparison']))
+        if any(row['regressed'] for row in report['comparison']):
+            sys.exit(1)
@@ -0,0 +1,298 @@
+"""
+Micro-benchmarks of the logic.py kernels across problem sizes.
+
+A stream state is generated for every combination of bed length
+(x_max) and level_limit, and each kernel of the entrainment loop is
+timed on it:
+
+    compute_available_vertices, get_event_particles,
+    move_model_particles, update_flux, update_particle_states,
+    set_model_particles
+
+For every kernel and level_limit a scaling exponent k is fitted to
+time ~ n_particles^k on a log-log scale, so super-linear kernels stand
+out. Sizes that would take longer than the time budget (predicted from
+the smaller sizes) are skipped and recorded as null. Results are
+written as JSON:
+
+    python bench_kernels.py --x-max 100 1000 10000 --level-limit 2 3
+"""
+import json
+import math
+import time
+import random
+import platform
+import argparse
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+
+import logic
+
+
+KERNELS = ['compute_available_vertices', 'get_event_particles', 'move_model_particles',
+           'update_flux', 'update_particle_states', 'set_model_particles']
+
+X_MAX = [100, 1000, 10000, 100000]
+LEVEL_LIMITS = [2, 3, 4, 5]
+
+# Kernels whose inputs are computed with another kernel; they are
+# skipped whenever that kernel is
+DEPENDS_ON = {'move_model_particles': 'compute_available_vertices',
+              'set_model_particles': 'compute_available_vertices'}
+
+# Exponent assumed when predicting the time of a kernel measured at one size only
+DEFAULT_EXPONENT = 2
+
+
+def build_state(x_max, level_limit, set_diam=0.5, pack_density=0.78,
+                    stack_fraction=0.5, num_subregions=4, seed=0):
+    """ Generate a stream state without the quadratic placement loop
+    of set_model_particles.
+
+    Bed vertices are filled with model particles at pack_density, as
+    at the start of a run. Particles are then stacked level by level up
+    to level_limit, the way they pile up during a run: stack_fraction
+    of the vertices formed by two touching particles of a level get a
+    particle on the next level. Ages are drawn at random.
+
+    Keyword arguments:
+        x_max -- length of the bed
+        level_limit -- highest level particles are stacked to
+        set_diam -- diameter of all particles
+        pack_density -- fraction of the bed vertices holding a particle
+        stack_fraction -- fraction of the vertices above the first
+                                        level holding a particle
+        num_subregions -- number of subregions
+        seed -- seed of the generators
+
+    Returns:
+        state -- dictionary of bed_particles, model_particles, model_supp,
+                                        subregions, h and the parameters
+    """
+    np.random.seed(seed)
+    random.seed(seed)
+    h = np.sqrt(np.square(set_diam) - np.square(set_diam / 2))
+    bed_particles = logic.build_streambed(x_max, set_diam)
+
+    # Level 1 sits on the bed, level k on two touching particles of level k-1
+    below_x, below_y, below_ids = bed_particles[:,0], bed_particles[:,2], bed_particles[:,3]
+    levels = []
+    for level in range(1, level_limit + 1):
+        vertices = np.intersect1d(below_x - (set_diam / 2), below_x + (set_diam / 2))
+        fraction = pack_density if level == 1 else stack_fraction
+        count = int(math.ceil(vertices.size * fraction)) if level == 1 \
+                    else int(vertices.size * fraction)
+        if count == 0:
+            break
+        x = np.sort(np.random.choice(vertices, count, replace=False))
+        order = np.argsort(below_x)
+        left = order[np.searchsorted(below_x, x - (set_diam / 2), sorter=order)]
+        right = order[np.searchsorted(below_x, x + (set_diam / 2), sorter=order)]
+        y = np.round(h + below_y[left], 2)
+        levels.append((x, y, below_ids[left], below_ids[right]))
+        first_id = sum(level_x.size for level_x, _, _, _ in levels[:-1])
+        below_x, below_y, below_ids = x, y, np.arange(first_id, first_id + count, dtype=float)
+
+    num_particles = sum(x.size for x, _, _, _ in levels)
+    model_particles = np.zeros([num_particles, 7], dtype=float)
+    model_supp = np.zeros([num_particles, 2], dtype=float)
+    start = 0
+    for x, y, left_ids, right_ids in levels:
+        end = start + x.size
+        model_particles[start:end, 0] = x
+        model_particles[start:end, 2] = y
+        model_supp[start:end, 0] = left_ids
+        model_supp[start:end, 1] = right_ids
+        start = end
+    model_particles[:,1] = set_diam
+    model_particles[:,3] = np.arange(num_particles)
+    model_particles[:,5] = np.random.randint(0, 100, num_particles)
+    model_particles = logic.update_particle_states(model_particles, model_supp)
+
+    return {'x_max': x_max,
+            'level_limit': level_limit,
+            'set_diam': set_diam,
+            'pack_density': pack_density,
+            'h': h,
+            'bed_particles': bed_particles,
+            'model_particles': model_particles,
+            'model_supp': model_supp,
+            'subregions': logic.define_subregions(x_max, num_subregions, 1)}
+
+
+def kernel_calls(state, kernels, lambda_1=5, mu=1, sigma=0.25):
+    """ Return a dictionary of kernel name to a zero-argument function
+    running that kernel once on (a copy of) state, for each of kernels.
+    Event particles, hops and vertices are drawn once, so every call
+    does the same work. """
+    bed = state['bed_particles']
+    model = state['model_particles']
+    supp = state['model_supp']
+    subregions = state['subregions']
+    set_diam, level_limit, h = state['set_diam'], state['level_limit'], state['h']
+
+    event_ids = logic.get_event_particles(lambda_1, subregions, model.copy(), level_limit)
+    hops = logic.compute_hops(event_ids, model, mu, sigma)
+    # Keep the hops inside the bed so no particle leaves the stream
+    hops[:,0] = np.minimum(hops[:,0], state['x_max'] - set_diam)
+    initial_x = model[event_ids, 0]
+
+    calls = {
+        'compute_available_vertices': lambda: logic.compute_available_vertices(
+                                model, bed, set_diam, level_limit, lifted_particles=event_ids),
+        'get_event_particles': lambda: logic.get_event_particles(
+                                lambda_1, subregions, model.copy(), level_limit),
+        'update_particle_states': lambda: logic.update_particle_states(model.copy(), supp),
+    }
+    if 'move_model_particles' in kernels:
+        vertices = logic.compute_available_vertices(model, bed, set_diam, level_limit,
+                                                    lifted_particles=event_ids)
+        calls['move_model_particles'] = lambda: logic.move_model_particles(
+                                hops.copy(), model.copy(), supp.copy(), bed, vertices, h)
+        moved, _ = calls['move_model_particles']()
+        final_x = moved[event_ids, 0]
+    else:
+        # Flux only depends on the positions, so fall back on the desired hops
+        final_x = hops[:,0]
+    calls['update_flux'] = lambda: logic.update_flux(initial_x, final_x, 0, subregions)
+    if 'set_model_particles' in kernels:
+        bare_vertices = logic.compute_available_vertices(np.empty((0, 7)), bed,
+                                                         set_diam, level_limit)
+        calls['set_model_particles'] = lambda: logic.set_model_particles(
+                                bed, bare_vertices, set_diam, state['pack_density'], h)
+    return {kernel: calls[kernel] for kernel in kernels}
+
+
+def time_call(call, budget, repeats):
+    """ Time call up to repeats times or until budget seconds are used,
+    at least once. Returns the per-call times in seconds. """
+    times = []
+    spent = 0
+    while len(times) < repeats and (not times or spent < budget):
+        tic = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - tic)
+        spent += times[-1]
+    return times
+
+
+def predict_time(sizes, times, size):
+    """ Predict the time of one call at size from the times measured
+    at the smaller sizes, extrapolating their scaling exponent. """
+    if not sizes:
+        return 0
+    exponent = DEFAULT_EXPONENT
+    if len(sizes) > 1:
+        exponent = max(fit_exponent(sizes[-2:], times[-2:]), 1)
+    return times[-1] * (size / sizes[-1]) ** exponent
+
+
+def fit_exponent(sizes, times):
+    """ Slope of log(time) against log(size), or None for < 2 sizes """
+    sizes, times = np.asarray(sizes, dtype=float), np.asarray(times, dtype=float)
+    keep = (sizes > 0) & (times > 0)
+    if np.unique(sizes[keep]).size < 2:
+        return None
+    slope, _ = np.polyfit(np.log(sizes[keep]), np.log(times[keep]), 1)
+    return float(slope)
+
+
+def main(x_maxes, level_limits, kernels, budget, repeats, seed):
+    """ Benchmark kernels on every (x_max, level_limit) state.
+
+    Keyword arguments:
+        x_maxes -- bed lengths to generate states for
+        level_limits -- level limits to generate states for
+        kernels -- names of the kernels to time
+        budget -- seconds each kernel may take per state; sizes
+                                predicted to take longer are skipped
+        repeats -- maximum number of calls timed per kernel and state
+        seed -- seed of the state generator
+
+    Returns:
+        results -- dictionary of the measurements and fitted exponents
+    """
+    measurements = []
+    for level_limit in level_limits:
+        measured = {kernel: ([], []) for kernel in kernels}
+        for x_max in sorted(x_maxes):
+            tic = time.perf_counter()
+            state = build_state(x_max, level_limit, seed=seed)
+            n_particles = state['model_particles'].shape[0]
+            print(f'x_max={x_max} level_limit={level_limit}: {n_particles} model particles '
+                  f'(built in {time.perf_counter() - tic:.2f}s)')
+            predicted = {kernel: predict_time(*measured[kernel], n_particles)
+                                                            for kernel in kernels}
+            runnable = [kernel for kernel in kernels if predicted[kernel] <= budget 
+                            and predicted.get(DEPENDS_ON.get(kernel), 0) <= budget]
+            calls = kernel_calls(state, runnable)
+            for kernel in kernels:
+                sizes, times = measured[kernel]
+                entry = {'kernel': kernel, 'x_max': x_max, 'level_limit': level_limit,
+                         'n_particles': n_particles, 'n_bed': state['bed_particles'].shape[0]}
+                if kernel not in runnable:
+                    reason = f'predicted {predicted[kernel]:.1f}s per call'
+                    if predicted[kernel] <= budget:
+                        reason = f'needs {DEPENDS_ON[kernel]}'
+                    print(f'    {kernel:<28}skipped ({reason})')
+                    entry.update({'skipped': True, 'predicted_seconds': predicted[kernel]})
+                    measurements.append(entry)
+                    continue
+                call_times = time_call(calls[kernel], budget, repeats)
+                sizes.append(n_particles)
+                times.append(float(np.median(call_times)))
+                print(f'    {kernel:<28}{np.median(call_times) * 1e3:>12.3f} ms'
+                      f'  ({len(call_times)} calls)')
+                entry.update({'skipped': False, 'calls': len(call_times),
+                              'median_seconds': float(np.median(call_times)),
+                              'min_seconds': float(np.min(call_times))})
+                measurements.append(entry)
+
+    scaling = []
+    for level_limit in level_limits:
+        for kernel in kernels:
+            rows = [m for m in measurements if m['kernel'] == kernel
+                        and m['level_limit'] == level_limit and not m['skipped']]
+            scaling.append({'kernel': kernel, 'level_limit': level_limit,
+                            'exponent': fit_exponent([m['n_particles'] for m in rows],
+                                                     [m['median_seconds'] for m in rows])})
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'seed': seed,
+            'budget_seconds': budget,
+            'measurements': measurements,
+            'scaling': scaling}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Time the logic.py kernels across problem sizes')
+    parser.add_argument('--x-max', type=int, nargs='+', default=X_MAX,
+                        help=f'Bed lengths to benchmark (default: {X_MAX})')
+    parser.add_argument('--level-limit', type=int, nargs='+', default=LEVEL_LIMITS,
+                        help=f'Level limits to benchmark (default: {LEVEL_LIMITS})')
+    parser.add_argument('--kernels', nargs='+', choices=KERNELS, default=KERNELS,
+                        help='Kernels to time (default: all)')
+    parser.add_argument('--budget', type=float, default=5.0,
+                        help='Seconds each kernel may take per size (default: 5)')
+    parser.add_argument('--repeats', type=int, default=20,
+                        help='Maximum calls timed per kernel and size (default: 20)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the state generator')
+    parser.add_argument('--output', default=Path(__file__).parent / 'output/bench-kernels.json',
+                        help='JSON file to write (default: model/output/bench-kernels.json)')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    results = main(args.x_max, args.level_limit, args.kernels, args.budget, args.repeats, args.seed)
+    print(f'\n{"kernel":<28}{"level_limit":>12}{"exponent":>10}')
+    for row in results['scaling']:
+        exponent = '-' if row['exponent'] is None else f'{row["exponent"]:.2f}'
+        print(f'{row["kernel"]:<28}{row["level_limit"]:>12}{exponent:>10}')
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
@@ -0,0 +1,197 @@
+"""
+A local SQLite catalog of model runs.
+
+Each run registers its parameters, seed, engine, code version, timing,
+output files and a few summary metrics, so runs can be found without
+opening every output file:
+
+    python catalog.py query sigma=0.5 level_limit=3 "n_iterations>100000"
+
+prints the output files of every matching run, one per line.
+"""
+import json
+import sqlite3
+import argparse
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created TEXT,
+    seed INTEGER,
+    engine TEXT,
+    code_version TEXT,
+    wall_time REAL,
+    iterations_per_second REAL,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS params (run_id TEXT, key TEXT, value);
+CREATE TABLE IF NOT EXISTS metrics (run_id TEXT, name TEXT, value REAL);
+CREATE TABLE IF NOT EXISTS outputs (run_id TEXT, path TEXT);
+CREATE INDEX IF NOT EXISTS params_key_value ON params (key, value);
+CREATE INDEX IF NOT EXISTS metrics_name_value ON metrics (name, value);
+CREATE INDEX IF NOT EXISTS outputs_run_id ON outputs (run_id);
+'''
+
+RUN_COLUMNS = ['run_id', 'created', 'seed', 'engine', 'code_version',
+                'wall_time', 'iterations_per_second']
+
+OPERATORS = ['<=', '>=', '!=', '=', '<', '>']
+
+
+class Catalog():
+    """ A catalog of runs stored in the SQLite database at path.
+
+    Several processes may register runs in the same catalog at
+    once; writers wait up to timeout seconds for each other.
+    """
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.connection = sqlite3.connect(str(path), timeout=timeout)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def register(self, run_id, parameters, output_paths, seed, engine, code_version,
+                    wall_time, iterations_per_second, metrics):
+        """ Add a run to the catalog, replacing any earlier entry
+        with the same run_id.
+
+        Keyword arguments:
+            run_id -- the run's ID
+            parameters -- dictionary of parameters used by the run
+            output_paths -- list of files/directories the run wrote
+            seed -- the seed of the run's random number generators
+            engine -- name of the simulation engine
+            code_version -- version (e.g. git commit) of the model code
+            wall_time -- wall time of the run in seconds
+            iterations_per_second -- throughput of the entrainment loop
+            metrics -- dictionary of summary metric names to values
+        """
+        with self.connection:
+            for table in ['runs', 'params', 'metrics', 'outputs']:
+                self.connection.execute(f'DELETE FROM {table} WHERE run_id = ?', (run_id,))
+            self.connection.execute(
+                'INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (run_id, datetime.now().isoformat(timespec='seconds'), int(seed), engine,
+                 code_version, float(wall_time), float(iterations_per_second),
+                 json.dumps(parameters, default=str)))
+            self.connection.executemany(
+                'INSERT INTO params VALUES (?, ?, ?)',
+                [(run_id, key, to_sql_value(value)) for key, value in parameters.items()])
+            self.connection.executemany(
+                'INSERT INTO metrics VALUES (?, ?, ?)',
+                [(run_id, name, float(value)) for name, value in metrics.items()])
+            self.connection.executemany(
+                'INSERT INTO outputs VALUES (?, ?)',
+                [(run_id, str(path)) for path in output_paths])
+
+    def query(self, conditions=()):
+        """ Return the runs matching every condition as a list of
+        dictionaries (the run columns plus params, metrics and outputs).
+
+        Each condition is a string 'name<op>value' with op one of
+        =, !=, <, <=, >, >=. The name may be a run column (seed,
+        wall_time, ...), a summary metric or a parameter.
+        """
+        clauses, arguments = [], []
+        for condition in conditions:
+            name, operator, value = parse_condition(condition)
+            if name in RUN_COLUMNS:
+                clauses.append(f'runs.{name} {operator} ?')
+            else:
+                clauses.append(
+                    f'(EXISTS (SELECT 1 FROM params WHERE params.run_id = runs.run_id '
+                    f'AND params.key = ? AND params.value {operator} ?) '
+                    f'OR EXISTS (SELECT 1 FROM metrics WHERE metrics.run_id = runs.run_id '
+                    f'AND metrics.name = ? AND metrics.value {operator} ?))')
+                arguments.extend([name, value, name])
+            arguments.append(value)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self.connection.execute(
+                    f'SELECT {", ".join(RUN_COLUMNS)}, params FROM runs {where} '
+                    f'ORDER BY created', arguments).fetchall()
+        runs = []
+        for row in rows:
+            run = dict(zip(RUN_COLUMNS, row))
+            run['params'] = json.loads(row[-1])
+            run['metrics'] = dict(self.connection.execute(
+                    'SELECT name, value FROM metrics WHERE run_id = ?', (run['run_id'],)))
+            run['outputs'] = [path for path, in self.connection.execute(
+                    'SELECT path FROM outputs WHERE run_id = ?', (run['run_id'],))]
+            runs.append(run)
+        return runs
+
+    def files(self, conditions=()):
+        """ Return the output files of every run matching conditions """
+        return [path for run in self.query(conditions) for path in run['outputs']]
+
+
+def summary_metrics(subregions, particle_age_array):
+    """ Return the summary metrics registered for a run: the mean
+    flux of each subregion and the final and mean average age, over
+    the iterations in particle_age_array. """
+    iterations = len(particle_age_array)
+    metrics = {f'mean_flux_{subregion.getName()}': 
+                                np.mean(subregion.getFluxList()[:iterations])
+                                                        for subregion in subregions}
+    metrics['final_avg_age'] = particle_age_array[-1]
+    metrics['mean_avg_age'] = np.mean(particle_age_array)
+    return metrics
+
+
+def to_sql_value(value):
+    """ Store numbers and strings as is, anything else as JSON """
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    return json.dumps(value)
+
+
+def parse_condition(condition):
+    """ Split 'name<op>value' into name, operator and a typed value """
+    for operator in OPERATORS:
+        name, found, value = condition.partition(operator)
+        if found:
+            break
+    else:
+        raise ValueError(f'Condition {condition} has no operator, expected one of {OPERATORS}')
+    value = value.strip()
+    for cast in [int, float]:
+        try:
+            return name.strip(), operator, cast(value)
+        except ValueError:
+            pass
+    if value.lower() in ['true', 'false']:
+        return name.strip(), operator, value.lower() == 'true'
+    return name.strip(), operator, value
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Query the catalog of model runs')
+    parser.add_argument('--catalog', default=Path(__file__).parent / 'output/catalog.sqlite', 
+                        help='Path to the catalog database (default: model/output/catalog.sqlite)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    query = subparsers.add_parser('query', help='List the output files of runs matching every condition')
+    query.add_argument('conditions', nargs='*', help="Conditions such as sigma=0.5 or 'n_iterations>100000'")
+    query.add_argument('--format', choices=['paths', 'runs', 'json'], default='paths',
+                        help='Print output paths (default), one line per run, or full JSON entries')
+    args = parser.parse_args()
+    return args.catalog, args.conditions, args.format
+
+if __name__ == '__main__':
+    catalog_path, conditions, output_format = parse_arguments()
+    catalog = Catalog(catalog_path)
+    if output_format == 'paths':
+        for path in catalog.files(conditions):
+            print(path)
+    elif output_format == 'runs':
+        for run in catalog.query(conditions):
+            print(f'{run["run_id"]}  {run["created"]}  seed={run["seed"]}  '
+                  f'{run["iterations_per_second"]:.1f} it/s  {" ".join(run["outputs"])}')
+    else:
+        print(json.dumps(catalog.query(conditions), indent=2))
+    catalog.close()
@@ -0,0 +1,63 @@
+"""
+Aggregated diagnostics of a run.
+
+Rather than logging a line per entrained particle, the entrainment
+loop counts what happens in a Counter (see logic.get_event_particles
+and logic.move_model_particles):
+
+    events_requested   events requested, summed over the subregions
+    forced_events      events added where the request was 0, one per subregion
+    events             particles selected for entrainment
+    event_mismatches   subregions where the selection differed from the request
+    hops               particles moved to a vertex
+    loops              particles which left the stream
+
+Every interval iterations one structured line with the counts since
+the previous line is logged to the 'diagnostics' logger, e.g.
+
+    INFO - {"iteration": 999, "iterations": 1000, "events": 5105, "hops": 4977, ...}
+
+The per-particle messages are only formatted and logged at DEBUG
+level (run.py --debug).
+"""
+import json
+import logging
+from collections import Counter
+
+
+class Diagnostics():
+    """ Counters of the entrainment loop, logged periodically.
+
+    Keyword arguments:
+        interval -- iterations between log lines, 0 to only keep totals
+        logger -- logger to write to (default: the 'diagnostics' logger)
+    """
+    def __init__(self, interval, logger=None):
+        self.interval = interval
+        self.logger = logger if logger is not None else logging.getLogger('diagnostics')
+        self.counters = Counter()
+        self.totals = Counter()
+        self.iterations = 0
+
+    def end_iteration(self, iteration):
+        """ Count an iteration and log the counters every interval iterations """
+        self.iterations += 1
+        if self.interval > 0 and (iteration + 1) % self.interval == 0:
+            self.flush(iteration)
+
+    def flush(self, iteration):
+        """ Log the counters since the last flush, add them to the totals
+        and reset them """
+        if self.iterations == 0:
+            return
+        if self.logger.isEnabledFor(logging.INFO):
+            line = dict(iteration=iteration, iterations=self.iterations,
+                        **{name: self.counters[name] for name in sorted(self.counters)})
+            self.logger.info(json.dumps(line))
+        self.totals.update(self.counters)
+        self.counters.clear()
+        self.iterations = 0
+
+    def results(self):
+        """ Return the totals over the run, for the sinks """
+        return dict(self.totals + self.counters)
@@ -0,0 +1,108 @@
+"""
+Ensemble-level views over per-run output files.
+
+An ensemble of runs writes one {prefix}-{run_id}.hdf5 file per run.
+build_virtual_view writes a single master file which stacks every
+run's final_metrics into (n_runs, n_iterations) HDF5 virtual datasets,
+so ensemble statistics are one sliced read and no data is copied:
+
+/final_metrics/subregions/<name>-flux   (n_runs, n_iterations), missing = -1
+/final_metrics/avg_age                  (n_runs, n_iterations), missing = nan
+/final_metrics/age_range                (n_runs, n_iterations), missing = nan
+/runs/run_id, /runs/file                (n_runs,)
+/params/<key>                           (n_runs,) one entry per run
+"""
+import os
+import argparse
+import numpy as np
+import h5py
+
+
+FILL_VALUES = {'i': -1, 'u': 0, 'f': np.nan}
+
+def build_virtual_view(run_files, master_path, run_ids=None):
+    """ Write a master file of virtual datasets over run_files.
+
+    Runs may differ in length or number of subregions; the view
+    is as long as the longest run and covers every subregion seen,
+    with the missing entries set to the fill value. Source files are
+    referenced relative to the master file, so the two should be
+    kept together.
+
+    Keyword arguments:
+        run_files -- list of paths to per-run output files
+        master_path -- path of the master file to write
+        run_ids -- optional list of run IDs, one per file
+
+    Returns:
+        master_path -- path of the master file
+    """
+    if run_ids is None:
+        run_ids = [os.path.splitext(os.path.basename(path))[0] for path in run_files]
+    master_dir = os.path.dirname(os.path.abspath(master_path))
+
+    # Gather the shape of every final_metrics dataset and every parameter
+    datasets = {}
+    params = []
+    for row, path in enumerate(run_files):
+        with h5py.File(path, 'r') as f:
+            def add_source(name, obj):
+                if isinstance(obj, h5py.Dataset):
+                    datasets.setdefault(name, []).append((row, path, obj.shape, obj.dtype))
+            f['final_metrics'].visititems(add_source)
+            params.append({key: f['params'][key][()] for key in f['params']})
+
+    n_runs = len(run_files)
+    with h5py.File(master_path, 'w', libver='latest') as master:
+        grp_final = master.create_group('final_metrics')
+        for name, sources in datasets.items():
+            length = max(shape[0] for _, _, shape, _ in sources)
+            dtype = sources[0][3]
+            layout = h5py.VirtualLayout(shape=(n_runs, length), dtype=dtype)
+            for row, path, shape, _ in sources:
+                source = h5py.VirtualSource(os.path.relpath(path, master_dir),
+                                            f'final_metrics/{name}', shape=shape)
+                layout[row, :shape[0]] = source
+            grp_final.create_virtual_dataset(name, layout, fillvalue=FILL_VALUES[dtype.kind])
+
+        grp_runs = master.create_group('runs')
+        grp_runs.create_dataset('run_id', data=np.array(run_ids, dtype=object),
+                                dtype=h5py.special_dtype(vlen=str))
+        grp_runs.create_dataset('file', data=np.array([os.path.relpath(path, master_dir)
+                                                        for path in run_files], dtype=object),
+                                dtype=h5py.special_dtype(vlen=str))
+        write_param_table(master.create_group('params'), params)
+    return master_path
+
+
+def write_param_table(group, params):
+    """ Write one dataset per parameter key with one entry per run.
+    Numeric parameters missing from a run are nan, strings are ''. """
+    keys = sorted(set(key for run_params in params for key in run_params))
+    for key in keys:
+        values = [run_params.get(key) for run_params in params]
+        present = [value for value in values if value is not None]
+        if all(np.ndim(value) == 0 and np.asarray(value).dtype.kind in 'biuf'
+                                                                for value in present):
+            column = np.array([np.nan if value is None else value for value in values],
+                                dtype=float if None in values else None)
+            group.create_dataset(key, data=column)
+        else:
+            column = [b'' if value is None else value for value in values]
+            column = [value.decode() if isinstance(value, bytes) else str(value)
+                                                                for value in column]
+            group.create_dataset(key, data=np.array(column, dtype=object),
+                                    dtype=h5py.special_dtype(vlen=str))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Build a master file of virtual datasets over per-run output files')
+    parser.add_argument('master', help='Path of the master file to write')
+    parser.add_argument('run_files', nargs='+', help='Per-run hdf5 output files')
+    args = parser.parse_args()
+    return args.master, args.run_files
+
+if __name__ == '__main__':
+    master_path, run_files = parse_arguments()
+    build_virtual_view(run_files, master_path)
+    print(f'Wrote ensemble view of {len(run_files)} runs to {master_path}')
@@ -0,0 +1,190 @@
+"""
+Dry-run resource estimates for a parameter file.
+
+The parameters are validated and the stream is built as for a real
+run, then a short calibration burst of iterations is timed and a few
+snapshots are written through the requested output sinks into a
+temporary directory. From these the wall time, peak memory and output
+size of the full run are extrapolated, and the output size is checked
+against the free space where the run would write:
+
+    python run.py param.yaml --dry-run
+"""
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import numpy as np
+from pathlib import Path
+
+import run
+import sinks as sinks_module
+from progress import path_size, current_rss
+
+
+BURST_ITERATIONS = 50
+BURST_SECONDS = 10
+SNAPSHOT_SAMPLES = 5
+
+
+def estimate(param_path, burst_iterations=BURST_ITERATIONS, burst_seconds=BURST_SECONDS):
+    """ Estimate the resources a run of the parameters in param_path needs.
+
+    Keyword arguments:
+        param_path -- path to the parameter file
+        burst_iterations -- maximum number of iterations timed
+        burst_seconds -- stop timing iterations after this many seconds
+
+    Returns:
+        estimate -- dictionary of the measurements and predictions:
+                    wall_time (seconds), peak_memory and output_bytes
+                    (bytes), free_bytes where the output is written and
+                    fits_on_disk
+    """
+    logConf_path, _, schema_path, _ = run.get_relative_paths()
+    parameters = run.load_parameters(param_path, schema_path)
+    run.seed_generators(parameters)
+    n_iterations = parameters['n_iterations']
+    interval = parameters['data_save_interval']
+    n_snapshots = n_iterations // interval if interval > 0 else 0
+    burst_iterations = min(burst_iterations, n_iterations)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Log as a real run does, so the burst pays the same logging cost
+        run.configure_logging('dry-run', logConf_path, tmp)
+        try:
+            tic = time.perf_counter()
+            h = run.compute_h(parameters['set_diam'])
+            # Flux arrays only as long as the burst, the full ones are estimated
+            bed_particles, model_particles, model_supp, subregions = run.build_stream(
+                                dict(parameters, n_iterations=burst_iterations), h)
+            build_seconds = time.perf_counter() - tic
+
+            iteration_times = []
+            for iteration in range(burst_iterations):
+                tic = time.perf_counter()
+                _, model_particles, model_supp, subregions = run.run_iteration(
+                                parameters, model_particles, model_supp, bed_particles,
+                                subregions, iteration, h)
+                iteration_times.append(time.perf_counter() - tic)
+                if sum(iteration_times) > burst_seconds:
+                    break
+        finally:
+            for handler in logging.getLogger().handlers:
+                handler.close()
+        sample = sample_output(parameters, bed_particles, model_particles, tmp)
+    burst_peak = peak_rss()
+
+    seconds_per_iteration = float(np.mean(iteration_times))
+    names = parameters.get('output_sinks', ['hdf5'])
+    n_file_sinks = len([name for name in names if name != 'null'])
+    # Flux per subregion, average age and age range, one value per iteration
+    metrics_bytes = n_iterations * (parameters['num_subregions'] + 2) * 8
+    record_bytes = estimate_record_bytes(parameters, model_particles)
+
+    output_bytes = (sample['fixed_bytes'] + sample['bytes_per_snapshot'] * n_snapshots
+                    + n_file_sinks * (metrics_bytes + record_bytes))
+    peak_memory = burst_peak + metrics_bytes
+
+    output_path = run.get_output_path(parameters, param_path)
+    free_bytes = shutil.disk_usage(existing_parent(output_path)).free
+    return {'param_path': str(param_path),
+            'output_path': str(output_path),
+            'n_iterations': n_iterations,
+            'n_model_particles': model_particles.shape[0],
+            'n_snapshots': n_snapshots,
+            'build_seconds': build_seconds,
+            'burst_iterations': len(iteration_times),
+            'seconds_per_iteration': seconds_per_iteration,
+            'seconds_per_snapshot': sample['seconds_per_snapshot'],
+            'bytes_per_snapshot': sample['bytes_per_snapshot'],
+            'wall_time': (build_seconds + n_iterations * seconds_per_iteration
+                          + n_snapshots * sample['seconds_per_snapshot']),
+            'peak_memory': peak_memory,
+            'output_bytes': output_bytes,
+            'free_bytes': free_bytes,
+            'fits_on_disk': output_bytes < free_bytes}
+
+
+def sample_output(parameters, bed_particles, model_particles, directory):
+    """ Write one and then 1 + SNAPSHOT_SAMPLES snapshots through the
+    requested sinks, returning the fixed size of their output, the size
+    and the write time of each further snapshot. """
+    names = parameters.get('output_sinks', ['hdf5'])
+    sizes, times = [], []
+    for count in [1, 1 + SNAPSHOT_SAMPLES]:
+        sample_parameters = dict(parameters, n_iterations=count, data_save_interval=1)
+        sinks = sinks_module.build_sinks(names, Path(directory) / f'sample-{count}', 'dry-run')
+        output = sinks_module.MultiSink(sinks)
+        output.open('dry-run', sample_parameters, bed_particles, model_particles)
+        tic = time.perf_counter()
+        for iteration in range(count):
+            if output.wants_snapshots:
+                output.write_snapshot(iteration, model_particles, np.arange(10))
+        times.append(time.perf_counter() - tic)
+        output.close()
+        sizes.append(sum(path_size(path) for path in output.paths()))
+    bytes_per_snapshot = (sizes[1] - sizes[0]) / SNAPSHOT_SAMPLES
+    return {'fixed_bytes': sizes[0] - bytes_per_snapshot,
+            'bytes_per_snapshot': bytes_per_snapshot,
+            'seconds_per_snapshot': max(times[1] - times[0], 0) / SNAPSHOT_SAMPLES}
+
+
+def estimate_record_bytes(parameters, model_particles):
+    """ Uncompressed size of the window and tracer records of a run """
+    n_iterations = parameters['n_iterations']
+    num_particles, width = model_particles.shape
+    particles_per_record = []
+    for x_min, x_max in parameters.get('window_bounds', []):
+        fraction = min(max(x_max - x_min, 0) / parameters['x_max'], 1)
+        particles_per_record.append((fraction * num_particles,
+                                     parameters.get('window_interval', 1)))
+    tracers = len(parameters.get('tracer_ids', [])) or parameters.get('tracer_count', 0)
+    if tracers:
+        particles_per_record.append((tracers, parameters.get('tracer_interval', 1)))
+    return int(sum(count * width * 8 * (n_iterations // interval)
+                        for count, interval in particles_per_record))
+
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes. Without the
+    POSIX-only resource module this is the current size, or 0. """
+    try:
+        import resource
+    except ImportError:
+        return current_rss() or 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * \
+                                (1 if sys.platform == 'darwin' else 1024)
+
+
+def existing_parent(path):
+    """ Return path, or its closest ancestor that exists """
+    path = Path(path).resolve()
+    while not path.exists():
+        path = path.parent
+    return path
+
+
+def format_bytes(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TiB'
+
+
+def format_estimate(estimate):
+    """ Return a readable summary of an estimate """
+    return '\n'.join([
+        f'Dry run of {estimate["param_path"]}:',
+        f'    {estimate["n_model_particles"]} model particles, {estimate["n_iterations"]} '
+        f'iterations, {estimate["n_snapshots"]} snapshots',
+        f'    calibrated on {estimate["burst_iterations"]} iterations: '
+        f'{estimate["seconds_per_iteration"] * 1e3:.2f} ms per iteration, '
+        f'{format_bytes(estimate["bytes_per_snapshot"])} per snapshot',
+        f'    predicted wall time:   {estimate["wall_time"]:.0f} s '
+        f'({estimate["wall_time"] / 3600:.2f} h)',
+        f'    predicted peak memory: {format_bytes(estimate["peak_memory"])}',
+        f'    predicted output:      {format_bytes(estimate["output_bytes"])} in '
+        f'{estimate["output_path"]} ({format_bytes(estimate["free_bytes"])} free)'])
@@ -0,0 +1,81 @@
+"""
+Snapshot filters for selective recording.
+
+A filter picks a subset of the model particles to record on its own
+interval, independent of the full snapshots taken every
+data_save_interval iterations. Each filter is recorded under its name
+through the output sinks' write_record.
+"""
+import numpy as np
+
+
+class WindowFilter():
+    """ Record the model particles whose centre lies inside
+    [x_min, x_max] every interval iterations. """
+    def __init__(self, name, x_min, x_max, interval):
+        self.name = name
+        self.x_min = x_min
+        self.x_max = x_max
+        self.interval = interval
+
+    def due(self, iteration):
+        return (iteration + 1) % self.interval == 0
+
+    def select(self, model_particles):
+        x = model_particles[:,0]
+        return model_particles[(x >= self.x_min) & (x <= self.x_max)]
+
+
+class TracerFilter():
+    """ Record a fixed set of model particles (by id) every
+    interval iterations. """
+    def __init__(self, name, ids, interval):
+        self.name = name
+        self.ids = np.sort(np.asarray(ids, dtype=np.intp))
+        self.interval = interval
+
+    def due(self, iteration):
+        return (iteration + 1) % self.interval == 0
+
+    def select(self, model_particles):
+        return model_particles[self.ids]
+
+
+def build_filters(parameters, model_particles):
+    """ Build the snapshot filters requested in the parameters.
+
+    Each [x_min, x_max] pair in window_bounds becomes a WindowFilter
+    named window-<k>. Tracers are either the ids listed in tracer_ids
+    or tracer_count ids chosen at random from the model particles,
+    recorded as a TracerFilter named tracers.
+
+    Keyword arguments:
+        parameters -- dictionary of parameters passed for the model
+        model_particles -- array of all model particles
+
+    Returns:
+        filters -- list of filter objects
+    """
+    filters = []
+    for idx, (x_min, x_max) in enumerate(parameters.get('window_bounds', [])):
+        if x_min > x_max:
+            raise ValueError(f'Window {idx} has x_min > x_max ({x_min} > {x_max})')
+        filters.append(WindowFilter(f'window-{idx}', x_min, x_max,
+                                    parameters.get('window_interval', 1)))
+
+    num_particles = model_particles.shape[0]
+    if 'tracer_ids' in parameters:
+        tracer_ids = np.unique(parameters['tracer_ids'])
+        if tracer_ids.size and (tracer_ids.min() < 0 or tracer_ids.max() >= num_particles):
+            raise ValueError(f'Tracer ids must be between 0 and {num_particles - 1}')
+    elif 'tracer_count' in parameters:
+        if parameters['tracer_count'] > num_particles:
+            raise ValueError(f'Requested {parameters["tracer_count"]} tracers but '
+                             f'there are only {num_particles} model particles')
+        tracer_ids = np.random.choice(num_particles, parameters['tracer_count'], replace=False)
+    else:
+        tracer_ids = []
+    if len(tracer_ids) > 0:
+        filters.append(TracerFilter('tracers', tracer_ids, parameters.get('tracer_interval', 1)))
+
+    return filters
@@ -0,0 +1,282 @@
+"""
+Statistics of flux (crossing count) series.
+
+Every function works on arrays of shape (..., n_iterations), e.g. one
+series per subregion, per run or both, and treats the leading axes as
+independent series:
+
+    poisson_fit             MLE rate, its standard error and log-likelihood
+    negative_binomial_fit   MLE mean and dispersion k (variance = mean + mean^2 / k)
+    dispersion_index        variance / mean, with a chi-square test against Poisson
+    autocorrelation         by FFT, normalised to 1 at lag 0
+    power_spectrum          one-sided periodogram by FFT
+    bin_spectrum            periodogram averaged over logarithmic frequency bands
+    block_averages          means over blocks of several sizes, with the
+                            standard error of the overall mean at each size
+    cumulative
+
+summarise computes all of them at once and flux_stats.py writes them
+for a set of run files. So that the summary stays much smaller than
+the series, the spectrum is binned and the cumulative flux kept every
+cumulative_step iterations:
+
+    python3 flux_stats.py OUTPUT_FILE RUN_FILE...
+"""
+import argparse
+import numpy as np
+import h5py
+from scipy import special
+from scipy import stats as scipy_stats
+
+
+SCALES = [10, 100, 1000]
+
+
+def poisson_fit(counts):
+    """ Maximum likelihood Poisson fit of each series.
+
+    Returns:
+        dictionary of rate, rate_se (standard error of the rate) and
+        log_likelihood, each of shape counts.shape[:-1]
+    """
+    counts = np.asarray(counts, dtype=float)
+    n = counts.shape[-1]
+    rate = counts.mean(axis=-1)
+    log_likelihood = (special.xlogy(counts, rate[..., np.newaxis]) - rate[..., np.newaxis]
+                      - special.gammaln(counts + 1)).sum(axis=-1)
+    return {'rate': rate, 'rate_se': np.sqrt(rate / n), 'log_likelihood': log_likelihood}
+
+
+def negative_binomial_fit(counts, iterations=100):
+    """ Maximum likelihood negative binomial fit of each series.
+
+    The mean is the sample mean; the dispersion k solves the score
+    equation by bisection on log k, for every series at once, using the
+    histogram of each series rather than every entry. Series with no
+    overdispersion (variance <= mean) get k = inf, the Poisson limit.
+
+    Keyword arguments:
+        counts -- non-negative integer array of shape (..., n_iterations)
+        iterations -- bisection steps
+
+    Returns:
+        dictionary of mean, dispersion (k), variance and log_likelihood,
+        each of shape counts.shape[:-1]
+    """
+    counts = np.asarray(counts)
+    shape = counts.shape[:-1]
+    flat = counts.reshape(-1, counts.shape[-1]).astype(np.int64)
+    n = flat.shape[1]
+    mean = flat.mean(axis=1)
+    # Histogram of each series: histogram[s, v] = entries of series s equal to v
+    values = np.arange(flat.max() + 1 if flat.size else 1)
+    rows = np.arange(flat.shape[0])[:, np.newaxis] * values.size
+    histogram = np.bincount((rows + flat).ravel(),
+                            minlength=flat.shape[0] * values.size).reshape(-1, values.size)
+
+    def score(k):
+        k = k[:, np.newaxis]
+        return ((histogram * (special.digamma(values + k) - special.digamma(k))).sum(axis=1)
+                + n * np.log(k[:, 0] / (k[:, 0] + mean)))
+
+    low = np.full(flat.shape[0], np.log(1e-6))
+    high = np.full(flat.shape[0], np.log(1e6))
+    overdispersed = (flat.var(axis=1, ddof=1) > mean) & (score(np.exp(high)) < 0)
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        positive = score(np.exp(middle)) > 0
+        low = np.where(positive, middle, low)
+        high = np.where(positive, high, middle)
+    k = np.where(overdispersed, np.exp((low + high) / 2), np.inf)
+
+    finite_k = np.where(overdispersed, k, 1.0)[:, np.newaxis]
+    nb_log_likelihood = (special.gammaln(flat + finite_k) - special.gammaln(finite_k)
+                         - special.gammaln(flat + 1)
+                         + finite_k * np.log(finite_k / (finite_k + mean[:, np.newaxis]))
+                         + special.xlogy(flat, mean[:, np.newaxis] / (finite_k + mean[:, np.newaxis]))
+                         ).sum(axis=1)
+    log_likelihood = np.where(overdispersed, nb_log_likelihood,
+                              poisson_fit(flat)['log_likelihood'])
+    return {'mean': mean.reshape(shape),
+            'dispersion': k.reshape(shape),
+            'variance': (mean + np.square(mean) / k).reshape(shape),
+            'log_likelihood': log_likelihood.reshape(shape)}
+
+
+def dispersion_index(counts):
+    """ Index of dispersion (variance / mean) of each series, 1 for a
+    Poisson process, with the chi-square statistic (n - 1) * index and
+    its upper tail p-value under the Poisson hypothesis.
+
+    Returns:
+        dictionary of index, statistic and p_value
+    """
+    counts = np.asarray(counts, dtype=float)
+    n = counts.shape[-1]
+    mean = counts.mean(axis=-1)
+    index = np.divide(counts.var(axis=-1, ddof=1), mean,
+                      out=np.full(mean.shape, np.nan), where=mean > 0)
+    statistic = (n - 1) * index
+    return {'index': index, 'statistic': statistic,
+            'p_value': scipy_stats.chi2.sf(statistic, n - 1)}
+
+
+def autocorrelation(series, max_lag=None):
+    """ Autocorrelation of each series at lags 0 to max_lag (default:
+    n_iterations - 1), computed by FFT in O(n log n). Constant series
+    are nan. """
+    series = np.asarray(series, dtype=float)
+    n = series.shape[-1]
+    max_lag = n - 1 if max_lag is None else min(max_lag, n - 1)
+    centred = series - series.mean(axis=-1, keepdims=True)
+    # Zero pad to avoid circular wrap-around
+    size = 1 << int(np.ceil(np.log2(2 * n - 1))) if n > 1 else 1
+    spectrum = np.fft.rfft(centred, n=size, axis=-1)
+    covariance = np.fft.irfft(np.square(np.abs(spectrum)), n=size, axis=-1)[..., :max_lag + 1]
+    variance = covariance[..., :1]
+    return np.divide(covariance, variance, out=np.full(covariance.shape, np.nan),
+                     where=variance > 1e-12 * n)
+
+
+def power_spectrum(series):
+    """ One-sided periodogram of each series (mean removed).
+
+    Returns:
+        frequency -- (n_iterations // 2 + 1,) in cycles per iteration
+        power -- (..., n_iterations // 2 + 1) power spectral density
+    """
+    series = np.asarray(series, dtype=float)
+    n = series.shape[-1]
+    centred = series - series.mean(axis=-1, keepdims=True)
+    power = np.square(np.abs(np.fft.rfft(centred, axis=-1))) / n
+    # Every frequency but 0 and Nyquist stands for its negative twin too
+    power[..., 1:(n + 1) // 2] *= 2
+    return np.fft.rfftfreq(n), power
+
+
+def bin_spectrum(frequency, power, n_bins):
+    """ Average a periodogram over n_bins logarithmically spaced
+    frequency bands, leaving out frequency 0. Empty bands are dropped.
+
+    Returns:
+        frequency -- (n,) mean frequency of each band
+        power -- (..., n) mean power in each band
+    """
+    frequency, power = frequency[1:], power[..., 1:]
+    if frequency.size == 0:
+        return frequency, power
+    edges = np.geomspace(frequency[0], frequency[-1], n_bins + 1)
+    band = np.clip(np.searchsorted(edges, frequency, side='right') - 1, 0, n_bins - 1)
+    counts = np.bincount(band, minlength=n_bins)
+    starts = np.searchsorted(band, np.arange(n_bins))[counts > 0]
+    counts = counts[counts > 0]
+    return (np.add.reduceat(frequency, starts) / counts,
+            np.add.reduceat(power, starts, axis=-1) / counts)
+
+
+def block_averages(series, scales=SCALES):
+    """ Means of each series over consecutive blocks of each size in
+    scales (the last partial block is dropped), and the standard error
+    of the overall mean estimated from them. The standard error levels
+    off once blocks are longer than the correlation time.
+
+    Returns:
+        dictionary keyed by block size, each a dictionary of means
+        (..., n_blocks) and standard_error (...)
+    """
+    series = np.asarray(series, dtype=float)
+    n = series.shape[-1]
+    blocks = {}
+    for scale in scales:
+        n_blocks = n // scale
+        if n_blocks < 2:
+            continue
+        means = series[..., :n_blocks * scale].reshape(
+                                    series.shape[:-1] + (n_blocks, scale)).mean(axis=-1)
+        blocks[scale] = {'means': means,
+                         'standard_error': means.std(axis=-1, ddof=1) / np.sqrt(n_blocks)}
+    return blocks
+
+
+def cumulative(series):
+    """ Cumulative sum of each series """
+    return np.cumsum(series, axis=-1)
+
+
+def summarise(counts, scales=SCALES, max_lag=1000, spectrum_bins=100, cumulative_step=100):
+    """ Return every statistic of the count series as a nested dictionary.
+
+    Keyword arguments:
+        counts -- array of shape (..., n_iterations)
+        scales -- block sizes of the block averages
+        max_lag -- largest lag of the autocorrelation
+        spectrum_bins -- number of frequency bands of the spectrum, or
+                         0 for the full periodogram
+        cumulative_step -- iterations between the cumulative flux values
+                           kept; the totals are always kept
+    """
+    frequency, power = power_spectrum(counts)
+    if spectrum_bins > 0:
+        frequency, power = bin_spectrum(frequency, power, spectrum_bins)
+    n = counts.shape[-1]
+    return {'poisson': poisson_fit(counts),
+            'negative_binomial': negative_binomial_fit(counts),
+            'dispersion': dispersion_index(counts),
+            'autocorrelation': autocorrelation(counts, max_lag),
+            'spectrum': {'frequency': frequency, 'power': power},
+            'blocks': {f'scale-{scale}': block for scale, block
+                                                in block_averages(counts, scales).items()},
+            'cumulative': {'iteration': np.arange(cumulative_step - 1, n, cumulative_step),
+                           'flux': cumulative(counts)[..., cumulative_step - 1::cumulative_step],
+                           'total': np.sum(counts, axis=-1)}}
+
+
+#############################################################################
+# Helper functions
+#############################################################################
+
+def read_flux(run_files):
+    """ Read the flux of every subregion of run_files into a
+    (n_runs, n_subregions, n_iterations) array, cut to the shortest run.
+
+    Returns:
+        flux -- the array
+        names -- names of the subregion series
+    """
+    series = []
+    for path in run_files:
+        with h5py.File(path, 'r') as f:
+            grp = f['final_metrics/subregions']
+            names = sorted(grp, key=lambda name: int(name.split('-')[1]))
+            series.append([grp[name][()] for name in names])
+    length = min(len(flux) for run in series for flux in run)
+    return np.array([[flux[:length] for flux in run] for run in series]), names
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Fit and summarise the flux series of run files')
+    parser.add_argument('output', help='Path of the hdf5 file to write')
+    parser.add_argument('run_files', nargs='+', help='Per-run hdf5 output files')
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help='Block sizes of the block averages')
+    parser.add_argument('--max-lag', type=int, default=1000, help='Largest lag of the autocorrelation')
+    parser.add_argument('--spectrum-bins', type=int, default=100,
+                        help='Logarithmic frequency bands of the power spectrum, 0 for the full periodogram')
+    parser.add_argument('--cumulative-step', type=int, default=100,
+                        help='Iterations between the cumulative flux values written')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    # Imported here so the statistics stay importable from the model package
+    from sinks import write_nested
+    args = parse_arguments()
+    flux, names = read_flux(args.run_files)
+    with h5py.File(args.output, 'w') as f:
+        f.create_dataset('runs/file', data=np.array(args.run_files, dtype=object),
+                            dtype=h5py.special_dtype(vlen=str))
+        f.create_dataset('subregions', data=np.array(names, dtype=object),
+                            dtype=h5py.special_dtype(vlen=str))
+        write_nested(f, summarise(flux, args.scales, args.max_lag, args.spectrum_bins,
+                                  args.cumulative_step))
+    print(f'Wrote flux statistics of {flux.shape[0]} runs x {flux.shape[1]} subregions '
+          f'x {flux.shape[2]} iterations to {args.output}')
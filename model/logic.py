@@ -1,6 +1,7 @@
 import math
 import random
 import numpy as np
+from scipy.special import ndtri
 
 
 import logging
@@ -38,20 +39,50 @@ class Subregion():
     def getFluxList(self):
         return self.flux_list
 
-def get_event_particles(e_events, subregions, model_particles, level_limit, height_dependant=False):
+class Gauges():
+    """ Virtual gauges at arbitrary cross-sections of the stream.
+
+    Counts, per iteration, the particles crossing each gauge
+    position, independently of the subregions.
+    """
+    def __init__(self, positions, iterations):
+        self.positions = np.asarray(positions, dtype=float)
+        self.counts = np.zeros((self.positions.size, iterations), dtype=np.int64)
+
+    def getPositions(self):
+        return self.positions
+
+    def getCountList(self, gauge):
+        return self.counts[gauge]
+
+
+def get_event_particles(e_events, subregions, model_particles, level_limit, height_dependant=False,
+                                                                        rng=None, counters=None):
     """ Find and return list of particles to be entrained
 
     Keyword arguments:
     e_events -- number of events requested per subregion 
     subregions -- array of Subregion objects
     model_particles -- array of all model particles
+    rng -- optional numpy Generator to select the particles with, 
+                instead of python's random module. One uniform key is
+                drawn per model particle, however many are active, and
+                the active particles with the smallest keys are selected,
+                so runs drawing from identically seeded generators select
+                the same particles wherever their active particles agree.
+    counters -- optional collections.Counter, see diagnostics.py. If 
+                passed, subregions with fewer or more events than requested
+                are counted and only logged at DEBUG level.
 
     Returns:
     event_particles -- List of particles to be entrained
 
     """
+    requested = e_events
     if e_events == 0:
         e_events = 1 #???
+    if rng is not None:
+        keys = rng.random(len(model_particles))
     
     event_particles = []
     for subregion in subregions:
@@ -82,7 +113,10 @@ def get_event_particles(e_events, subregions, model_particles, level_limit, heig
                 subregion_event_ids.append(particle[3])
                 active_particles = active_particles[active_particles[:,2] != particle[2]]
         # If there are not enough particles in the subregion to sample from, alter the sample size
-        if e_events > len(active_particles):
+        if rng is not None:
+            random_sample = np.argsort(keys[active_particles[:,3].astype(int)],
+                                       kind='stable')[:e_events]
+        elif e_events > len(active_particles):
             random_sample = random.sample(range(len(active_particles)), 
                                         len(active_particles))
         else: 
@@ -98,13 +132,19 @@ def get_event_particles(e_events, subregions, model_particles, level_limit, heig
             subregion_event_ids.append(index)
         
         if e_events != len(subregion_event_ids):
-            msg = (
-                     f'Requested {e_events} events in {subregion.getName()} ' 
-                     f'but {len(subregion_event_ids)} are occuring'
-            )
-            logging.warning(msg)
+            if counters is not None:
+                counters['event_mismatches'] += 1
+            logging.log(logging.WARNING if counters is None else logging.DEBUG,
+                        'Requested %d events in %s but %d are occuring',
+                        e_events, subregion.getName(), len(subregion_event_ids))
         event_particles = event_particles + subregion_event_ids
     event_particles = np.array(event_particles, dtype=np.intp)
+    if counters is not None:
+        # The Poisson draw, not the event forced when it is 0
+        counters['events_requested'] += requested * len(subregions)
+        if requested == 0:
+            counters['forced_events'] += len(subregions)
+        counters['events'] += len(event_particles)
 
     return event_particles
 
@@ -461,26 +501,39 @@ def elevation_list(elevations, desc=True):
            ue = ue[::-1]
     return ue
  
-def compute_hops(event_particle_ids, model_particles, mu, sigma, normal=False):
+def compute_hops(event_particle_ids, model_particles, mu, sigma, normal=False, rng=None):
     """ Given a list of (event) paritcles, this function will 
     add a hop distance to current x locations of all event particles. 
     
     Current + hop = desired hop distance.
     
     Hop distances are randomly selected from a log-normal or normal
-    distribution. 
+    distribution. If rng is passed, a uniform quantile is drawn from
+    it for every model particle (so the number of draws does not depend
+    on the number of events) and those of the event particles are
+    transformed through the inverse CDF of the distribution. Runs with
+    different mu or sigma sharing the rng's seed then give a particle
+    the same quantile.
     
     Keyword arguments:
         event_particle_ids -- list of event particle ids
         model_particles -- the model's np arry of model_particles
         normal -- boolean flag for sampling from Normal (default Flase)
+        rng -- optional numpy Generator to draw the hop quantiles from
     
     Returns:
         event_particles -- list of event particles with 'hopped' x-locations
     
     """
     event_particles = model_particles[event_particle_ids]
-    if normal:
+    if rng is not None:
+        # Quantiles in (0, 1), so the inverse CDF stays finite
+        quantiles = np.maximum(rng.random(len(model_particles))[event_particle_ids],
+                               np.finfo(float).tiny)
+        s = mu + sigma * ndtri(quantiles)
+        if not normal:
+            s = np.exp(s)
+    elif normal:
         s = np.random.normal(mu, sigma, len(event_particle_ids))
     else:
         s = np.random.lognormal(mu, sigma, len(event_particle_ids))
@@ -490,11 +543,19 @@ def compute_hops(event_particle_ids, model_particles, mu, sigma, normal=False):
     
     return event_particles
  
-def move_model_particles(event_particles, model_particles, model_supp, bed_particles, available_vertices, h):
+def move_model_particles(event_particles, model_particles, model_supp, bed_particles, available_vertices, h,
+                                                            accumulators=None, counters=None, rng=None):
     """ Given an array of event particles and their desired hops, move each
     event particle to the closest valid vertex if its desired hop is not a vertex.  
     Update the model particle and support arrays accordingly.
 
+    If an accumulators array is passed, the transport of each event 
+    particle is added to its row (indexed by uid):
+        [0] = hop count,
+        [1] = cumulative travel distance,
+        [2] = largest single hop
+    A particle which exceeds the stream travels its desired hop.
+
     Keyword arguments:
         event_particles -- array of particles (full 1-7 struct) to be entrained
         model_particles -- array of all model particles 
@@ -502,6 +563,13 @@ def move_model_particles(event_particles, model_particles, model_supp, bed_parti
                                                             model particle
         bed_particles -- array of all bed particles
         available_particles -- array of available vertices in the stream
+        accumulators -- optional n-3 array of per-particle transport totals,
+                                                            updated in place
+        counters -- optional collections.Counter, the hops and the 
+                    particles leaving the stream are counted in it
+        rng -- optional numpy Generator to order the event particles with,
+                    instead of np.random. One uniform key is drawn per
+                    model particle and the particles move in key order.
     
     Returns:
         model_particles -- array of model particles with event particle updates
@@ -509,28 +577,40 @@ def move_model_particles(event_particles, model_particles, model_supp, bed_parti
                                     model particle, with event particles updated
 
     """
+    # Per-particle messages are only built when they will be logged
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
     # Randomly iterate over event particles
-    for particle in np.random.permutation(event_particles):
+    if rng is not None:
+        keys = rng.random(len(model_particles))[event_particles[:,3].astype(int)]
+        event_particles = event_particles[np.argsort(keys, kind='stable')]
+    else:
+        event_particles = np.random.permutation(event_particles)
+    for particle in event_particles:
         orig_x = model_particles[model_particles[:,3] == particle[3]][0][0]
         verified_hop = find_closest_vertex(particle[0], available_vertices)
+        if accumulators is not None:
+            distance = (particle[0] if verified_hop == -1 else verified_hop) - orig_x
+            uid = int(particle[3])
+            accumulators[uid][0] += 1
+            accumulators[uid][1] += distance
+            accumulators[uid][2] = max(accumulators[uid][2], distance)
         
         if verified_hop == -1:
-            exceed_msg = (
-                f'Particle {int(particle[3])} exceeded stream...'
-                f'sending to -1 axis'
-            )
-            logging.info(exceed_msg) 
+            if debug:
+                logging.debug('Particle %d exceeded stream...sending to -1 axis', particle[3])
+            if counters is not None:
+                counters['loops'] += 1
             particle[6] = particle[6] + 1
             particle[0] = verified_hop
 
             model_supp[int(particle[3])][0] = np.nan
             model_supp[int(particle[3])][1] = np.nan
         else:
-            hop_msg = (
-                f'Particle {int(particle[3])} entrained from {orig_x} '
-                f'to {verified_hop}. Desired hop was: {particle[0]}'
-            )
-            logging.info(hop_msg)
+            if debug:
+                logging.debug('Particle %d entrained from %s to %s. Desired hop was: %s',
+                              particle[3], orig_x, verified_hop, particle[0])
+            if counters is not None:
+                counters['hops'] += 1
             particle[0] = verified_hop
             available_vertices = available_vertices[available_vertices != verified_hop]
 
@@ -545,16 +625,21 @@ def move_model_particles(event_particles, model_particles, model_supp, bed_parti
     return model_particles, model_supp
 
 
-def update_flux(initial_positions, final_positions, iteration, subregions):
+def update_flux(initial_positions, final_positions, iteration, subregions, gauges=None):
     """ Given arrays of initial and final positions, this function 
     will update each subregion s to indicate how many paticles crossed
     s's downstream boundary.
 
+    If a Gauges object is passed, a particle crosses a gauge at g if
+    it starts upstream of g (initial < g) and ends at or beyond g, or
+    leaves the stream (final == -1).
+
     Keyword arguments:
     initial_positions -- array of initial x locations
     final_positions -- array of final (verified) x locations
     iteration -- the iteration the that the crossing should be recorded under
     subregions -- array of subregion objects
+    gauges -- optional Gauges object, updated with the crossings
 
     Return values:
     subregions -- array of subregion objects with updated flux values
@@ -562,6 +647,12 @@ def update_flux(initial_positions, final_positions, iteration, subregions):
     # This can _most definitely_ be made quicker but for now, it works
     if len(initial_positions) != len(final_positions):
         raise ValueError(f'Initial_positions and final_positions do not contain the same # of elements')
+
+    if gauges is not None and len(initial_positions) > 0:
+        initial = np.asarray(initial_positions, dtype=float)[:,None]
+        final = np.asarray(final_positions, dtype=float)[:,None]
+        crossed = (initial < gauges.positions) & ((final >= gauges.positions) | (final == -1))
+        gauges.counts[:, iteration] += crossed.sum(axis=0)
     
     for position in range(0, len(initial_positions)):
 
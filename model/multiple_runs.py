@@ -1,9 +1,22 @@
+import os
 import sys
+import time
+import yaml
+import secrets
 import subprocess
 import argparse
+import numpy as np
 from pathlib import Path 
 
-def main(n_processes, param_path):
+import h5py
+import run
+import sinks
+import stats
+import progress
+import ensemble
+import catalog as catalog_module
+
+def main(n_processes, param_path, run_args=(), live_interval=None):
     run_path = get_run_path()
     if n_processes != len(param_path) and len(param_path) != 1:
         print(
@@ -16,22 +29,394 @@ def main(n_processes, param_path):
         for _ in range(n_processes-1):
             param_path.append(param_path[0])
 
+    # Run IDs are chosen here so the ensemble knows where each run's output is
+    run_ids = [run.make_run_id() for _ in range(n_processes)]
+
+    live = None
+    if live_interval is not None:
+        live = LiveEnsemble(param_path, live_interval)
+        print(f'Writing live ensemble statistics to {live.path} every {live_interval} s')
+    ensemble_progress = build_ensemble_progress(param_path[0])
+
     # From https://stackoverflow.com/questions/19156467/
     procs = []
     print(f'Running {n_processes} processes of BeRCM in parallel...')
     for i in range(n_processes):
-        if sys.platform.startswith('win32'):
-            proc = subprocess.Popen([sys.executable, run_path, param_path[i]], creationflags=subprocess.CREATE_NEW_CONSOLE)
-        else:
-            proc = subprocess.Popen([sys.executable, run_path, param_path[i]])
-        procs.append(proc)
-        print(f'Process [{proc.pid}] using {param_path[i]}')
-
-    for proc in procs:
-        proc.wait()
+        args = run_args if live is None else [*run_args, '--shared-memory', live.name, str(i)]
+        procs.append(launch(run_path, param_path[i], run_ids[i], args, ensemble_progress))
+
+    try:
+        wait_for(procs, [watcher for watcher in [live, ensemble_progress] if watcher is not None])
+    finally:
+        if live is not None:
+            live.close()
     print(f'All processes complete.')
+
+    build_ensemble_view(param_path, run_ids)
     return 
 
+class LiveEnsemble():
+    """ Ensemble statistics kept up to date while the runs go.
+
+    The runs write their flux and age series into shared memory
+    (see sinks.SharedArrays and sinks.SharedMemorySink). Every
+    interval seconds, and once all runs are done, the entries written
+    since the last look are merged into running means and variances
+    across runs, which are written to {prefix}-ensemble-live-{id}.hdf5
+    next to the first run's output:
+
+        /subregions/<name>-flux/mean, variance    (n_iterations,)
+        /subregions/<name>-flux/count             runs with the subregion reaching
+                                                  each iteration
+        /avg_age/mean, variance, /age_range/...   (n_iterations,)
+        /count                                    runs reaching each iteration
+        /progress                                 last iteration of each run
+
+    Runs may have different numbers of subregions: each subregion's
+    statistics are over the runs which have it.
+
+    The file is replaced whole each time, so it can be read at any time.
+    """
+    def __init__(self, param_path, interval):
+        _, _, schema_path, _ = run.get_relative_paths()
+        parameters = [run.load_parameters(path, schema_path) for path in param_path]
+        self.num_subregions = [p['num_subregions'] for p in parameters]
+        n_subregions = max(self.num_subregions)
+        n_iterations = max(p['n_iterations'] for p in parameters)
+        self.interval = interval
+        self.next_dump = time.monotonic() + interval
+        self.name = f'belt-{secrets.token_hex(4)}'
+        self.arrays = sinks.SharedArrays(self.name, len(param_path), n_subregions, 
+                                         n_iterations, create=True)
+        self.flux = stats.EnsembleMoments(n_subregions, n_iterations)
+        self.age = stats.EnsembleMoments(2, n_iterations)
+        self.merged = np.zeros(len(param_path), dtype=np.int64)
+        prefix = parameters[0]['filename_prefix']
+        self.path = (run.get_output_path(parameters[0], param_path[0]) / 
+                        f'{prefix}-ensemble-live-{run.make_run_id()}.hdf5')
+
+    def update(self):
+        """ Merge every entry written since the last update """
+        for row in range(self.merged.size):
+            stop = int(self.arrays.progress[row]) + 1
+            self.flux.update(self.arrays.flux[row], self.merged[row], stop,
+                             self.num_subregions[row])
+            self.age.update(self.arrays.age[row], self.merged[row], stop)
+            self.merged[row] = max(self.merged[row], stop)
+
+    def dump(self):
+        """ Write the statistics to a temporary file and move it into place """
+        flux, age = self.flux.results(), self.age.results()
+        results = {'count': flux['count'], 'progress': self.merged - 1,
+                   'subregions': {f'subregion-{idx}-flux': {'mean': flux['mean'][idx], 
+                                                            'variance': flux['variance'][idx],
+                                                            'count': flux['series_count'][idx]}
+                                    for idx in range(flux['mean'].shape[0])}}
+        for idx, name in enumerate(['avg_age', 'age_range']):
+            results[name] = {'mean': age['mean'][idx], 'variance': age['variance'][idx]}
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with h5py.File(tmp_path, 'w') as f:
+            sinks.write_nested(f, results)
+        os.replace(tmp_path, self.path)
+
+    def poll(self):
+        """ Update and dump the statistics if interval seconds have passed """
+        if time.monotonic() >= self.next_dump:
+            self.write()
+
+    def write(self):
+        self.update()
+        self.dump()
+        self.next_dump = time.monotonic() + self.interval
+
+    def close(self):
+        self.arrays.close()
+
+def launch(run_path, param_path, run_id, run_args=(), ensemble_progress=None):
+    """ Start run.py on param_path as a new process and return it. If
+    ensemble_progress is given, it follows the new run. """
+    args = [sys.executable, run_path, param_path, '--run-id', run_id, *run_args]
+    if sys.platform.startswith('win32'):
+        proc = subprocess.Popen(args, creationflags=subprocess.CREATE_NEW_CONSOLE)
+    else:
+        proc = subprocess.Popen(args)
+    print(f'Process [{proc.pid}] using {param_path}')
+    if ensemble_progress is not None:
+        _, _, schema_path, _ = run.get_relative_paths()
+        parameters = run.load_parameters(param_path, schema_path)
+        stem = run.get_progress_stem(parameters, param_path, 
+                                     f'{parameters["filename_prefix"]}-{run_id}')
+        ensemble_progress.add(run_id, proc, progress.progress_paths(stem, ['json'])['json'])
+    return proc
+
+def wait_for(procs, watchers=()):
+    """ Wait for every process in procs to finish. Every watcher (a
+    LiveEnsemble or progress.EnsembleProgress) is polled while waiting
+    and written once more at the end. """
+    if not watchers:
+        for proc in procs:
+            proc.wait()
+        return
+    tick = min([watcher.interval for watcher in watchers] + [1])
+    while any(proc.poll() is None for proc in procs):
+        time.sleep(tick)
+        for watcher in watchers:
+            watcher.poll()
+    for watcher in watchers:
+        watcher.write()
+
+def as_completed(procs, watchers=()):
+    """ Yield every process in procs as it finishes, polling every
+    watcher while waiting, as wait_for does. """
+    pending = list(procs)
+    tick = min([watcher.interval for watcher in watchers] + [1])
+    while pending:
+        for proc in [proc for proc in pending if proc.poll() is not None]:
+            pending.remove(proc)
+            yield proc
+        if pending:
+            time.sleep(tick)
+            for watcher in watchers:
+                watcher.poll()
+    for watcher in watchers:
+        watcher.write()
+
+def build_ensemble_progress(param_path):
+    """ Build the progress.EnsembleProgress of an ensemble using the
+    progress settings of param_path, or None if they are off """
+    _, _, schema_path, _ = run.get_relative_paths()
+    parameters = run.load_parameters(param_path, schema_path)
+    interval = parameters.get('progress_interval', 10)
+    if interval <= 0:
+        return None
+    ensemble_id = run.make_run_id()
+    stem = run.get_progress_stem(parameters, param_path, 
+                                 f'{parameters["filename_prefix"]}-ensemble-{ensemble_id}')
+    return progress.EnsembleProgress(stem, ensemble_id, interval, 
+                                     parameters.get('progress_formats', ['json']))
+
+def adaptive(n_processes, param_path, tolerance, metric=None, confidence=0.95, 
+             min_runs=3, max_runs=100, run_args=()):
+    """ Run replicates of one parameter file until the mean of a
+    summary metric is known precisely enough.
+
+    Replicates are launched in waves of n_processes. As each run
+    finishes, its metric is read from the catalog and the confidence
+    interval of the mean over all runs so far is updated. No further
+    wave is launched once the half-width of the interval is within
+    tolerance of the mean (and at least min_runs runs have finished),
+    or once max_runs runs have been launched.
+
+    Keyword arguments:
+        n_processes -- number of runs per wave
+        param_path -- path to the parameter file
+        tolerance -- target half-width of the interval, relative to the mean
+        metric -- catalog metric (see catalog.summary_metrics), by 
+                  default the mean flux of the last subregion
+        confidence -- confidence level of the interval
+        min_runs -- number of runs to finish before stopping
+        max_runs -- most runs to launch
+        run_args -- further arguments passed on to run.py
+
+    Returns:
+        values -- the metric of every run that registered it
+        run_ids -- the IDs of every run launched
+    """
+    _, _, schema_path, _ = run.get_relative_paths()
+    parameters = run.load_parameters(param_path, schema_path)
+    if not parameters.get('catalog', True):
+        print('Adaptive ensembles read the metric of each run from the catalog, '
+              'set catalog: True in the parameters.')
+        return [], []
+    if parameters.get('seed') is not None:
+        print('Every replicate would use the same seed, remove seed from the parameters.')
+        return [], []
+    if metric is None:
+        metric = f'mean_flux_subregion-{parameters["num_subregions"] - 1}'
+    catalog_path = run.get_catalog_path(parameters, param_path)
+    run_path = get_run_path()
+
+    values, run_ids = [], []
+    width = np.inf
+    ensemble_progress = build_ensemble_progress(param_path)
+    watchers = [ensemble_progress] if ensemble_progress is not None else []
+    print(f'Running replicates of {param_path} until the {confidence:.0%} confidence '
+          f'interval of {metric} is within {tolerance:.1%} of its mean...')
+    while len(run_ids) < max_runs and (len(values) < min_runs or width > tolerance):
+        wave_ids = [run.make_run_id() for _ in range(min(n_processes, max_runs - len(run_ids)))]
+        procs = {launch(run_path, param_path, run_id, run_args, ensemble_progress): run_id
+                                                                    for run_id in wave_ids}
+        run_ids.extend(wave_ids)
+        registered = 0
+        for proc in as_completed(procs, watchers):
+            run_id = procs[proc]
+            value = read_metric(catalog_path, run_id, metric)
+            if value is None:
+                print(f'Run {run_id} did not register {metric} in {catalog_path}')
+                continue
+            registered += 1
+            values.append(value)
+            mean, half_width = stats.confidence_interval(values, confidence)
+            width = stats.relative_half_width(values, confidence)
+            print(f'{len(values)} runs: {metric} = {mean:.6g} +/- {half_width:.3g} '
+                  f'({width:.1%} of the mean)')
+        if not registered:
+            print(f'No run of the last wave registered {metric}, stopping.')
+            break
+
+    if values and width <= tolerance and len(values) >= min_runs:
+        print(f'Tolerance of {tolerance:.1%} reached after {len(values)} runs.')
+    else:
+        print(f'Stopped after {len(run_ids)} runs without reaching a tolerance of '
+              f'{tolerance:.1%}.')
+    build_ensemble_view([param_path] * len(run_ids), run_ids)
+    return values, run_ids
+
+def sweep(n_processes, param_path, name, values, replicates=1, metric=None, run_args=()):
+    """ Sweep one parameter with common random numbers.
+
+    Every value of the parameter is run replicates times, at most
+    n_processes runs at a time. Replicate r of every value uses seed
+    seed + r (seed being the parameter file's seed, or a random one)
+    and common_random_numbers, so neighbouring values draw the same
+    event counts, event particles and hop quantiles, and their paired
+    differences are not swamped by sampling noise. The parameter files
+    of the runs are written to a {prefix}-sweep-{id} directory in the
+    output directory.
+
+    Keyword arguments:
+        n_processes -- most runs at a time
+        param_path -- path to the parameter file to sweep from
+        name -- name of the parameter to sweep
+        values -- values of the parameter
+        replicates -- number of runs (seeds) per value
+        metric -- catalog metric to summarise, by default the mean flux
+                  of the last subregion
+        run_args -- further arguments passed on to run.py
+
+    Returns:
+        run_ids -- array (n_values, replicates) of the IDs of the runs
+    """
+    _, _, schema_path, _ = run.get_relative_paths()
+    parameters = run.load_parameters(param_path, schema_path)
+    seed = parameters.get('seed')
+    if seed is None:
+        seed = secrets.randbelow(2**32 - replicates)
+    output_path = run.get_output_path(parameters, param_path).resolve()
+    sweep_path = output_path / f'{parameters["filename_prefix"]}-sweep-{run.make_run_id()}'
+    os.makedirs(sweep_path)
+
+    # Paths in the parameter files are relative to them, so pin them down
+    paths = {'output_dir': str(output_path)}
+    if 'catalog_path' in parameters:
+        paths['catalog_path'] = str((Path(param_path).parent / parameters['catalog_path']).resolve())
+    jobs = []
+    for value in values:
+        for replicate in range(replicates):
+            point = dict(parameters, common_random_numbers=True, seed=seed + replicate, **paths)
+            point[name] = value
+            point_path = sweep_path / f'{name}-{value}-seed-{seed + replicate}.yaml'
+            with open(point_path, 'w') as f:
+                yaml.safe_dump(point, f, sort_keys=False)
+            run.load_parameters(point_path, schema_path)
+            jobs.append((str(point_path), run.make_run_id()))
+
+    run_path = get_run_path()
+    print(f'Sweeping {name} over {len(values)} values with {replicates} common seed(s) '
+          f'from {seed}, parameter files in {sweep_path}')
+    ensemble_progress = build_ensemble_progress(jobs[0][0])
+    watchers = [ensemble_progress] if ensemble_progress is not None else []
+    for start in range(0, len(jobs), n_processes):
+        procs = [launch(run_path, point_path, run_id, run_args, ensemble_progress) 
+                                    for point_path, run_id in jobs[start:start + n_processes]]
+        wait_for(procs, watchers)
+
+    run_ids = np.array([run_id for _, run_id in jobs]).reshape(len(values), replicates)
+    if parameters.get('catalog', True):
+        if metric is None:
+            metric = f'mean_flux_subregion-{parameters["num_subregions"] - 1}'
+        catalog_path = run.get_catalog_path(dict(parameters, **paths), param_path)
+        results = np.array([[read_metric(catalog_path, run_id, metric) for run_id in row] 
+                                                for row in run_ids], dtype=float)
+        print(format_sweep(name, values, metric, results))
+    build_ensemble_view([point_path for point_path, _ in jobs], list(run_ids.flat))
+    return run_ids
+
+def format_sweep(name, values, metric, results, confidence=0.95):
+    """ Return a table of the mean of metric at each value and of the
+    paired differences between neighbouring values, from results of 
+    shape (n_values, replicates) (nan where a run is missing) """
+    lines = [f'{name:>12}  {"mean " + metric:>32}  {"paired difference from previous":>40}']
+    for idx, value in enumerate(values):
+        row = results[idx][~np.isnan(results[idx])]
+        line = f'{str(value):>12}  {np.mean(row) if row.size else np.nan:>32.6g}'
+        if idx > 0:
+            paired = results[idx] - results[idx - 1]
+            mean, half_width = stats.confidence_interval(paired[~np.isnan(paired)], confidence)
+            line += f'  {mean:>25.6g} +/- {half_width:<10.3g}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+def read_metric(catalog_path, run_id, metric):
+    """ Return the value of metric registered by run_id in the catalog
+    at catalog_path, or None if the run or metric is missing """
+    if not os.path.exists(catalog_path):
+        return None
+    catalog = catalog_module.Catalog(catalog_path)
+    try:
+        runs = catalog.query([f'run_id={run_id}'])
+    finally:
+        catalog.close()
+    return runs[0]['metrics'].get(metric) if runs else None
+
+def build_ensemble_view(param_path, run_ids):
+    """ Write the ensemble master file next to the first run's output,
+    stacking the final metrics of every run that produced an hdf5 file. """
+    _, _, schema_path, _ = run.get_relative_paths()
+    run_files, found_ids = [], []
+    for path, run_id in zip(param_path, run_ids):
+        parameters = run.load_parameters(path, schema_path)
+        sinks = run.build_output_sinks(parameters, path, run_id)
+        hdf5_files = [p for sink in sinks for p in sink.paths() if str(p).endswith('.hdf5')]
+        if hdf5_files and os.path.exists(hdf5_files[0]):
+            run_files.append(hdf5_files[0])
+            found_ids.append(run_id)
+    if not run_files:
+        print('No hdf5 output to build an ensemble view from.')
+        return
+    prefix = run.load_parameters(param_path[0], schema_path)['filename_prefix']
+    master_path = os.path.join(os.path.dirname(run_files[0]), 
+                                f'{prefix}-ensemble-{run.make_run_id()}.hdf5')
+    ensemble.build_virtual_view(run_files, master_path, found_ids)
+    print(f'Ensemble view of {len(run_files)} runs written to {master_path}')
+
+def dry_run(n_processes, param_path):
+    """ Estimate the resources of the ensemble without running it.
+    The runs execute side by side, so their memory and output add up
+    while the wall time is that of the slowest. Returns False if the
+    output would not fit on the disk. """
+    # Imported here, as in run.py, since only a dry run needs it
+    import estimate
+    if len(param_path) == 1:
+        param_path = param_path * n_processes
+    estimates = {path: estimate.estimate(path) for path in set(param_path)}
+    for path in estimates:
+        print(estimate.format_estimate(estimates[path]))
+    runs = [estimates[path] for path in param_path]
+    output_bytes = sum(run_estimate['output_bytes'] for run_estimate in runs)
+    free_bytes = min(run_estimate['free_bytes'] for run_estimate in runs)
+    print(f'Ensemble of {len(runs)} runs:')
+    print(f'    predicted wall time:   {max(r["wall_time"] for r in runs):.0f} s')
+    print(f'    predicted peak memory: '
+          f'{estimate.format_bytes(sum(r["peak_memory"] for r in runs))}')
+    print(f'    predicted output:      {estimate.format_bytes(output_bytes)} '
+          f'({estimate.format_bytes(free_bytes)} free)')
+    if output_bytes >= free_bytes:
+        print('The output of this ensemble would not fit on the disk.')
+        return False
+    return True
+
 def get_run_path():
     run_path = Path(__file__).parent / "run.py"
     return run_path
@@ -40,12 +425,70 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description='A test')
     parser.add_argument("pcount", help="Number of processes to run")
     parser.add_argument("param", default='param.yaml', nargs='*', help="Test variable")
+    parser.add_argument('--profile', action='store_true', 
+                        help='Profile every run (see run.py --profile)')
+    parser.add_argument('--trace-memory', action='store_true', 
+                        help='Also trace memory in every run (see run.py --trace-memory)')
+    parser.add_argument('--memory-interval', type=int, default=0, 
+                        help='Dump tracemalloc snapshots every n-th iteration of every run '
+                             '(see run.py --memory-interval)')
+    parser.add_argument('--debug', action='store_true', 
+                        help='Log every iteration and hop of every run (see run.py --debug)')
+    parser.add_argument('--dry-run', action='store_true', 
+                        help='Estimate wall time, memory and output size of the ensemble without running it')
+    parser.add_argument('--tolerance', type=float, 
+                        help='Run waves of pcount replicates until the confidence interval of the '
+                             'mean of --metric is within this fraction of the mean')
+    parser.add_argument('--metric', 
+                        help='Catalog metric to estimate (default: mean flux of the last subregion)')
+    parser.add_argument('--confidence', type=float, default=0.95, 
+                        help='Confidence level of the interval (default: 0.95)')
+    parser.add_argument('--min-runs', type=int, default=3, 
+                        help='Least number of runs before stopping (default: 3)')
+    parser.add_argument('--max-runs', type=int, default=100, 
+                        help='Most runs to launch (default: 100)')
+    parser.add_argument('--live-interval', type=float, 
+                        help='Share the flux and age series of the runs in memory and write '
+                             'running ensemble means and variances every this many seconds')
+    parser.add_argument('--sweep', metavar='NAME=V1,V2,...', 
+                        help='Run every value of a parameter with common random numbers, '
+                             'at most pcount runs at a time')
+    parser.add_argument('--replicates', type=int, default=1, 
+                        help='Seeds per value in a sweep (default: 1)')
     args = parser.parse_args()
-    return int(args.pcount), args.param
+    run_args = [flag for flag, on in [('--profile', args.profile), 
+                                      ('--trace-memory', args.trace_memory),
+                                      ('--debug', args.debug)] if on]
+    if args.memory_interval > 0:
+        run_args += ['--memory-interval', str(args.memory_interval)]
+    target = None
+    if args.tolerance is not None:
+        if len(args.param) != 1:
+            parser.error('--tolerance runs replicates of a single parameter file')
+        target = {'tolerance': args.tolerance, 'metric': args.metric, 
+                  'confidence': args.confidence, 'min_runs': args.min_runs, 
+                  'max_runs': args.max_runs}
+    sweep_points = None
+    if args.sweep is not None:
+        name, found, values = args.sweep.partition('=')
+        if len(args.param) != 1 or not found or not values:
+            parser.error('--sweep takes NAME=V1,V2,... and a single parameter file')
+        sweep_points = {'name': name.strip(), 'replicates': args.replicates, 'metric': args.metric,
+                        'values': [yaml.safe_load(value) for value in values.split(',')]}
+    return int(args.pcount), args.param, run_args, args.dry_run, target, sweep_points, \
+                                                                        args.live_interval
 
 if __name__ == '__main__':
-    n_processes, param_path = parse_arguments()
-    main(n_processes, param_path)
+    n_processes, param_path, run_args, is_dry_run, target, sweep_points, live_interval = \
+                                                                        parse_arguments()
+    if is_dry_run:
+        sys.exit(0 if dry_run(n_processes, param_path) else 1)
+    if sweep_points is not None:
+        sweep(n_processes, param_path[0], run_args=run_args, **sweep_points)
+    elif target is not None:
+        adaptive(n_processes, param_path[0], run_args=run_args, **target)
+    else:
+        main(n_processes, param_path, run_args, live_interval)
 
 
 
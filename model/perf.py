@@ -0,0 +1,114 @@
+"""
+Lightweight per-phase timers for the entrainment loop.
+
+Each iteration is split into phases. The loop calls lap(phase) at the
+end of every phase, which charges the time since the previous lap to
+that phase. Per-iteration phase times are buffered and folded into
+log-spaced histograms in blocks, so the cost per lap is one
+perf_counter call and an addition.
+"""
+import time
+import numpy as np
+
+
+PHASES = ['event_selection', 'hop_sampling', 'vertex_computation', 'move',
+          'flux', 'state_update', 'age', 'io']
+
+# 100ns to 100s, 10 bins per decade
+BIN_EDGES = np.logspace(-7, 2, 91)
+
+PERCENTILES = [50, 90, 99]
+
+
+class PhaseTimer():
+    """ Time each phase of every iteration.
+
+    Call start() at the top of an iteration, lap(phase) after each
+    phase (a phase may be lapped more than once per iteration, the
+    times add up) and end_iteration() at the bottom. If an observer
+    is given, observer.observe(phase, iteration) is called on every lap.
+    """
+    def __init__(self, phases=PHASES, block=1024, observer=None):
+        self.phases = list(phases)
+        self.index = {phase: idx for idx, phase in enumerate(self.phases)}
+        self.buffer = np.zeros((block, len(self.phases)))
+        self.row = 0
+        self.iterations = 0
+        self.totals = np.zeros(len(self.phases))
+        self.maxima = np.zeros(len(self.phases))
+        self.histogram = np.zeros((len(self.phases), len(BIN_EDGES) - 1), dtype=np.int64)
+        self.last = None
+        self.observer = observer
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.buffer[self.row, self.index[phase]] += now - self.last
+        if self.observer is not None:
+            self.observer.observe(phase, self.iterations)
+            now = time.perf_counter()
+        self.last = now
+
+    def end_iteration(self):
+        self.row += 1
+        self.iterations += 1
+        if self.row == self.buffer.shape[0]:
+            self.flush()
+
+    def flush(self):
+        """ Fold the buffered iterations into the totals and histograms """
+        times = self.buffer[:self.row]
+        self.totals += times.sum(axis=0)
+        if self.row > 0:
+            self.maxima = np.maximum(self.maxima, times.max(axis=0))
+        # Bin index of every time; times below/above the edges go in the end bins
+        bins = np.clip(np.searchsorted(BIN_EDGES, times, side='right') - 1,
+                        0, len(BIN_EDGES) - 2)
+        for idx in range(len(self.phases)):
+            self.histogram[idx] += np.bincount(bins[:,idx], minlength=len(BIN_EDGES) - 1)
+        self.buffer[:] = 0
+        self.row = 0
+
+    def percentiles(self):
+        """ Estimate the PERCENTILES of each phase's per-iteration time
+        from the histograms, as the upper edge of the bin holding each
+        percentile. Returns an (n_phases, len(PERCENTILES)) array. """
+        self.flush()
+        cumulative = np.cumsum(self.histogram, axis=1)
+        estimates = np.zeros((len(self.phases), len(PERCENTILES)))
+        for idx in range(len(self.phases)):
+            if cumulative[idx, -1] == 0:
+                continue
+            targets = np.array(PERCENTILES) / 100 * cumulative[idx, -1]
+            estimates[idx] = BIN_EDGES[np.searchsorted(cumulative[idx], targets) + 1]
+        return estimates
+
+    def results(self):
+        """ Return the timings as a nested dictionary for the sinks """
+        self.flush()
+        return {'phases': np.array(self.phases),
+                'iterations': self.iterations,
+                'total_seconds': self.totals,
+                'mean_seconds': self.totals / max(self.iterations, 1),
+                'max_seconds': self.maxima,
+                'histogram': self.histogram,
+                'bin_edges': BIN_EDGES,
+                'percentile_levels': np.array(PERCENTILES),
+                'percentiles': self.percentiles()}
+
+    def report(self):
+        """ Return a table of the per-phase timings """
+        self.flush()
+        total = max(self.totals.sum(), 1e-12)
+        percentiles = self.percentiles()
+        header = (f'{"phase":<20}{"total (s)":>12}{"share":>8}{"mean (ms)":>12}'
+                  + ''.join(f'{f"p{p} (ms)":>12}' for p in PERCENTILES))
+        lines = [header]
+        for idx, phase in enumerate(self.phases):
+            mean = self.totals[idx] / max(self.iterations, 1)
+            lines.append(f'{phase:<20}{self.totals[idx]:>12.3f}{self.totals[idx] / total:>8.1%}'
+                         f'{mean * 1e3:>12.3f}'
+                         + ''.join(f'{p * 1e3:>12.3f}' for p in percentiles[idx]))
+        return '\n'.join(lines)
@@ -0,0 +1,145 @@
+"""
+Profiling mode for model runs.
+
+A Profiler wraps a run and writes, next to the run's output:
+
+    {stem}.pstats      -- cProfile statistics, for pstats/snakeviz
+    {stem}.collapsed   -- sampled call stacks in collapsed form
+                          ('outer;inner;leaf count' per line), for
+                          flamegraph.pl, speedscope, inferno, ...
+
+With memory tracing on, tracemalloc runs for the whole run. The traced
+memory is checked at every phase boundary of the entrainment loop to
+find the peak growth per phase, written to {stem}-memory.txt, and
+snapshots are dumped at the start and end of the run and at the phase
+boundaries of every memory_interval-th iteration as
+{stem}-<label>.tracemalloc (load them with tracemalloc.Snapshot.load).
+"""
+import os
+import sys
+import cProfile
+import threading
+import tracemalloc
+
+
+class StackSampler(threading.Thread):
+    """ Sample the call stack of one thread every interval seconds
+    and count each distinct stack. """
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f'{stack} {count}\n')
+
+
+class MemoryTracer():
+    """ Track tracemalloc's traced memory at the phase boundaries of
+    the entrainment loop. Used as a perf.PhaseTimer observer. """
+    def __init__(self, stem, interval=0):
+        self.stem = stem
+        self.interval = interval
+        self.growth = {}
+        self.paths = []
+        self.last = 0
+        self.iteration = None
+        self.boundary = 0
+
+    def start(self):
+        tracemalloc.start()
+        self.last, _ = tracemalloc.get_traced_memory()
+        self.snapshot('start')
+
+    def observe(self, phase, iteration):
+        current, _ = tracemalloc.get_traced_memory()
+        self.growth[phase] = max(self.growth.get(phase, 0), current - self.last)
+        self.last = current
+        if iteration != self.iteration:
+            self.iteration, self.boundary = iteration, 0
+        self.boundary += 1
+        if self.interval and iteration % self.interval == 0:
+            self.snapshot(f'iteration{iteration}-{self.boundary}-{phase}')
+
+    def snapshot(self, label):
+        path = f'{self.stem}-{label}.tracemalloc'
+        tracemalloc.take_snapshot().dump(path)
+        self.paths.append(path)
+
+    def stop(self):
+        self.snapshot('end')
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        path = f'{self.stem}-memory.txt'
+        with open(path, 'w') as f:
+            f.write(f'peak traced memory: {peak} bytes\n')
+            f.write('largest growth in traced memory during one phase (bytes):\n')
+            for phase, growth in self.growth.items():
+                f.write(f'{phase:<20}{growth:>16}\n')
+        self.paths.append(path)
+
+
+class Profiler():
+    """ Profile a run with cProfile and a stack sampler, and
+    optionally trace its memory.
+
+    Keyword arguments:
+        stem -- path prefix of the files written
+        interval -- seconds between stack samples
+        trace_memory -- also trace memory with tracemalloc
+        memory_interval -- dump tracemalloc snapshots at the phase
+                           boundaries of every memory_interval-th
+                           iteration (0 for start and end only)
+    """
+    def __init__(self, stem, interval=0.005, trace_memory=False, memory_interval=0):
+        self.stem = str(stem)
+        self.interval = interval
+        self.memory = MemoryTracer(self.stem, memory_interval) if trace_memory else None
+        self.paths = []
+
+    def start(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.stem)), exist_ok=True)
+        if self.memory is not None:
+            self.memory.start()
+        self.sampler = StackSampler(threading.get_ident(), self.interval)
+        self.sampler.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        self.profile.dump_stats(f'{self.stem}.pstats')
+        self.sampler.write(f'{self.stem}.collapsed')
+        self.paths = [f'{self.stem}.pstats', f'{self.stem}.collapsed']
+        if self.memory is not None:
+            self.memory.stop()
+            self.paths += self.memory.paths
+        return self.paths
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
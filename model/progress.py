@@ -0,0 +1,223 @@
+"""
+Machine-readable progress of runs and ensembles.
+
+Every interval seconds a run (and the ensemble runner) writes its
+progress to small files next to its output, so stalls and slow
+configurations can be spotted without attaching to a terminal:
+
+    {stem}-progress.json   one JSON object
+    {stem}.prom            the same values in the Prometheus text format,
+                           for node_exporter's textfile collector
+
+Each file is written to a temporary file and moved into place, so
+readers never see a partial write. A run reports its state (running,
+finished or failed), iteration, n_iterations, fraction done,
+iterations_per_second since the previous write and
+mean_iterations_per_second since the start, eta_seconds, rss_bytes,
+bytes_written by its sinks and the unix time it was updated.
+"""
+import os
+import sys
+import json
+import time
+
+
+FORMATS = ['json', 'prometheus']
+METRIC_PREFIX = 'belt_'
+
+
+class ProgressReporter():
+    """ Periodically write the progress of a run.
+
+    Keyword arguments:
+        stem -- path and filename stem of the progress files
+        run_id -- the run's ID, used as a label
+        n_iterations -- number of iterations of the run
+        interval -- seconds between writes
+        formats -- formats to write, from FORMATS
+        output_paths -- callable returning the paths the run writes to
+    """
+    def __init__(self, stem, run_id, n_iterations, interval=10, formats=('json',),
+                                                                output_paths=None):
+        self.paths = progress_paths(stem, formats)
+        self.run_id = run_id
+        self.n_iterations = n_iterations
+        self.interval = interval
+        self.output_paths = output_paths if output_paths is not None else list
+        self.start = time.monotonic()
+        self.last_time, self.last_done = self.start, 0
+        self.next_write = self.start + interval
+
+    def update(self, iteration):
+        """ Write the progress if interval seconds have passed since
+        the last write. Costs one clock read otherwise. """
+        if time.monotonic() >= self.next_write:
+            self.write(iteration)
+
+    def write(self, iteration, state='running'):
+        """ Write the progress after iteration """
+        now = time.monotonic()
+        done = iteration + 1
+        mean_rate = done / (now - self.start) if now > self.start else 0.0
+        recent_rate = ((done - self.last_done) / (now - self.last_time)
+                                            if now > self.last_time else 0.0)
+        remaining = self.n_iterations - done if state == 'running' else 0
+        values = {'state': state,
+                  'iteration': iteration,
+                  'n_iterations': self.n_iterations,
+                  'fraction': done / self.n_iterations if self.n_iterations else 1.0,
+                  'iterations_per_second': recent_rate,
+                  'mean_iterations_per_second': mean_rate,
+                  'eta_seconds': remaining / mean_rate if mean_rate > 0 else None,
+                  'rss_bytes': current_rss(),
+                  'bytes_written': sum(path_size(path) for path in self.output_paths()),
+                  'updated': time.time()}
+        write_progress(self.paths, values, {'run_id': self.run_id})
+        self.last_time, self.last_done = now, done
+        self.next_write = now + self.interval
+
+    def finish(self, iteration, state='finished'):
+        """ Write the final progress of the run """
+        self.write(iteration, state)
+
+
+class EnsembleProgress():
+    """ Periodically write the progress of an ensemble of runs.
+
+    The runs are run.py processes, each writing its own JSON progress
+    file. Their states are taken from the processes, and their
+    iterations, throughput, memory and output are read from the files
+    and added up. The ETA is that of the slowest run still going.
+
+    Keyword arguments:
+        stem -- path and filename stem of the progress files
+        ensemble_id -- the ensemble's ID, used as a label
+        interval -- seconds between writes
+        formats -- formats to write, from FORMATS
+    """
+    def __init__(self, stem, ensemble_id, interval=10, formats=('json',)):
+        self.paths = progress_paths(stem, formats)
+        self.ensemble_id = ensemble_id
+        self.interval = interval
+        self.runs = []
+        self.next_write = time.monotonic() + interval
+
+    def add(self, run_id, proc, progress_path):
+        """ Follow the run run_id, running as proc and writing its JSON
+        progress to progress_path """
+        self.runs.append((run_id, proc, progress_path))
+
+    def poll(self):
+        """ Write the progress if interval seconds have passed """
+        if time.monotonic() >= self.next_write:
+            self.write()
+
+    def write(self):
+        """ Write the progress of every run followed so far """
+        runs = []
+        for run_id, proc, progress_path in self.runs:
+            run = read_progress(progress_path)
+            returncode = proc.poll()
+            if returncode is None:
+                run['state'] = 'running'
+            else:
+                run['state'] = 'finished' if returncode == 0 else 'failed'
+            runs.append(dict(run, run_id=run_id, returncode=returncode))
+        running = [run for run in runs if run['state'] == 'running']
+        etas = [run['eta_seconds'] for run in running if run.get('eta_seconds') is not None]
+        values = {'state': 'running' if running else 'finished',
+                  'runs': len(runs),
+                  'runs_running': len(running),
+                  'runs_finished': len([run for run in runs if run['state'] == 'finished']),
+                  'runs_failed': len([run for run in runs if run['state'] == 'failed']),
+                  'iterations': sum(run.get('iteration', -1) + 1 for run in runs),
+                  'iterations_per_second': sum(run.get('iterations_per_second', 0)
+                                                                    for run in running),
+                  'eta_seconds': max(etas) if etas else None,
+                  'rss_bytes': sum(run.get('rss_bytes') or 0 for run in running),
+                  'bytes_written': sum(run.get('bytes_written', 0) for run in runs),
+                  'updated': time.time()}
+        write_progress(self.paths, values, {'ensemble_id': self.ensemble_id},
+                       extra={'runs_detail': runs})
+        self.next_write = time.monotonic() + self.interval
+
+
+#############################################################################
+# Helper functions
+#############################################################################
+
+def progress_paths(stem, formats):
+    """ Return the progress file of stem for each format """
+    paths = {'json': f'{stem}-progress.json', 'prometheus': f'{stem}.prom'}
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        raise ValueError(f'Unknown progress formats {unknown}, expected some of {FORMATS}')
+    return {name: paths[name] for name in formats}
+
+
+def write_progress(paths, values, labels, extra=None):
+    """ Atomically write values to the JSON and Prometheus files in paths.
+    extra holds further entries for the JSON file only. """
+    for name, path in paths.items():
+        if name == 'json':
+            text = json.dumps(dict(labels, **values, **(extra or {})))
+        else:
+            text = format_prometheus(values, labels)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text + '\n')
+        os.replace(tmp_path, path)
+
+
+def format_prometheus(values, labels):
+    """ Return values as gauges in the Prometheus text format. The
+    state is exported as belt_state{state="..."} 1. """
+    label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    lines = []
+    for key, value in values.items():
+        name = METRIC_PREFIX + key
+        lines.append(f'# TYPE {name} gauge')
+        if key == 'state':
+            lines.append(f'{name}{{{label_text},state="{value}"}} 1')
+        else:
+            lines.append(f'{name}{{{label_text}}} {"NaN" if value is None else value}')
+    return '\n'.join(lines)
+
+
+def read_progress(path):
+    """ Return the JSON progress in path, or an empty dictionary """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def current_rss():
+    """ Resident set size of this process in bytes (the peak where the
+    current size is not available), or None where neither is (e.g. on
+    Windows, which has no resource module) """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * \
+                                (1 if sys.platform == 'darwin' else 1024)
+
+
+def path_size(path):
+    """ Size in bytes of a file, or of every file under a directory """
+    if os.path.isdir(path):
+        return sum(path_size(os.path.join(root, name))
+                        for root, _, names in os.walk(path) for name in names)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        # Missing, or removed while the directory was walked
+        return 0
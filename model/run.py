@@ -5,19 +5,49 @@ import logging.config
 from datetime import datetime
 from pathlib import Path 
 from shortuuid import uuid
-import h5py
 import time
+import argparse
+import sys
+import random
+import secrets
+import subprocess
 from tqdm import tqdm
 from jsonschema import validate, exceptions
 
 import logic
-import sys
+import sinks as sinks_module
+import filters as filters_module
+import catalog as catalog_module
+import stats as stats_module
+import diagnostics as diagnostics_module
+import perf
+import profiling
+import progress
 import os
 
-ITERATION_HEADER = ('Beginning iteration {iteration}...')
-ENTRAINMENT_HEADER = ('Entraining particles {event_particles}')
+ENGINE = 'python'
+
+# Logged lazily at DEBUG level, see diagnostics.py
+ITERATION_HEADER = 'Beginning iteration %d...'
+ENTRAINMENT_HEADER = 'Entraining particles %s'
 
-def main(run_id, pid, param_path):
+def main(run_id, pid, param_path, sinks=None, profile=None, extra_sinks=(), debug=False):
+    """ Run the model using the parameters in param_path.
+
+    Output is written to every sink in sinks. If sinks is None, the
+    sinks named by the output_sinks parameter are built, writing to
+    output_dir (relative to the parameter file) or model/output/.
+    Sinks in extra_sinks are written to as well. With debug, every
+    iteration and hop is logged at DEBUG level.
+    Unless the catalog parameter is False, the run is registered in
+    the run catalog at the end. If profile is a dictionary, the run
+    is profiled with profiling.Profiler(**profile), writing next to
+    the output files.
+
+    Returns a summary of the run: its run_id, seed, wall_time,
+    iterations_per_second, output_paths and summary metrics.
+    """
+    tic = time.perf_counter()
 
     logConf_path, log_path, schema_path, output_path = get_relative_paths()
 
@@ -25,139 +55,222 @@ def main(run_id, pid, param_path):
     # Set up logging
     #############################################################################
     
-    configure_logging(run_id, logConf_path, log_path)
+    configure_logging(run_id, logConf_path, log_path, debug)
     
     #############################################################################
     # Get and validate parameters
     #############################################################################
     
-    with open(schema_path, 'r') as s:
-        schema = yaml.safe_load(s.read())
-    with open(param_path, 'r') as p:
-        parameters = yaml.safe_load(p.read())
+    parameters = load_parameters(param_path, schema_path)
+    seed = seed_generators(parameters)
+    # Separate substreams for common random numbers, if requested
+    streams = build_random_streams(parameters, seed)
+    profiler = None
+    if profile is not None:
+        stem = get_output_path(parameters, param_path) / f'{parameters["filename_prefix"]}-{run_id}'
+        profiler = profiling.Profiler(stem, **profile)
+        profiler.start()
+
+    # The profiler covers the setup too, so stop it if the setup fails
     try:
-        validate(parameters, schema)
-    except exceptions.ValidationError as e:
-        print("Invalid configuration of param file at {param_path}. See the exception below:\n" )
-        raise e
-    if parameters['x_max'] % parameters['set_diam'] != 0:
-        print("Invalid configuration of param file at {param_path}: x_max must be divisible by set_diam.")
-        raise ValueError("x_max must be divisible by set_diam")
-    if parameters['x_max'] % parameters['num_subregions'] != 0:
-        print("Invalid configuration of param file at {param_path}: x_max must be divisible by num_subregions.")
-        raise ValueError("x_max must be divisible by num_subregions")
-
-    #############################################################################
-    #  Create model data and data structures
-    # TODO: Better names for d, h variables
-    #############################################################################
-
-    print(f'[{pid}] Building Bed and Model particle arrays...')
-    # Pre-compute d and h values for particle elevation placement
-        # see d and h here: https://math.stackexchange.com/questions/2293201/
-    d = np.divide(np.multiply(np.divide(parameters['set_diam'], 2), 
-                                        parameters['set_diam']), 
-                                        parameters['set_diam'])
-    h = np.sqrt(np.square(parameters['set_diam']) - np.square(d))
-    # Build the required structures for entrainment events
-    bed_particles, model_particles, model_supp, subregions = build_stream(parameters, h)
-
-    #############################################################################
-    #  Create entrainment data and data structures
-    #############################################################################
+        #############################################################################
+        #  Create model data and data structures
+        # TODO: Better names for d, h variables
+        #############################################################################
 
-    particle_age_array = np.ones(parameters['n_iterations'])*(-1)
-    particle_range_array = np.ones(parameters['n_iterations'])*(-1)
-    snapshot_counter = 0
+        print(f'[{pid}] Building Bed and Model particle arrays...')
+        h = compute_h(parameters['set_diam'])
+        # Build the required structures for entrainment events
+        bed_particles, model_particles, model_supp, subregions = build_stream(parameters, h)
 
-    #############################################################################
+        #############################################################################
+        #  Create entrainment data and data structures
+        #############################################################################
 
-    h5py_filename = f'{parameters["filename_prefix"]}-{run_id}.hdf5'
-    hdf5_path = f'{output_path}/{h5py_filename}'
+        particle_age_array = np.ones(parameters['n_iterations'])*(-1)
+        particle_range_array = np.ones(parameters['n_iterations'])*(-1)
+        # Per-subregion age distributions, if age_bins is set
+        age_statistics = stats_module.build_age_statistics(parameters, subregions)
+        # End of burn-in in the flux and age series, if stationarity_batch is set
+        monitor = stats_module.build_stationarity_monitor(parameters, subregions)
+        skip_burn_in_snapshots = parameters.get('skip_burn_in_snapshots', False)
+        stationary_iterations = parameters.get('stationary_iterations', 0)
+        # Per-particle hop count, travel distance and largest hop, if track_transport is set
+        transport = None
+        if parameters.get('track_transport', False):
+            transport = np.zeros((model_particles.shape[0], 3))
+        transport_interval = parameters.get('transport_interval', 0)
+        # Counters of the entrainment loop, logged every diagnostics_interval iterations
+        diagnostics = diagnostics_module.Diagnostics(parameters.get('diagnostics_interval', 1000))
+        # Crossings at the gauge positions, if gauges is set
+        gauges = None
+        if 'gauges' in parameters:
+            gauges = logic.Gauges(parameters['gauges'], parameters['n_iterations'])
+        snapshot_counter = 0
 
-    with h5py.File(hdf5_path, "a") as f: 
-        
-        grp_p = f.create_group(f'params')
-        for key, value in parameters.items():
-            grp_p[key] = value
+        #############################################################################
+        #  Set up output sinks
+        #############################################################################
 
-        grp_iv = f.create_group(f'initial_values')
-        grp_iv.create_dataset('bed', data=bed_particles)
-        grp_iv.create_dataset('model', data=model_particles)
+        if sinks is None:
+            sinks = build_output_sinks(parameters, param_path, run_id)
+        output = sinks_module.MultiSink(list(sinks) + list(extra_sinks))
+        # Subsets of particles recorded on their own intervals
+        snapshot_filters = filters_module.build_filters(parameters, model_particles)
+        for snapshot_filter in snapshot_filters:
+            output.declare_record(snapshot_filter.name, model_particles.shape[1])
+        if transport is not None and transport_interval > 0:
+            output.declare_record('transport', transport.shape[1])
+        output.open(run_id, parameters, bed_particles, model_particles)
+        # Views of the flux and age arrays, handed to the sinks periodically
+        flush_interval = parameters.get('flush_interval', 100)
+        live = {'subregions': {f'{subregion.getName()}-flux': subregion.getFluxList() 
+                                                        for subregion in subregions},
+                'avg_age': particle_age_array,
+                'age_range': particle_range_array}
+        if gauges is not None:
+            live['gauges'] = {f'gauge-{idx}-count': gauges.getCountList(idx) 
+                                                        for idx in range(gauges.getPositions().size)}
+        # Progress files for schedulers and monitoring, every progress_interval seconds
+        reporter = build_progress_reporter(parameters, param_path, run_id, output.paths)
+        iterations_run = 0
+        finished = False
+    except BaseException:
+        if profiler is not None:
+            profiler.stop()
+        raise
 
+    try:
         #############################################################################
         #  Entrainment iterations
         #############################################################################
 
         print(f'[{pid}] Bed and Model particles built. Beginning entrainments...')
+        timer = perf.PhaseTimer(observer=profiler.memory if profiler is not None else None)
+        loop_tic = time.perf_counter()
         for iteration in tqdm(range(parameters['n_iterations']), leave=False):
-            logging.info(ITERATION_HEADER.format(iteration=iteration))
+            timer.start()
+            logging.debug(ITERATION_HEADER, iteration)
             snapshot_counter += 1
 
-            # Calculate number of entrainment events iteration
-            e_events = np.random.poisson(parameters['lambda_1'], None)
-            # Select n (= e_events) particles, per-subregion, to be entrained
-            event_particle_ids = logic.get_event_particles(e_events, subregions,
-                                                        model_particles, 
-                                                        parameters['level_limit'], 
-                                                        parameters['height_dependancy'])
-            logging.info(ENTRAINMENT_HEADER.format(event_particles=event_particle_ids))
-            # Determine hop distances of all event particles
-            unverified_e = logic.compute_hops(event_particle_ids, model_particles, parameters['mu'],
-                                                    parameters['sigma'], normal=parameters['normal_dist'])
-            # Compute available vertices based on current model_particles state
-            avail_vertices = logic.compute_available_vertices(model_particles, 
-                                                        bed_particles,
-                                                        parameters['set_diam'],
-                                                        parameters['level_limit'],
-                                                        lifted_particles=event_particle_ids)
-            # Run entrainment event                    
-            model_particles, model_supp, subregions = run_entrainments(model_particles, 
+            event_particle_ids, model_particles, model_supp, subregions = run_iteration(
+                                                                    parameters,
+                                                                    model_particles,
                                                                     model_supp,
-                                                                    bed_particles, 
-                                                                    event_particle_ids,
-                                                                    avail_vertices, 
-                                                                    unverified_e,
+                                                                    bed_particles,
                                                                     subregions,
-                                                                    iteration,  
-                                                                    h)
+                                                                    iteration,
+                                                                    h,
+                                                                    timer,
+                                                                    transport,
+                                                                    gauges,
+                                                                    streams,
+                                                                    diagnostics.counters)
             # Compute age range and average age, store in np arrays
             age_range = np.max(model_particles[:,5]) - np.min(model_particles[:,5])
             particle_range_array[iteration] = age_range
 
             avg_age = np.average(model_particles[:,5]) 
             particle_age_array[iteration] = avg_age
+            if age_statistics is not None:
+                age_statistics.update(model_particles, iteration)
+            stopping = False
+            if monitor is not None:
+                monitor.update(iteration, [subregion.getFluxList()[iteration] 
+                                            for subregion in subregions] + [avg_age])
+                stopping = (stationary_iterations > 0 and 
+                            monitor.stationary_iterations(iteration) >= stationary_iterations)
+            timer.lap('age')
 
             # Record per-iteration information 
             if (snapshot_counter == parameters['data_save_interval']):
-                grp_i = f.create_group(f'iteration_{iteration}')
-                grp_i.create_dataset("model", data=model_particles, compression="gzip")
-                grp_i.create_dataset("event_ids", data=event_particle_ids, compression="gzip")
+                in_burn_in = monitor is not None and not monitor.stationary
+                if output.wants_snapshots and not (skip_burn_in_snapshots and in_burn_in):
+                    output.write_snapshot(iteration, model_particles, event_particle_ids)
                 snapshot_counter = 0
+            for snapshot_filter in snapshot_filters:
+                if snapshot_filter.due(iteration):
+                    output.write_record(snapshot_filter.name, iteration, 
+                                        snapshot_filter.select(model_particles))
+            if (transport is not None and transport_interval > 0 
+                    and (iteration + 1) % transport_interval == 0):
+                output.write_record('transport', iteration, transport)
+            if ((iteration + 1) % flush_interval == 0 
+                    or iteration == parameters['n_iterations'] - 1 or stopping):
+                output.write_progress(iteration, live)
+            diagnostics.end_iteration(iteration)
+            if reporter is not None:
+                reporter.update(iteration)
+            timer.lap('io')
+            timer.end_iteration()
+            iterations_run = iteration + 1
+            if stopping:
+                print(f'[{pid}] {stationary_iterations} stationary iterations reached, '
+                      f'stopping after iteration {iteration}')
+                break
+        loop_toc = time.perf_counter()
 
         #############################################################################
         # Store flux and age information
         #############################################################################
         
-        print(f'[{pid}] Writting flux and age information to shelf...')
-        grp_final = f.create_group(f'final_metrics')
-        grp_sub = grp_final.create_group(f'subregions')
-        for subregion in subregions:
-            name = f'{subregion.getName()}-flux'
-            flux_list = subregion.getFluxList()
-            grp_sub.create_dataset(name, data=flux_list, compression="gzip")
-
-        grp_final.create_dataset('avg_age', data=particle_age_array, compression="gzip")
-        grp_final.create_dataset('age_range', data=particle_range_array, compression="gzip")
+        print(f'[{pid}] Writting flux and age information to output...')
+        diagnostics.flush(iterations_run - 1)
+        results = {'final_metrics': truncate(live, iterations_run), 'perf': timer.results(),
+                   'diagnostics': diagnostics.results()}
+        if age_statistics is not None:
+            results['age_statistics'] = age_statistics.results()
+        if transport is not None:
+            results['transport'] = {'hop_count': transport[:,0].astype(np.int64),
+                                    'distance': transport[:,1],
+                                    'max_hop': transport[:,2]}
+        if monitor is not None:
+            results['stationarity'] = dict(monitor.results(), iterations=iterations_run,
+                                        stopped_early=iterations_run < parameters['n_iterations'])
+        output.write_results(results)
         print(f'[{pid}] Finished writing flux and age information.')
-
-        print(f'[{pid}] Model run finished successfully.')
-    return
+        print(f'[{pid}] Time per phase over {timer.iterations} iterations:\n{timer.report()}')
+        finished = True
+    finally:
+        output.close()
+        if reporter is not None:
+            reporter.finish(iterations_run - 1, 'finished' if finished else 'failed')
+        if profiler is not None:
+            profile_paths = profiler.stop()
+            print(f'[{pid}] Profile written to {", ".join(str(p) for p in profile_paths)}')
+
+    summary = {'run_id': run_id,
+               'seed': seed,
+               'wall_time': time.perf_counter() - tic,
+               'iterations_per_second': iterations_run / (loop_toc - loop_tic),
+               'output_paths': output.paths(),
+               'metrics': catalog_module.summary_metrics(subregions, 
+                                                particle_age_array[:iterations_run])}
+    if monitor is not None:
+        summary['metrics']['burn_in_iteration'] = monitor.burn_in_iteration
+    if parameters.get('catalog', True):
+        register_run(summary, parameters, param_path)
+
+    print(f'[{pid}] Model run finished successfully.')
+    return summary
 
 #############################################################################
 # Helper functions
 #############################################################################
 
+def truncate(metrics, length):
+    """ Return the nested dictionary of per-iteration arrays cut
+    to their first length entries """
+    return {key: truncate(value, length) if isinstance(value, dict) else value[:length]
+                                                for key, value in metrics.items()}
+
+def compute_h(set_diam):
+    """ Return h, the height of a particle's centre above the centres
+    of its two supports, used for particle elevation placement """
+    # see d and h here: https://math.stackexchange.com/questions/2293201/
+    d = np.divide(np.multiply(np.divide(set_diam, 2), set_diam), set_diam)
+    return np.sqrt(np.square(set_diam) - np.square(d))
+
 def build_stream(parameters, h):
     """ Build the data structures which define a stream
 
@@ -190,8 +303,88 @@ def build_stream(parameters, h):
     subregions = logic.define_subregions(parameters['x_max'], parameters['num_subregions'], parameters['n_iterations'])
     return bed_particles,model_particles, model_supp, subregions
 
+def run_iteration(parameters, model_particles, model_supp, bed_particles, subregions, 
+                                                        iteration, h, timer=None, accumulators=None,
+                                                        gauges=None, streams=None, counters=None):
+    """ Run one iteration of the model: select the event particles,
+    sample their hops, compute the available vertices and run the 
+    entrainment event.
+
+    Keyword arguments:
+        parameters -- dictionary of parameters passed for the model
+        model_particles -- array of all model particles 
+        model_supp -- array of ids representing supporting particles
+                                                for all model particles
+        bed_particles -- array of all bed particles
+        subregions -- array of subregion objects
+        iteration -- the current iteration
+        h -- geometric value to help with particle placement 
+        timer -- optional perf.PhaseTimer, lapped after every phase
+        accumulators -- optional per-particle transport totals, see
+                                                logic.move_model_particles
+        gauges -- optional logic.Gauges, updated with the crossings
+        streams -- optional function of the iteration returning random
+                            number generators, see build_random_streams
+        counters -- optional collections.Counter of the events and
+                                                hops, see diagnostics.py
+
+    Returns:
+        event_particle_ids -- array of ids of the entrained particles
+        model_particles -- updated array of all model particles 
+        model_supp -- updated array of ids representing supporting particles
+        subregions -- array of subregion objects with updated flux arrays
+    """
+    streams = dict.fromkeys(RANDOM_STREAMS) if streams is None else streams(iteration)
+    # Calculate number of entrainment events iteration
+    if streams['events'] is not None:
+        e_events = streams['events'].poisson(parameters['lambda_1'])
+    else:
+        e_events = np.random.poisson(parameters['lambda_1'], None)
+    # Select n (= e_events) particles, per-subregion, to be entrained
+    event_particle_ids = logic.get_event_particles(e_events, subregions,
+                                                model_particles, 
+                                                parameters['level_limit'], 
+                                                parameters['height_dependancy'],
+                                                rng=streams['subregions'],
+                                                counters=counters)
+    logging.debug(ENTRAINMENT_HEADER, event_particle_ids)
+    if timer is not None:
+        timer.lap('event_selection')
+    # Determine hop distances of all event particles
+    unverified_e = logic.compute_hops(event_particle_ids, model_particles, parameters['mu'],
+                                            parameters['sigma'], normal=parameters['normal_dist'],
+                                            rng=streams['hops'])
+    if timer is not None:
+        timer.lap('hop_sampling')
+    # Compute available vertices based on current model_particles state
+    avail_vertices = logic.compute_available_vertices(model_particles, 
+                                                bed_particles,
+                                                parameters['set_diam'],
+                                                parameters['level_limit'],
+                                                lifted_particles=event_particle_ids)
+    if timer is not None:
+        timer.lap('vertex_computation')
+    # Run entrainment event                    
+    model_particles, model_supp, subregions = run_entrainments(model_particles, 
+                                                            model_supp,
+                                                            bed_particles, 
+                                                            event_particle_ids,
+                                                            avail_vertices, 
+                                                            unverified_e,
+                                                            subregions,
+                                                            iteration,  
+                                                            h,
+                                                            timer,
+                                                            accumulators,
+                                                            gauges,
+                                                            counters,
+                                                            streams['order'])
+    return event_particle_ids, model_particles, model_supp, subregions
+
 def run_entrainments(model_particles, model_supp, bed_particles, event_particle_ids, avail_vertices, 
-                                                                    unverified_e, subregions, iteration, h):
+                                                        unverified_e, subregions, iteration, h, timer=None,
+                                                        accumulators=None, gauges=None, counters=None,
+                                                        rng=None):
     """ This function mimics a single entrainment event through
     calls to the entrainment-related logic functions. 
     
@@ -208,6 +401,15 @@ def run_entrainments(model_particles, model_supp, bed_particles, event_particle_
         bed_particles -- array of all bed particles
         event_particle_ids -- array of ids representing the particles
                                                 to be entrained this event
+        timer -- optional perf.PhaseTimer, lapped after the move, flux,
+                                                state update and age phases
+        accumulators -- optional per-particle transport totals, see
+                                                logic.move_model_particles
+        gauges -- optional logic.Gauges, updated with the crossings
+        counters -- optional collections.Counter of the hops, see 
+                                                logic.move_model_particles
+        rng -- optional numpy Generator ordering the event particles, see
+                                                logic.move_model_particles
         
     Returns:
         model_particles -- updated array of all model particles 
@@ -222,21 +424,166 @@ def run_entrainments(model_particles, model_supp, bed_particles, event_particle_
                                                                 model_supp, 
                                                                 bed_particles, 
                                                                 avail_vertices,
-                                                                h)
+                                                                h,
+                                                                accumulators,
+                                                                counters,
+                                                                rng)
+    if timer is not None:
+        timer.lap('move')
     final_x = model_particles[event_particle_ids][:,0]
-    subregions = logic.update_flux(initial_x, final_x, iteration, subregions)
+    subregions = logic.update_flux(initial_x, final_x, iteration, subregions, gauges)
+    if timer is not None:
+        timer.lap('flux')
     model_particles = logic.update_particle_states(model_particles, model_supp)
+    if timer is not None:
+        timer.lap('state_update')
     # Increment age at the end of each entrainment
     model_particles = logic.increment_age(model_particles, event_particle_ids)
+    if timer is not None:
+        timer.lap('age')
 
     return model_particles, model_supp, subregions
 
 
-def configure_logging(run_id, logConf_path, log_path):
-    """"Configure logging procedure using conf.yaml"""
+def load_parameters(param_path, schema_path):
+    """ Load the parameters in param_path and validate them against
+    the schema in schema_path. Raises ValidationError or ValueError
+    for an invalid configuration. """
+    with open(schema_path, 'r') as s:
+        schema = yaml.safe_load(s.read())
+    with open(param_path, 'r') as p:
+        parameters = yaml.safe_load(p.read())
+    try:
+        validate(parameters, schema)
+    except exceptions.ValidationError as e:
+        print("Invalid configuration of param file at {param_path}. See the exception below:\n" )
+        raise e
+    if parameters['x_max'] % parameters['set_diam'] != 0:
+        print("Invalid configuration of param file at {param_path}: x_max must be divisible by set_diam.")
+        raise ValueError("x_max must be divisible by set_diam")
+    if parameters['x_max'] % parameters['num_subregions'] != 0:
+        print("Invalid configuration of param file at {param_path}: x_max must be divisible by num_subregions.")
+        raise ValueError("x_max must be divisible by num_subregions")
+    return parameters
+
+
+def get_output_path(parameters, param_path):
+    """ Return output_dir (relative to the parameter file) if it is
+    set, otherwise model/output/ """
+    _, _, _, output_path = get_relative_paths()
+    if 'output_dir' in parameters:
+        output_path = Path(param_path).parent / parameters['output_dir']
+    return output_path
+
+
+def build_output_sinks(parameters, param_path, run_id):
+    """ Build the sinks named by the output_sinks parameter. Files are
+    written to the output path and named {filename_prefix}-{run_id}. """
+    output_path = get_output_path(parameters, param_path)
+    stem = f'{parameters["filename_prefix"]}-{run_id}'
+    return sinks_module.build_sinks(parameters.get('output_sinks', ['hdf5']), 
+                                                    output_path, stem)
+
+
+def seed_generators(parameters):
+    """ Seed numpy's and python's random number generators with the
+    seed parameter, or with a fresh random seed if it is not set.
+    Returns the seed used. """
+    seed = parameters.get('seed')
+    if seed is None:
+        seed = secrets.randbelow(2**32)
+    np.random.seed(seed)
+    random.seed(seed)
+    return seed
+
+
+RANDOM_STREAMS = ['events', 'subregions', 'hops', 'order']
+
+def build_random_streams(parameters, seed):
+    """ Return a function of the iteration giving independent random
+    number generators for the event counts, the selection of event
+    particles in the subregions, the hop quantiles and the order the
+    event particles move in, if the common_random_numbers parameter is
+    set. Otherwise return None and the global generators are used.
+
+    Each generator is seeded with (seed, stream, iteration) and draws a
+    fixed amount per iteration (one Poisson count, or one uniform per
+    model particle), so runs sharing a seed use the same random numbers
+    for each purpose in every iteration, whatever their mu or sigma and
+    however far their states have drifted apart. """
+    if not parameters.get('common_random_numbers', False):
+        return None
+    def streams(iteration):
+        return {name: np.random.default_rng([seed, stream, iteration])
+                    for stream, name in enumerate(RANDOM_STREAMS)}
+    return streams
+
+
+def get_progress_stem(parameters, param_path, name):
+    """ Return the stem of the progress files called name: in
+    progress_dir (relative to the parameter file) if it is set,
+    otherwise in the output path """
+    if 'progress_dir' in parameters:
+        return Path(param_path).parent / parameters['progress_dir'] / name
+    return get_output_path(parameters, param_path) / name
+
+
+def build_progress_reporter(parameters, param_path, run_id, output_paths):
+    """ Build the progress.ProgressReporter of a run, or None if
+    progress_interval is 0 """
+    interval = parameters.get('progress_interval', 10)
+    if interval <= 0:
+        return None
+    stem = get_progress_stem(parameters, param_path, f'{parameters["filename_prefix"]}-{run_id}')
+    return progress.ProgressReporter(stem, run_id, parameters['n_iterations'], interval,
+                                     parameters.get('progress_formats', ['json']), output_paths)
+
+
+def get_catalog_path(parameters, param_path):
+    """ Return the path of the catalog runs register in: catalog_path
+    (relative to the parameter file), by default catalog.sqlite in
+    the output path """
+    if 'catalog_path' in parameters:
+        return Path(param_path).parent / parameters['catalog_path']
+    return get_output_path(parameters, param_path) / 'catalog.sqlite'
+
+
+def register_run(summary, parameters, param_path):
+    """ Add a finished run to the catalog """
+    catalog_path = get_catalog_path(parameters, param_path)
+    os.makedirs(catalog_path.parent, exist_ok=True)
+    catalog = catalog_module.Catalog(catalog_path)
+    try:
+        catalog.register(summary['run_id'], parameters, 
+                         [os.path.abspath(path) for path in summary['output_paths']],
+                         summary['seed'], ENGINE, get_code_version(), summary['wall_time'],
+                         summary['iterations_per_second'], summary['metrics'])
+    finally:
+        catalog.close()
+
+
+def get_code_version():
+    """ Return the git description of the model code, or 'unknown' """
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], 
+                                cwd=Path(__file__).parent, capture_output=True, text=True)
+    except OSError:
+        return 'unknown'
+    return result.stdout.strip() if result.returncode == 0 else 'unknown'
+
+
+def make_run_id():
+    """ Return a new run ID: the date and hour plus a short uuid """
+    return datetime.now().strftime('%y%m-%d%H-') + uuid()
+
+
+def configure_logging(run_id, logConf_path, log_path, debug=False):
+    """"Configure logging procedure using conf.yaml, at DEBUG level if debug is set"""
     with open(logConf_path, 'r') as f:
         config = yaml.safe_load(f.read())
         config['handlers']['file']['filename'] = f'{log_path}/{run_id}.log'
+        if debug:
+            config['root']['level'] = 'DEBUG'
         logging.config.dictConfig(config)
 
 
@@ -249,22 +596,56 @@ def get_relative_paths():
     return logConf_path,log_path, schema_path, output_path
 
 
-if __name__ == '__main__':
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Run a single instance of the model')
+    parser.add_argument('param', help='Path to the parameter file')
+    parser.add_argument('--run-id', default=None, help='Run ID to use instead of a generated one')
+    parser.add_argument('--profile', action='store_true', 
+                        help='Write cProfile stats (.pstats) and sampled stacks (.collapsed) next to the output')
+    parser.add_argument('--profile-interval', type=float, default=0.005, 
+                        help='Seconds between stack samples in profiling mode')
+    parser.add_argument('--trace-memory', action='store_true', 
+                        help='In profiling mode, also trace memory with tracemalloc')
+    parser.add_argument('--memory-interval', type=int, default=0, 
+                        help='Dump tracemalloc snapshots at the phase boundaries of every n-th iteration')
+    parser.add_argument('--dry-run', action='store_true', 
+                        help='Validate the parameters and estimate wall time, memory and output size without running')
+    parser.add_argument('--debug', action='store_true', 
+                        help='Log every iteration and hop at DEBUG level (slow, large logs)')
+    parser.add_argument('--shared-memory', nargs=2, metavar=('NAME', 'ROW'), 
+                        help='Also write the flux and age series into row ROW of the shared '
+                             'ensemble arrays NAME (used by multiple_runs.py --live-interval)')
+    args = parser.parse_args()
+    profile = None
+    if args.profile or args.trace_memory:
+        profile = {'interval': args.profile_interval, 'trace_memory': args.trace_memory, 
+                   'memory_interval': args.memory_interval}
+    extra_sinks = []
+    if args.shared_memory is not None:
+        name, row = args.shared_memory
+        extra_sinks.append(sinks_module.SharedMemorySink(name, int(row)))
+    return args.param, args.run_id, profile, args.dry_run, extra_sinks, args.debug
+
 
-    # pr = cProfile.Profile()
-    # pr.enable()
+if __name__ == '__main__':
+    param_path, run_id, profile, dry_run, extra_sinks, debug = parse_arguments()
+    if dry_run:
+        import estimate
+        run_estimate = estimate.estimate(param_path)
+        print(estimate.format_estimate(run_estimate))
+        if not run_estimate['fits_on_disk']:
+            print('The output of this run would not fit on the disk.')
+            sys.exit(1)
+        sys.exit(0)
     tic = time.perf_counter()
-    uid = uuid()
     pid = os.getpid()
-    run_id = datetime.now().strftime('%y%m-%d%H-') + uid
+    if run_id is None:
+        run_id = make_run_id()
     print(f'Process [{pid}] run ID: {run_id}')
     
-    main(run_id, pid, sys.argv[1])
+    main(run_id, pid, param_path, profile=profile, extra_sinks=extra_sinks, debug=debug)
     toc = time.perf_counter()
     print(f"Completed in {toc - tic:0.4f} seconds")
 
-    # pr.disable()
-    # pr.dump_stats('profile_dump_nov_24')
-
     
     
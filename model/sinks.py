@@ -0,0 +1,646 @@
+"""
+Output sinks for model runs.
+
+A sink receives everything a run produces: the parameters and initial
+stream at the start, a snapshot of the model particles every
+data_save_interval iterations, and a nested dictionary of results
+(flux, age, ...) at the end. Sinks may also be handed the live flux and
+age arrays every flush_interval iterations, and named records (subsets
+of particles picked by the snapshot filters) on their own intervals. Any number of sinks can be
+active at once; run.main fans each write out to all of them.
+"""
+import os
+import time
+import logging
+import numpy as np
+import h5py
+import yaml
+from multiprocessing import shared_memory, resource_tracker
+
+
+class Sink():
+    """ Base class for all output sinks.
+
+    Every method is a no-op, so subclasses only need to
+    override the writes they care about. A sink which does not
+    want per-iteration snapshots should set wants_snapshots
+    to False so the run can skip building them.
+    """
+    wants_snapshots = True
+
+    def declare_record(self, name, width):
+        """ Announce, before open, a record which will be written
+        with rows of the given width. """
+        pass
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        pass
+
+    def write_snapshot(self, iteration, model_particles, event_ids):
+        pass
+
+    def write_record(self, name, iteration, rows):
+        pass
+
+    def write_progress(self, iteration, live):
+        """ Called every flush_interval iterations with the live
+        flux and age arrays, laid out as in final_metrics. Only
+        entries up to and including iteration are valid. """
+        pass
+
+    def write_results(self, results):
+        pass
+
+    def close(self):
+        pass
+
+    def paths(self):
+        """ Return the list of files/directories this sink writes to """
+        return []
+
+
+class NullSink(Sink):
+    """ Discard everything. Useful for benchmarking the simulation alone. """
+    wants_snapshots = False
+
+
+class MultiSink(Sink):
+    """ Fan each write out to a list of sinks. """
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+        self.wants_snapshots = any(sink.wants_snapshots for sink in self.sinks)
+
+    def declare_record(self, name, width):
+        for sink in self.sinks:
+            sink.declare_record(name, width)
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        for sink in self.sinks:
+            sink.open(run_id, parameters, bed_particles, model_particles)
+
+    def write_snapshot(self, iteration, model_particles, event_ids):
+        for sink in self.sinks:
+            if sink.wants_snapshots:
+                sink.write_snapshot(iteration, model_particles, event_ids)
+
+    def write_record(self, name, iteration, rows):
+        for sink in self.sinks:
+            sink.write_record(name, iteration, rows)
+
+    def write_progress(self, iteration, live):
+        for sink in self.sinks:
+            sink.write_progress(iteration, live)
+
+    def write_results(self, results):
+        for sink in self.sinks:
+            sink.write_results(results)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def paths(self):
+        return [path for sink in self.sinks for path in sink.paths()]
+
+
+class MemorySink(Sink):
+    """ Collect the run in memory.
+
+    After the run, the collected values are available as
+    attributes: parameters, bed, initial_model, snapshots
+    (a dict of iteration -> (model_particles, event_ids)),
+    records (a dict of name -> {iteration -> rows}) and results.
+    """
+    def __init__(self, snapshots=True):
+        self.wants_snapshots = snapshots
+        self.snapshots = {}
+        self.records = {}
+        self.results = {}
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        self.run_id = run_id
+        self.parameters = dict(parameters)
+        self.bed = bed_particles.copy()
+        self.initial_model = model_particles.copy()
+
+    def write_snapshot(self, iteration, model_particles, event_ids):
+        self.snapshots[iteration] = (model_particles.copy(), np.array(event_ids))
+
+    def write_record(self, name, iteration, rows):
+        self.records.setdefault(name, {})[iteration] = rows.copy()
+
+    def write_results(self, results):
+        self.results.update(results)
+
+
+class CallbackSink(Sink):
+    """ Pass every write to a user supplied callback.
+
+    The callback is called as callback(kind, payload) where kind
+    is one of 'open', 'snapshot', 'record', 'results' or 'close' and payload
+    is a dictionary. Arrays in the payload are live model arrays;
+    copy them if they need to outlive the call.
+    """
+    def __init__(self, callback, snapshots=True):
+        self.callback = callback
+        self.wants_snapshots = snapshots
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        self.callback('open', {'run_id': run_id, 'parameters': parameters,
+                                'bed': bed_particles, 'model': model_particles})
+
+    def write_snapshot(self, iteration, model_particles, event_ids):
+        self.callback('snapshot', {'iteration': iteration, 'model': model_particles,
+                                    'event_ids': event_ids})
+
+    def write_record(self, name, iteration, rows):
+        self.callback('record', {'name': name, 'iteration': iteration, 'rows': rows})
+
+    def write_results(self, results):
+        self.callback('results', results)
+
+    def close(self):
+        self.callback('close', {})
+
+
+class HDF5Sink(Sink):
+    """ The standard layout: one group per snapshot.
+
+    /params/<key>
+    /initial_values/{bed, model}
+    /iteration_<i>/{model, event_ids}
+    /records/<name>/iteration_<i>
+    /final_metrics/...
+    """
+    def __init__(self, path, snapshots=True):
+        self.path = path
+        self.wants_snapshots = snapshots
+        self.file = None
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        if self.file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.file = h5py.File(self.path, "a")
+        write_params(self.file.create_group('params'), parameters)
+        grp_iv = self.file.create_group('initial_values')
+        grp_iv.create_dataset('bed', data=bed_particles)
+        grp_iv.create_dataset('model', data=model_particles)
+
+    def write_snapshot(self, iteration, model_particles, event_ids):
+        grp_i = self.file.create_group(f'iteration_{iteration}')
+        grp_i.create_dataset("model", data=model_particles, compression="gzip")
+        grp_i.create_dataset("event_ids", data=event_ids, compression="gzip")
+
+    def write_record(self, name, iteration, rows):
+        grp_r = self.file.require_group(f'records/{name}')
+        grp_r.create_dataset(f'iteration_{iteration}', data=rows, compression="gzip")
+
+    def write_results(self, results):
+        write_nested(self.file, results)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def paths(self):
+        return [self.path]
+
+
+class CompactHDF5Sink(HDF5Sink):
+    """ The compact layout: all snapshots in a few chunked datasets.
+
+    /snapshots/model          (n_snapshots, n_particles, 7), one chunk per snapshot
+    /snapshots/iteration      (n_snapshots,)
+    /snapshots/event_ids      all event ids, concatenated
+    /snapshots/event_offsets  (n_snapshots + 1,) slice bounds into event_ids
+    /records/<name>/rows      all rows of the record, concatenated
+    /records/<name>/iteration (n_records,)
+    /records/<name>/offsets   (n_records + 1,) slice bounds into rows
+
+    params, initial_values and final_metrics are the same as
+    the standard layout. The root group carries a 'layout'
+    attribute set to 'compact'.
+    """
+    LAYOUT = 'compact'
+
+    def __init__(self, path, snapshots=True):
+        super().__init__(path, snapshots)
+        self.declared = {}
+
+    def declare_record(self, name, width):
+        self.declared[name] = width
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        super().open(run_id, parameters, bed_particles, model_particles)
+        self.file.attrs['layout'] = self.LAYOUT
+        n_particles = model_particles.shape[0]
+        grp_s = self.file.create_group('snapshots')
+        grp_s.create_dataset('model', shape=(0, n_particles, model_particles.shape[1]),
+                                maxshape=(None, n_particles, model_particles.shape[1]),
+                                chunks=(1, n_particles, model_particles.shape[1]),
+                                dtype=model_particles.dtype, compression="gzip")
+        grp_s.create_dataset('iteration', shape=(0,), maxshape=(None,),
+                                chunks=(1024,), dtype=np.int64)
+        grp_s.create_dataset('event_ids', shape=(0,), maxshape=(None,),
+                                chunks=(4096,), dtype=np.int64, compression="gzip")
+        grp_s.create_dataset('event_offsets', data=np.zeros(1, dtype=np.int64),
+                                maxshape=(None,), chunks=(1024,))
+        for name, width in self.declared.items():
+            self.create_record(name, width)
+
+    def create_record(self, name, width):
+        grp_r = self.file.create_group(f'records/{name}')
+        grp_r.create_dataset('rows', shape=(0, width), maxshape=(None, width),
+                                chunks=(1024, width), dtype=float, compression="gzip")
+        grp_r.create_dataset('iteration', shape=(0,), maxshape=(None,),
+                                chunks=(1024,), dtype=np.int64)
+        grp_r.create_dataset('offsets', data=np.zeros(1, dtype=np.int64),
+                                maxshape=(None,), chunks=(1024,))
+
+    def write_snapshot(self, iteration, model_particles, event_ids):
+        grp_s = self.file['snapshots']
+        append(grp_s['model'], model_particles[np.newaxis])
+        append(grp_s['iteration'], np.array([iteration]))
+        append(grp_s['event_ids'], np.asarray(event_ids, dtype=np.int64))
+        append(grp_s['event_offsets'], np.array([grp_s['event_ids'].shape[0]]))
+
+    def write_record(self, name, iteration, rows):
+        if f'records/{name}' not in self.file:
+            self.create_record(name, rows.shape[1])
+        grp_r = self.file[f'records/{name}']
+        append(grp_r['rows'], rows)
+        append(grp_r['iteration'], np.array([iteration]))
+        append(grp_r['offsets'], np.array([grp_r['rows'].shape[0]]))
+
+
+class SWMRHDF5Sink(CompactHDF5Sink):
+    """ The compact layout, written in HDF5 single-writer/multiple-reader mode.
+
+    The final_metrics datasets are created up front (flux as 0,
+    ages as -1) and filled in every flush_interval iterations,
+    along with /live/iteration, the last iteration flushed. Readers
+    can open the file with swmr=True while the run is going (see
+    plots/watch.py), and the file stays readable if the run dies.
+    When the run ends, normally or early, /live/finished is set to 1
+    and /live/n_iterations_run to the number of iterations run (also
+    stored as root attributes once the results are written).
+
+    SWMR mode does not allow new objects to be created, so only
+    records declared before open can be written. At the
+    end of the run the file is reopened normally to write the
+    results. If a reader still has the file open after
+    REOPEN_ATTEMPTS seconds, the results go to a -final.hdf5
+    sidecar file instead; everything flushed so far stays put.
+    """
+    REOPEN_ATTEMPTS = 30
+
+    def __init__(self, path, snapshots=True):
+        super().__init__(path, snapshots)
+        self.flushed = 0
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = h5py.File(self.path, "a", libver='latest')
+        super().open(run_id, parameters, bed_particles, model_particles)
+        n_iterations = parameters['n_iterations']
+        grp_final = self.file.create_group('final_metrics')
+        grp_sub = grp_final.create_group('subregions')
+        for region in range(parameters['num_subregions']):
+            grp_sub.create_dataset(f'subregion-{region}-flux', shape=(n_iterations,),
+                                    dtype=np.int64, fillvalue=0, compression="gzip")
+        for name in ['avg_age', 'age_range']:
+            grp_final.create_dataset(name, shape=(n_iterations,), dtype=float,
+                                    fillvalue=-1, compression="gzip")
+        if parameters.get('gauges'):
+            grp_gauges = grp_final.create_group('gauges')
+            for gauge in range(len(parameters['gauges'])):
+                grp_gauges.create_dataset(f'gauge-{gauge}-count', shape=(n_iterations,),
+                                    dtype=np.int64, fillvalue=0, compression="gzip")
+        grp_live = self.file.create_group('live')
+        grp_live.create_dataset('iteration', data=np.array([-1]))
+        grp_live.create_dataset('finished', data=np.array([0]))
+        grp_live.create_dataset('n_iterations_run', data=np.array([-1]))
+        self.file.swmr_mode = True
+
+    def write_progress(self, iteration, live):
+        start, stop = self.flushed, iteration + 1
+        grp_final = self.file['final_metrics']
+        for name, flux_list in live['subregions'].items():
+            grp_final['subregions'][name][start:stop] = flux_list[start:stop]
+        for name, counts in live.get('gauges', {}).items():
+            grp_final['gauges'][name][start:stop] = counts[start:stop]
+        for name in ['avg_age', 'age_range']:
+            grp_final[name][start:stop] = live[name][start:stop]
+        self.file['live']['iteration'][0] = iteration
+        self.flushed = stop
+        self.file.flush()
+
+    def write_results(self, results):
+        # Mark the run as done while readers can still see the file; the
+        # run may have stopped before n_iterations
+        n_iterations_run = self.flushed
+        self.file['live']['n_iterations_run'][0] = n_iterations_run
+        self.file['live']['finished'][0] = 1
+        self.file.flush()
+        # Reopen outside of SWMR mode so new groups can be created. Readers
+        # still holding the file block this, so wait for them for a while
+        # and otherwise write the results to a sidecar file.
+        self.file.close()
+        self.file = None
+        for _ in range(self.REOPEN_ATTEMPTS):
+            try:
+                self.file = h5py.File(self.path, "a", libver='latest')
+                break
+            except OSError:
+                time.sleep(1)
+        if self.file is None:
+            sidecar = self.path.replace('.hdf5', '-final.hdf5')
+            logging.warning(f'Could not reopen {self.path}, it is still open '
+                            f'elsewhere. Writing results to {sidecar}')
+            self.path = sidecar
+            self.file = h5py.File(self.path, "a")
+        write_nested(self.file, results)
+        self.file.attrs['finished'] = True
+        self.file.attrs['n_iterations_run'] = n_iterations_run
+
+
+class NumpySink(Sink):
+    """ Write the run as plain NumPy files in a directory.
+
+    Snapshots go into a single .npy memmap of shape
+    (n_snapshots, n_particles, 7) which can be opened later with
+    np.load(..., mmap_mode='r'). Event ids are concatenated with
+    an offsets array, as in the compact HDF5 layout, and so are
+    records. The initial stream, records and all results are stored
+    in results.npz with the nested keys joined by '/', and the
+    parameters in params.yaml.
+    """
+    def __init__(self, path, snapshots=True):
+        self.path = path
+        self.wants_snapshots = snapshots
+        self.snapshots = None
+        self.arrays = None
+        self.records = {}
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'params.yaml'), 'w') as p:
+            yaml.safe_dump(dict(parameters), p)
+        self.arrays = {'initial_values/bed': bed_particles.copy(),
+                        'initial_values/model': model_particles.copy()}
+        self.count = 0
+        self.iterations = []
+        self.event_ids = []
+        self.event_offsets = [0]
+        self.records = {}
+        interval = parameters['data_save_interval']
+        n_snapshots = parameters['n_iterations'] // interval if interval > 0 else 0
+        if self.wants_snapshots and n_snapshots > 0:
+            self.snapshots = np.lib.format.open_memmap(
+                                os.path.join(self.path, 'snapshots.npy'), mode='w+',
+                                dtype=model_particles.dtype,
+                                shape=(n_snapshots,) + model_particles.shape)
+
+    def write_snapshot(self, iteration, model_particles, event_ids):
+        self.snapshots[self.count] = model_particles
+        self.count += 1
+        self.iterations.append(iteration)
+        self.event_ids.extend(np.asarray(event_ids).tolist())
+        self.event_offsets.append(len(self.event_ids))
+
+    def write_record(self, name, iteration, rows):
+        self.records.setdefault(name, []).append((iteration, rows.copy()))
+
+    def write_results(self, results):
+        self.arrays.update(flatten(results))
+
+    def close(self):
+        if self.arrays is None:
+            return
+        if self.snapshots is not None:
+            self.snapshots.flush()
+            n_snapshots = len(self.snapshots)
+            self.snapshots = None
+            # A run which stopped early, or saved fewer snapshots than
+            # planned, would leave rows of zeros at the end
+            if self.count < n_snapshots:
+                truncate_npy(os.path.join(self.path, 'snapshots.npy'), self.count)
+            self.arrays['snapshots/iteration'] = np.array(self.iterations, dtype=np.int64)
+            self.arrays['snapshots/event_ids'] = np.array(self.event_ids, dtype=np.int64)
+            self.arrays['snapshots/event_offsets'] = np.array(self.event_offsets, dtype=np.int64)
+        for name, records in self.records.items():
+            rows = [record_rows for _, record_rows in records]
+            self.arrays[f'records/{name}/rows'] = np.concatenate(rows)
+            self.arrays[f'records/{name}/iteration'] = np.array([i for i, _ in records], dtype=np.int64)
+            self.arrays[f'records/{name}/offsets'] = np.cumsum([0] + [len(r) for r in rows])
+        np.savez(os.path.join(self.path, 'results.npz'), **self.arrays)
+
+    def paths(self):
+        return [self.path]
+
+
+class SharedArrays():
+    """ The flux and age series of an ensemble, in shared memory.
+
+    The ensemble runner creates the arrays and each run attaches
+    to them by name, writing its own row:
+
+        flux       (n_runs, n_subregions, n_iterations)  int64, 0 until written
+        age        (n_runs, 2, n_iterations)             avg_age and age_range, nan
+        progress   (n_runs,)                             last iteration written, -1
+
+    A run writes its series before its progress, so every entry up to
+    and including progress[row] is valid. Each array lives in its own
+    shared memory block, {name}-{array}, and {name}-shape holds the
+    dimensions so runs can attach without being told them.
+    """
+    def __init__(self, name, n_runs=None, n_subregions=None, n_iterations=None, create=False):
+        self.name = name
+        self.create = create
+        self.blocks = []
+        if create:
+            shape = np.array([n_runs, n_subregions, n_iterations], dtype=np.int64)
+            self.shape = self.block_array('shape', (3,), np.int64)
+            self.shape[:] = shape
+        else:
+            self.shape = self.block_array('shape', (3,), np.int64)
+        n_runs, n_subregions, n_iterations = (int(size) for size in self.shape)
+        self.flux = self.block_array('flux', (n_runs, n_subregions, n_iterations), np.int64)
+        self.age = self.block_array('age', (n_runs, 2, n_iterations), float)
+        self.progress = self.block_array('progress', (n_runs,), np.int64)
+        if create:
+            self.flux[:] = 0
+            self.age[:] = np.nan
+            self.progress[:] = -1
+
+    def block_array(self, key, shape, dtype):
+        """ Create or attach to block {name}-{key} and return an array over it """
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        if self.create:
+            block = shared_memory.SharedMemory(f'{self.name}-{key}', create=True, size=size)
+        else:
+            block = shared_memory.SharedMemory(f'{self.name}-{key}')
+            # Attaching registers the block with this process's resource
+            # tracker, which would unlink it when the process exits. Only
+            # the creator may unlink it (https://bugs.python.org/issue39959)
+            resource_tracker.unregister(block._name, 'shared_memory')
+        self.blocks.append(block)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def close(self):
+        """ Detach from the blocks, and remove them if they were created here """
+        # The arrays must go before the buffers they point into
+        self.shape = self.flux = self.age = self.progress = None
+        for block in self.blocks:
+            block.close()
+            if self.create:
+                block.unlink()
+        self.blocks = []
+
+
+class SharedMemorySink(Sink):
+    """ Write the flux and age series of the run into row of the
+    SharedArrays called name, every flush_interval iterations. """
+    wants_snapshots = False
+
+    def __init__(self, name, row):
+        self.name = name
+        self.row = row
+        self.arrays = None
+        self.flushed = 0
+
+    def open(self, run_id, parameters, bed_particles, model_particles):
+        self.arrays = SharedArrays(self.name)
+
+    def write_progress(self, iteration, live):
+        start, stop = self.flushed, iteration + 1
+        flux, age = self.arrays.flux[self.row], self.arrays.age[self.row]
+        for idx, flux_list in enumerate(live['subregions'].values()):
+            flux[idx, start:stop] = flux_list[start:stop]
+        age[0, start:stop] = live['avg_age'][start:stop]
+        age[1, start:stop] = live['age_range'][start:stop]
+        self.arrays.progress[self.row] = iteration
+        self.flushed = stop
+
+    def close(self):
+        if self.arrays is not None:
+            self.arrays.close()
+            self.arrays = None
+
+
+#############################################################################
+# Sink construction
+#############################################################################
+
+SINK_TYPES = ['hdf5', 'compact', 'swmr', 'numpy', 'memory', 'null']
+
+def build_sinks(names, output_path, stem):
+    """ Build the sinks named in the parameter file.
+
+    Keyword arguments:
+        names -- list of sink names, each one of SINK_TYPES
+        output_path -- directory the file-based sinks write to
+        stem -- filename (without extension) for this run
+
+    Returns:
+        sinks -- list of sink objects
+    """
+    sinks = []
+    for name in names:
+        base = os.path.join(output_path, stem)
+        if name == 'hdf5':
+            sinks.append(HDF5Sink(f'{base}.hdf5'))
+        elif name == 'compact':
+            sinks.append(CompactHDF5Sink(f'{base}-compact.hdf5'))
+        elif name == 'swmr':
+            sinks.append(SWMRHDF5Sink(f'{base}-live.hdf5'))
+        elif name == 'numpy':
+            sinks.append(NumpySink(f'{base}-npy'))
+        elif name == 'memory':
+            sinks.append(MemorySink())
+        elif name == 'null':
+            sinks.append(NullSink())
+        else:
+            raise ValueError(f'Unknown output sink {name}, expected one of {SINK_TYPES}')
+    return sinks
+
+
+#############################################################################
+# Helper functions
+#############################################################################
+
+def write_params(group, parameters):
+    """ Write each parameter to group. Scalars are stored as is,
+    lists and mappings are stored as YAML strings with an
+    'encoding' attribute so readers can decode them. """
+    for key, value in parameters.items():
+        if isinstance(value, (list, tuple, dict)):
+            group[key] = yaml.safe_dump(value, default_flow_style=True).strip()
+            group[key].attrs['encoding'] = 'yaml'
+        else:
+            group[key] = value
+
+
+def write_nested(group, results):
+    """ Recursively write a nested dictionary of arrays to an HDF5 group.
+    Datasets which already exist are overwritten in place, or
+    replaced if their shape changed. """
+    for key, value in results.items():
+        if isinstance(value, dict):
+            sub = group[key] if key in group else group.create_group(key)
+            write_nested(sub, value)
+        elif key in group and group[key].shape == np.shape(value):
+            group[key][...] = value
+        else:
+            if key in group:
+                del group[key]
+            value = np.asarray(value)
+            if value.dtype.kind == 'U':
+                group.create_dataset(key, data=value.astype(object),
+                                        dtype=h5py.special_dtype(vlen=str))
+            elif value.ndim > 0 and value.size > 0:
+                group.create_dataset(key, data=value, compression="gzip")
+            else:
+                group.create_dataset(key, data=value)
+
+
+def flatten(results, prefix=''):
+    """ Flatten a nested dictionary, joining keys with '/' """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}/'))
+        else:
+            flat[f'{prefix}{key}'] = np.asarray(value)
+    return flat
+
+
+def truncate_npy(path, n_rows):
+    """ Shrink the .npy file at path to its first n_rows rows, in place.
+
+    The header is rewritten with the new shape, padded to its old
+    length so that the data does not move, and the file truncated.
+    """
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        data_start = f.tell()
+        header_start = f.seek(len(np.lib.format.magic(*version)) + (2 if version == (1, 0) else 4))
+        header = repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                       'fortran_order': fortran_order,
+                       'shape': (n_rows,) + shape[1:]})
+        f.write(header.ljust(data_start - header_start - 1).encode('latin1') + b'\n')
+        f.truncate(data_start + n_rows * int(np.prod(shape[1:])) * dtype.itemsize)
+
+
+def append(dataset, data):
+    """ Append data along the first axis of a resizable dataset """
+    if data.shape[0] == 0:
+        return
+    n = dataset.shape[0]
+    dataset.resize(n + data.shape[0], axis=0)
+    dataset[n:] = data
@@ -0,0 +1,288 @@
+"""
+Online statistics of a run, kept in the entrainment loop.
+
+AgeStatistics keeps per-subregion age distributions. Every iteration
+the ages of the in-stream particles are binned per subregion with one
+bincount, and the mean and variance of each subregion are merged into
+running totals (Welford's update, in the batched form of Chan et
+al.). Every interval iterations the
+statistics of the iterations since the last record are stored, so the
+output is O(subregions x bins) per record instead of O(particles) per
+snapshot:
+
+    iteration         (n_records,)              last iteration of each record
+    histogram         (n_records, n_sub, n_bins) age counts over the record
+    mean, variance    (n_records, n_sub)        age over the record
+    active_fraction   (n_records, n_sub)        fraction of active particles
+    running_mean,
+    running_variance  (n_records, n_sub)        age since the first iteration
+
+Bin k holds ages in [bin_edges[k], bin_edges[k+1]); the last bin holds
+every age >= bin_edges[-1].
+
+A StationarityMonitor watches the flux and average age series for the
+end of burn-in, using batch means. EnsembleMoments keeps the mean and
+variance across the runs of an ensemble while they run, and
+confidence_interval summarises a metric over the finished runs.
+"""
+import numpy as np
+from scipy import stats as scipy_stats
+
+
+class AgeStatistics():
+    """ Streaming age statistics of the particles in each subregion.
+
+    Keyword arguments:
+        names -- names of the subregions
+        boundaries -- right boundary of each subregion, ascending
+        bin_edges -- ascending lower edges of the age bins
+        interval -- iterations per record
+        n_iterations -- number of iterations of the run
+    """
+    def __init__(self, names, boundaries, bin_edges, interval, n_iterations):
+        self.names = list(names)
+        self.boundaries = np.asarray(boundaries, dtype=float)
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        if np.any(np.diff(self.bin_edges) <= 0):
+            raise ValueError('Age bin edges must be strictly increasing')
+        self.interval = interval
+        n_sub, n_bins = len(self.names), self.bin_edges.size
+        n_records = n_iterations // interval
+
+        self.iteration = np.full(n_records, -1, dtype=np.int64)
+        self.histogram = np.zeros((n_records, n_sub, n_bins), dtype=np.int64)
+        self.mean = np.full((n_records, n_sub), np.nan)
+        self.variance = np.full((n_records, n_sub), np.nan)
+        self.active_fraction = np.full((n_records, n_sub), np.nan)
+        self.running_mean = np.full((n_records, n_sub), np.nan)
+        self.running_variance = np.full((n_records, n_sub), np.nan)
+        self.records = 0
+
+        # (count, mean, M2) since the last record and since the start
+        self.window = [np.zeros(n_sub), np.zeros(n_sub), np.zeros(n_sub)]
+        self.total = [np.zeros(n_sub), np.zeros(n_sub), np.zeros(n_sub)]
+        self.window_histogram = np.zeros((n_sub, n_bins), dtype=np.int64)
+        self.window_active = np.zeros(n_sub)
+
+    def update(self, model_particles, iteration):
+        """ Add the ages of the in-stream particles at iteration and
+        store a record every interval iterations. """
+        in_stream = model_particles[model_particles[:,0] >= 0]
+        n_sub, n_bins = self.window_histogram.shape
+        subregion = np.minimum(np.searchsorted(self.boundaries, in_stream[:,0], side='right'),
+                               n_sub - 1)
+        ages = in_stream[:,5]
+        age_bin = np.clip(np.searchsorted(self.bin_edges, ages, side='right') - 1, 0, n_bins - 1)
+
+        self.window_histogram += np.bincount(subregion * n_bins + age_bin,
+                                             minlength=n_sub * n_bins).reshape(n_sub, n_bins)
+        count = np.bincount(subregion, minlength=n_sub).astype(float)
+        self.window_active += np.bincount(subregion, weights=in_stream[:,4], minlength=n_sub)
+        mean = np.divide(np.bincount(subregion, weights=ages, minlength=n_sub), count,
+                         out=np.zeros(n_sub), where=count > 0)
+        m2 = np.bincount(subregion, weights=np.square(ages - mean[subregion]), minlength=n_sub)
+        for moments in [self.window, self.total]:
+            merge(moments, count, mean, m2)
+
+        if (iteration + 1) % self.interval == 0 and self.records < self.iteration.size:
+            self.record(iteration)
+
+    def record(self, iteration):
+        """ Store the statistics since the last record and reset them """
+        row = self.records
+        count, mean, m2 = self.window
+        self.iteration[row] = iteration
+        self.histogram[row] = self.window_histogram
+        self.mean[row] = np.where(count > 0, mean, np.nan)
+        self.variance[row] = variance(count, m2)
+        self.active_fraction[row] = np.divide(self.window_active, count,
+                                              out=np.full(count.size, np.nan), where=count > 0)
+        self.running_mean[row] = np.where(self.total[0] > 0, self.total[1], np.nan)
+        self.running_variance[row] = variance(self.total[0], self.total[2])
+        self.records += 1
+
+        self.window = [np.zeros_like(count), np.zeros_like(count), np.zeros_like(count)]
+        self.window_histogram[:] = 0
+        self.window_active[:] = 0
+
+    def results(self):
+        """ Return the recorded time series as a nested dictionary for the sinks """
+        return {'subregions': np.array(self.names),
+                'bin_edges': self.bin_edges,
+                'iteration': self.iteration[:self.records],
+                'histogram': self.histogram[:self.records],
+                'mean': self.mean[:self.records],
+                'variance': self.variance[:self.records],
+                'active_fraction': self.active_fraction[:self.records],
+                'running_mean': self.running_mean[:self.records],
+                'running_variance': self.running_variance[:self.records]}
+
+
+def merge(moments, count, mean, m2):
+    """ Merge a batch (count, mean, M2) into moments, in place """
+    total_count = moments[0] + count
+    delta = mean - moments[1]
+    share = np.divide(count, total_count, out=np.zeros_like(count), where=total_count > 0)
+    moments[1] += delta * share
+    moments[2] += m2 + np.square(delta) * moments[0] * share
+    moments[0] = total_count
+
+
+def variance(count, m2):
+    """ Sample variance from a count and M2, nan with fewer than 2 samples """
+    return np.divide(m2, count - 1, out=np.full(count.shape, np.nan), where=count > 1)
+
+
+def build_age_statistics(parameters, subregions):
+    """ Build the AgeStatistics requested by the age_bins and
+    age_stats_interval parameters, or None if age_bins is not set. """
+    if 'age_bins' not in parameters:
+        return None
+    return AgeStatistics([subregion.getName() for subregion in subregions],
+                         [subregion.rightBoundary() for subregion in subregions],
+                         parameters['age_bins'],
+                         parameters.get('age_stats_interval', 1),
+                         parameters['n_iterations'])
+
+
+class StationarityMonitor():
+    """ Detect the end of burn-in from batch means of a set of series.
+
+    Every series (e.g. the flux of each subregion and the average
+    age) is averaged over batches of batch_size iterations. Once
+    window batches are complete, the mean of the older and the newer
+    half of the window are compared for every series after each batch;
+    when no difference is larger than z standard errors (estimated from
+    the spread of the batch means in each half), the series are taken
+    as stationary and burn-in ends at the first iteration of the window.
+
+    Keyword arguments:
+        names -- names of the series
+        batch_size -- iterations per batch
+        window -- batches compared at a time (at least 4)
+        z -- number of standard errors a difference may reach
+    """
+    def __init__(self, names, batch_size, window=10, z=1.96):
+        if window < 4:
+            raise ValueError('The stationarity window must hold at least 4 batches')
+        self.names = list(names)
+        self.batch_size = batch_size
+        self.window = window
+        self.z = z
+        self.batch_sum = np.zeros(len(self.names))
+        self.batch_means = []
+        self.burn_in_iteration = -1
+        self.detected_iteration = -1
+
+    @property
+    def stationary(self):
+        return self.burn_in_iteration >= 0
+
+    def update(self, iteration, values):
+        """ Add the values of every series at iteration """
+        self.batch_sum += values
+        if (iteration + 1) % self.batch_size != 0:
+            return
+        self.batch_means.append(self.batch_sum / self.batch_size)
+        self.batch_sum = np.zeros(len(self.names))
+        if not self.stationary and len(self.batch_means) >= self.window:
+            if self.window_is_stationary(np.array(self.batch_means[-self.window:])):
+                self.burn_in_iteration = (len(self.batch_means) - self.window) * self.batch_size
+                self.detected_iteration = iteration
+
+    def window_is_stationary(self, means):
+        """ Compare the halves of a (window, n_series) array of batch means """
+        half = means.shape[0] // 2
+        older, newer = means[:half], means[half:]
+        difference = np.abs(newer.mean(axis=0) - older.mean(axis=0))
+        error = np.sqrt(older.var(axis=0, ddof=1) / older.shape[0]
+                        + newer.var(axis=0, ddof=1) / newer.shape[0])
+        return bool(np.all(difference <= self.z * error))
+
+    def stationary_iterations(self, iteration):
+        """ Number of iterations up to and including iteration since
+        burn-in ended, 0 while still in burn-in """
+        return iteration + 1 - self.burn_in_iteration if self.stationary else 0
+
+    def results(self):
+        """ Return the burn-in point and batch means as a nested dictionary for the sinks """
+        means = np.array(self.batch_means).reshape(-1, len(self.names))
+        return {'burn_in_iteration': self.burn_in_iteration,
+                'detected_iteration': self.detected_iteration,
+                'batch_size': self.batch_size,
+                'window': self.window,
+                'batch_means': {name: means[:,idx] for idx, name in enumerate(self.names)}}
+
+
+def build_stationarity_monitor(parameters, subregions):
+    """ Build the StationarityMonitor requested by the stationarity_batch
+    and stationarity_window parameters over the flux of every subregion
+    and the average age, or None if stationarity_batch is not set. """
+    if 'stationarity_batch' not in parameters:
+        return None
+    names = [f'{subregion.getName()}-flux' for subregion in subregions] + ['avg_age']
+    return StationarityMonitor(names, parameters['stationarity_batch'],
+                               parameters.get('stationarity_window', 10))
+
+
+class EnsembleMoments():
+    """ Running mean and variance across runs of per-iteration series.
+
+    Runs are added piece by piece as they progress: every update
+    merges the entries start:stop of one run's series (Welford's
+    update), so each iteration holds the moments of the runs which
+    have reached it. A run may have fewer series than the ensemble,
+    e.g. fewer subregions; each series then holds the moments of the
+    runs which have it.
+
+    Keyword arguments:
+        n_series -- number of series per run
+        n_iterations -- length of the series
+    """
+    def __init__(self, n_series, n_iterations):
+        self.count = np.zeros((n_series, n_iterations))
+        self.mean = np.zeros((n_series, n_iterations))
+        self.m2 = np.zeros((n_series, n_iterations))
+
+    def update(self, values, start, stop, n_series=None):
+        """ Merge the entries start:stop of a (n_series, n_iterations)
+        array, or of only its first n_series series """
+        if stop <= start:
+            return
+        n_series = values.shape[0] if n_series is None else n_series
+        values = values[:n_series, start:stop]
+        count, mean, m2 = (self.count[:n_series, start:stop], self.mean[:n_series, start:stop],
+                           self.m2[:n_series, start:stop])
+        count += 1
+        delta = values - mean
+        mean += delta / count
+        m2 += delta * (values - mean)
+
+    def results(self):
+        """ Return the number of runs, mean and variance of every entry """
+        return {'count': self.count[0].astype(np.int64),
+                'series_count': self.count.astype(np.int64),
+                'mean': np.where(self.count > 0, self.mean, np.nan),
+                'variance': variance(self.count, self.m2)}
+
+
+def confidence_interval(values, confidence=0.95):
+    """ Return the mean of values and the half-width of its Student-t
+    confidence interval, which is inf with fewer than 2 values. """
+    values = np.asarray(values, dtype=float)
+    mean = float(np.mean(values)) if values.size else np.nan
+    if values.size < 2:
+        return mean, np.inf
+    quantile = scipy_stats.t.ppf(0.5 + confidence / 2, values.size - 1)
+    return mean, float(quantile * np.std(values, ddof=1) / np.sqrt(values.size))
+
+
+def relative_half_width(values, confidence=0.95):
+    """ Half-width of the confidence interval of the mean of values
+    relative to the mean, inf while it cannot be estimated """
+    mean, half_width = confidence_interval(values, confidence)
+    if not np.isfinite(half_width):
+        return np.inf
+    if mean == 0:
+        return 0.0 if half_width == 0 else np.inf
+    return half_width / abs(mean)
@@ -1,67 +1,131 @@
 import numpy as np
-import h5py
 import argparse
 import os
+import sys
+import multiprocessing
+import matplotlib
 
 import plotting
+from reader import RunReader
 
 
-def main(filename, save_location, iter_min, iter_max):
+IF_EXISTS = ['ask', 'overwrite', 'skip', 'abort']
+
+
+def main(filename, save_location, iter_min, iter_max, processes=1, if_exists=None,
+                                            animation='gif', frames=True):
+    """ Plot the stream bed for iterations iter_min to iter_max, an animation
+    of it, and the flux and age plots of a run.
+
+    Keyword arguments:
+        filename -- path to the hdf5 file of the run
+        save_location -- directory the plots are written to
+        iter_min, iter_max -- range of iterations to plot
+        processes -- number of processes rendering the stream bed frames
+        if_exists -- what to do when save_location exists: ask, overwrite,
+                     skip (keep frames already rendered) or abort. By
+                     default ask if stdin is a terminal, otherwise abort.
+        animation -- format of the stream bed animation: gif, webp or apng
+        frames -- whether to write a png of each frame. If False the
+                  frames are encoded straight into the animation, in
+                  this process.
+    """
     # Path to run-info file
     fp_in = filename
     # Path to output directory
     fp_out = save_location + '/'
     # Range to plot
-    iteration_range = [iter_min, iter_max] 
+    iteration_range = [iter_min, iter_max]
     # Plot height
     y_limit = 10
 
     # Make appropriate sub-directory if it doesn't exist already
     # Don't overwrite data without user's permission
-    try: 
+    try:
         os.mkdir(save_location)
         print(f'Creating output directory...')
     except FileExistsError:
-        while True: 
+        if if_exists is None:
+            if_exists = 'ask' if sys.stdin.isatty() else 'abort'
+        while if_exists == 'ask':
             response = input(f'Directory {save_location}/ already exists. You could be overwriting existing data, continue (Y/N)? ')
             if response.lower() == 'y':
-                print(f'Continuing with plotting script...')
-                break 
+                if_exists = 'overwrite'
             elif response.lower() == 'n':
-                print('Exiting plotting script...')
-                return 
+                if_exists = 'abort'
+        if if_exists == 'abort':
+            print('Exiting plotting script...')
+            return
+        print(f'Continuing with plotting script...')
 
-    with h5py.File(fp_in, 'r') as f:
-        subregion_max = f['params']['num_subregions'][()]
-        ds_boundary_key = f'subregion-{subregion_max-1}-flux' 
-        # Plot stream bed for iter_min to iter_max
-        #   This method assumes plotting iteration 0 means plotting
-        #   the model particles at the start of iteration 0. Since the
-        #   model particles are stored (runpy) at the end of each iteration, 
-        #   we need to plot 1 index back.
+    # Plot stream bed for iter_min to iter_max
+    iterations = range(iteration_range[0], iteration_range[1]+1)
+    if frames:
         print(f'Plotting stream bed...')
-        for iter in range(iteration_range[0], iteration_range[1]+1):
-            if iter == 0:
-                model_particles = np.array(f['initial_values']['model'])
-            else:
-                model_particles = np.array(f[f'iteration_{iter-1}']['model'])
-            plotting.stream(iter,   np.array(f['initial_values']['bed']), 
-                                    model_particles, 
-                                    f['params']['x_max'][()], 
-                                    y_limit, 
-                                    fp_out)
-        print(f'Creating gif of stream bed...')
-        # Create a gif of the stream bed for iter_min to iter_max
-        plotting.stream_gif(iter_min, iter_max, fp_out)
-       
+        render_stream(fp_in, fp_out, iterations, y_limit, processes, if_exists == 'skip')
+        print(f'Creating {animation} of stream bed...')
+        # Create an animation of the stream bed for iter_min to iter_max
+        plotting.stream_animation(iter_min, iter_max + 1, fp_out, animation)
+    else:
+        print(f'Creating {animation} of stream bed...')
+        animate_stream(fp_in, fp_out + f'simulation_snapshot.{animation}', iterations, y_limit)
+
+    with RunReader(fp_in) as run:
         print(f'Plotting flux and age plot...')
         # Plot downstream boundary crossing histogram
-        plotting.crossing_info(f['final_metrics']['subregions'][ds_boundary_key][()], 
-                                f['params']['n_iterations'][()], 1, fp_out)
+        plotting.crossing_info(run.flux(-1), run.params['n_iterations'], 1, fp_out)
         # Plot timeseries of particle age and downstream crossings
-        plotting.crossing_info2(f['final_metrics']['subregions'][ds_boundary_key][()], 
-                                np.array(f['final_metrics']['avg_age']),
-                                f['params']['n_iterations'][()], 1, fp_out)
+        plotting.crossing_info2(run.flux(-1), run.avg_age(),
+                                run.params['n_iterations'], 1, fp_out)
+
+def render_stream(fp_in, fp_out, iterations, y_limit, processes=1, skip_existing=False):
+    """ Render the stream bed frames of iterations, split into contiguous
+    chunks over a pool of processes. Returns the frame paths in order. """
+    if len(iterations) == 0:
+        return []
+    n_chunks = min(len(iterations), processes * 4) if processes > 1 else 1
+    chunks = [(fp_in, fp_out, list(chunk), y_limit, skip_existing)
+                        for chunk in np.array_split(np.asarray(iterations), n_chunks)]
+    if processes <= 1:
+        results = [render_chunk(*chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(render_chunk, chunks)
+    return [path for paths in results for path in paths]
+
+def render_chunk(fp_in, fp_out, iterations, y_limit, skip_existing=False):
+    """ Render the stream bed frames of iterations. The file is opened,
+    and the bed read, once per chunk. Frame iter shows the model
+    particles at the start of iteration iter (see RunReader.state_at). """
+    matplotlib.use('Agg')
+    paths = []
+    with RunReader(fp_in) as run:
+        renderer = plotting.StreamRenderer(run.bed, run.params['x_max'], y_limit, fp_out)
+        try:
+            for iter in iterations:
+                iter = int(iter)
+                path = fp_out + f'iter{iter}.png'
+                if skip_existing and os.path.exists(path):
+                    paths.append(path)
+                    continue
+                paths.append(renderer.render(iter, run.state_at(iter)))
+        finally:
+            renderer.close()
+    return paths
+
+def animate_stream(fp_in, path, iterations, y_limit, duration=150):
+    """ Render the stream bed frames of iterations in memory and encode
+    them into the animation at path, one frame at a time """
+    matplotlib.use('Agg')
+    with RunReader(fp_in) as run:
+        renderer = plotting.StreamRenderer(run.bed, run.params['x_max'], y_limit, None)
+        try:
+            with plotting.AnimationWriter(path, duration=duration) as writer:
+                for iter in iterations:
+                    writer.add(renderer.frame(iter, run.state_at(iter)))
+        finally:
+            renderer.close()
+    return path
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Plotting script using the Python shelf files created by a py_BeRCM model run')
@@ -69,10 +133,25 @@ def parse_arguments():
     parser.add_argument('save_location', help='Path to plot output location')
     parser.add_argument('iter_min', help='First iteration for stream plot')
     parser.add_argument('iter_max', help='Final iteration for stream plot')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes rendering the stream plots')
+    parser.add_argument('--if-exists', choices=IF_EXISTS, default=None,
+                        help='When the output directory exists: ask, overwrite it, skip frames already rendered, '
+                             'or abort (default: ask from a terminal, otherwise abort)')
+    parser.add_argument('--animation', choices=plotting.ANIMATION_FORMATS, default='gif',
+                        help='Format of the stream animation. WebP and APNG frames are held in memory until '
+                             f'the end, so they are limited to {plotting.MAX_BUFFERED_FRAMES} iterations; '
+                             'gif is written frame by frame and has no limit')
+    parser.add_argument('--no-frames', action='store_true', help='Encode the stream frames straight into the animation without writing pngs')
     args = parser.parse_args()
-    return args.path_to_file, args.save_location, int(args.iter_min), int(args.iter_max)
+    n_frames = int(args.iter_max) - int(args.iter_min) + 1
+    if args.animation != 'gif' and n_frames > plotting.MAX_BUFFERED_FRAMES:
+        parser.error(f'--animation {args.animation} is limited to {plotting.MAX_BUFFERED_FRAMES} '
+                     f'iterations, {n_frames} requested. Use gif, or a smaller range.')
+    return (args.path_to_file, args.save_location, int(args.iter_min), int(args.iter_max),
+            args.processes, args.if_exists, args.animation, not args.no_frames)
 
 if __name__ == '__main__':
     # TODO: Replace save location param with the filename parsed of path and format
-    path_to_file, save_location, iter_min, iter_max = parse_arguments()
-    main(path_to_file, save_location, iter_min, iter_max)
\ No newline at end of file
+    (path_to_file, save_location, iter_min, iter_max, processes, if_exists,
+                                                animation, frames) = parse_arguments()
+    main(path_to_file, save_location, iter_min, iter_max, processes, if_exists, animation, frames)
@@ -2,74 +2,230 @@
 All things plotting related.
 Most of this code created by Dr. Shawn Chartrand.
 """
+import os
 import numpy as np
+import h5py
 import matplotlib
 from matplotlib import pyplot as plt
-from matplotlib.collections import PatchCollection
-from matplotlib.patches import Circle
-from scipy.optimize import curve_fit
+from matplotlib.collections import EllipseCollection
 from scipy.special import factorial
-from PIL import Image
+from PIL import Image, GifImagePlugin
+
+
+ANIMATION_FORMATS = ['gif', 'webp', 'apng']
+# Pillow holds every WebP and APNG frame until the file is written; a
+# 2000 x 650 stream frame is about 4 MB, so this is about 1 GB
+MAX_BUFFERED_FRAMES = 250
+
+
+class StreamRenderer():
+    """ Render the stream from 0,0 to x_lim and y_lim, one iteration at
+    a time. Bed particles are plotted as light grey and model particles
+    are coloured by age.
+
+    The figure, the bed and the colorbar are built once. Each frame only
+    moves the model particles and recolours them, so rendering a frame
+    costs little more than rasterising it. Particles are drawn as an
+    EllipseCollection sized in data units.
+
+    Keyword arguments:
+        bed_particles -- bed particle array
+        x_lim -- right limit of the plot
+        y_lim -- top limit of the plot
+        fp_out -- directory (with trailing separator) the frames are saved to
+        age_limits -- (min, max) of the age colour scale, or None to
+                      scale each frame to its own ages
+    """
+    def __init__(self, bed_particles, x_lim, y_lim, fp_out, age_limits=None):
+        self.fp_out = fp_out
+        self.age_limits = age_limits
+        self.fig = plt.figure(figsize=(20, 6.5))
+        self.ax = self.fig.add_subplot(1, 1, 1, aspect='equal')
+        # NOTE: xlim and ylim modified for aspec ratio -- WIP
+        self.ax.set_xlim((-2, x_lim))
+        self.ax.set_ylim((0, y_lim))
+
+        bed_diameters = np.asarray(bed_particles[:,1], dtype=float)
+        bed_centers = np.column_stack((bed_particles[:,0], np.zeros(np.size(bed_diameters))))
+        bed = EllipseCollection(bed_diameters, bed_diameters, 0, units='xy',
+                                offsets=bed_centers, transOffset=self.ax.transData,
+                                facecolors='#BDBDBD', alpha=0.9, linewidths=(0, ))
+        self.ax.add_collection(bed)
+
+        self.diameters = None
+        self.models = None
+        self.colorbar = None
+        self.title = self.ax.set_title('')
+
+    def render(self, iteration, model_particles):
+        """ Draw the model particles at iteration and save the frame as
+        iter{iteration}.png. Returns the path of the frame. """
+        self.draw(iteration, model_particles)
+        plots_path = self.fp_out + f'iter{iteration}.png'
+        self.fig.savefig(plots_path, format='png')
+        return plots_path
+
+    def frame(self, iteration, model_particles):
+        """ Draw the model particles at iteration and return the frame as
+        an RGB image, without writing it to disk. Needs an Agg based
+        backend. """
+        self.draw(iteration, model_particles)
+        self.fig.canvas.draw()
+        return Image.fromarray(np.asarray(self.fig.canvas.buffer_rgba())).convert('RGB')
+
+    def draw(self, iteration, model_particles):
+        """ Move and recolour the model particles to their state at iteration """
+        diameters = np.asarray(model_particles[:,1], dtype=float)
+        if self.diameters is None or not np.array_equal(diameters, self.diameters):
+            # Only rebuilt if the model particles change size or number
+            self.build_models(diameters)
+        self.models.set_offsets(np.column_stack((model_particles[:,0], model_particles[:,2])))
+        self.models.set_array(np.asarray(model_particles[:,5], dtype=float))
+        if self.age_limits is None:
+            self.models.autoscale()
+        self.title.set_text(f'Iteration {iteration}')
+
+    def build_models(self, diameters):
+        """ Build the collection of model particles, and the colorbar on
+        the first call """
+        if self.models is not None:
+            self.models.remove()
+        self.models = EllipseCollection(diameters, diameters, 0, units='xy',
+                                        offsets=np.zeros((diameters.size, 2)),
+                                        transOffset=self.ax.transData,
+                                        cmap=matplotlib.cm.RdGy, edgecolors='black')
+        self.models.set_array(np.zeros(diameters.size))
+        if self.age_limits is not None:
+            self.models.set_clim(*self.age_limits)
+        self.ax.add_collection(self.models)
+        if self.colorbar is None:
+            self.colorbar = self.fig.colorbar(self.models, ax=self.ax, orientation='horizontal',
+                                              fraction=0.046, pad=0.1,
+                                              label='Particle Age (iterations since last hop)')
+        else:
+            self.colorbar.update_normal(self.models)
+        self.diameters = diameters
+
+    def close(self):
+        plt.close(self.fig)
+
 
 def stream(iteration, bed_particles, model_particles, x_lim, y_lim, fp_out):
     """ Plot the complete stream from 0,0 to x_lim and y_lim. Bed particles 
     are plotted as light grey and model particles are dark blue. Allows
-    for closer look at state of a subregion of the stream during simulation """
-    plt.clf()
-    fig = plt.figure(1)
-    fig.set_size_inches(20, 6.5)
-    ax = fig.add_subplot(1, 1, 1, aspect='equal')
-    # NOTE: xlim and ylim modified for aspec ratio -- WIP
-    ax.set_xlim((-2, x_lim))
-    ax.set_ylim((0, y_lim))
-    
-    radius_array = np.asarray((bed_particles[:,1] / 2.0), dtype=float)
-    x_center = bed_particles[:,0]
-    y_center_bed = np.zeros(np.size(x_center))
-    plt.rcParams['image.cmap'] = 'gray'
-    ## This method of plotting circles comes from Stack Overflow questions\32444037
-    ## Note that the patches won't be added to the axes, instead a collection will.
-    patches = []
-    for x1, y1, r in zip(x_center, y_center_bed, radius_array):
-        circle = Circle((x1, y1), r)
-        patches.append(circle)
-    p = PatchCollection(patches, color="#BDBDBD", alpha=0.9, linewidths=(0, ))
-    ax.add_collection(p)
-    
-    x_center_m = model_particles[:,0]
-    y_center_m = model_particles[:,2]
-    patches1 = []
-    for x2, y2, r in zip(x_center_m, y_center_m, model_particles[:,1]/2):
-        circle = Circle((x2, y2), r)
-        patches1.append(circle)
-    p_m = PatchCollection(patches1, cmap=matplotlib.cm.RdGy, edgecolors='black')
-    p_m.set_array(model_particles[:,5])
-    ax.add_collection(p_m)
-
-    plt.colorbar(p_m,orientation='horizontal',fraction=0.046, pad=0.1,label='Particle Age (iterations since last hop)')
-    plt.title(f'Iteration {iteration}')
-
-    filename = f'iter{iteration}.png'
-    plots_path = fp_out + filename
-    plt.savefig(plots_path, format='png',)
-        
+    for closer look at state of a subregion of the stream during simulation.
+    To plot many iterations, reuse one StreamRenderer instead. """
+    renderer = StreamRenderer(bed_particles, x_lim, y_lim, fp_out)
+    try:
+        renderer.render(iteration, model_particles)
+    finally:
+        renderer.close()
     return
 
-def stream_gif(start, stop, dir):
+class AnimationWriter():
+    """ Encode frames into an animated GIF, WebP or PNG (APNG), one
+    frame at a time.
+
+    GIF frames are quantized to their own 256 colour palette and written
+    as soon as they are added, so memory use does not grow with the
+    number of frames. Pillow encodes WebP and APNG in a single call, so
+    those frames are kept, in full colour, until close and at most
+    max_frames of them are accepted.
+
+    Keyword arguments:
+        path -- file to write, the format is taken from its suffix
+                (.gif, .webp, .png or .apng) unless format is given
+        duration -- milliseconds per frame
+        loop -- number of times to loop, 0 to loop forever
+        format -- one of ANIMATION_FORMATS
+        max_frames -- most WebP or APNG frames to hold in memory
+    """
+    def __init__(self, path, duration=150, loop=0, format=None, max_frames=MAX_BUFFERED_FRAMES):
+        if format is None:
+            format = os.path.splitext(path)[1].lstrip('.').lower()
+            format = 'apng' if format == 'png' else format
+        if format not in ANIMATION_FORMATS:
+            raise ValueError(f'Unknown animation format {format}, expected one of {ANIMATION_FORMATS}')
+        self.path = path
+        self.duration = duration
+        self.loop = loop
+        self.format = format
+        self.max_frames = max_frames
+        self.frames = []
+        self.n_frames = 0
+        self.file = open(path, 'wb') if format == 'gif' else None
+
+    def add(self, image):
+        """ Add a frame, a PIL image or an (height, width, 3) array """
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(np.asarray(image, dtype=np.uint8))
+        image = image.convert('RGB')
+        if self.format == 'gif':
+            # method 2 is the fast octree quantizer
+            frame = image.quantize(colors=256, method=2)
+            if self.n_frames == 0:
+                header, _ = GifImagePlugin.getheader(frame, info={'loop': self.loop,
+                                                                  'duration': self.duration})
+                self.file.write(b''.join(header))
+            for data in GifImagePlugin.getdata(frame, duration=self.duration,
+                                               include_color_table=True):
+                self.file.write(data)
+        else:
+            if self.n_frames >= self.max_frames:
+                raise ValueError(f'More than {self.max_frames} frames would be held in memory '
+                                 f'for {self.format}, use gif for long animations')
+            self.frames.append(image)
+        self.n_frames += 1
+
+    def close(self):
+        """ Finish the animation file """
+        if self.format == 'gif':
+            if not self.file.closed:
+                self.file.write(b';')
+                self.file.close()
+        elif self.frames:
+            self.frames[0].save(self.path, format='PNG' if self.format == 'apng' else 'WEBP',
+                                save_all=True, append_images=self.frames[1:],
+                                duration=self.duration, loop=self.loop)
+            self.frames = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Don't encode a partial WebP or APNG
+            self.frames = []
+        self.close()
+
+
+def stream_animation(start, stop, dir, format='gif', duration=150):
+    """ Encode the stream plots iter{start}.png to iter{stop-1}.png in dir
+    into dir/simulation_snapshot.{format}, reading one plot at a time.
+    Returns the path of the animation. """
     in_filename = 'iter{i}.png'
-    out_filename = 'simulation_snapshot.gif'
+    out_filename = f'simulation_snapshot.{format}'
 
     fp_in = dir + in_filename
     fp_out = dir + out_filename
 
     step = 1
-    images = []
+    with AnimationWriter(fp_out, duration=duration, loop=0, format=format) as writer:
+        for i in range(start, stop, step):
+            with Image.open(fp_in.format(i=i)) as im:
+                writer.add(im)
+    return fp_out
 
-    for i in range(start, stop, step):
-        im = Image.open(fp_in.format(i=i))
-        images.append(im)
+def stream_gif(start, stop, dir):
+    stream_animation(start, stop, dir, 'gif')
 
-    images[0].save(fp_out, save_all=True, append_images=images[1:], optimize=True, duration=150, loop=0)
+def moving_average(values, window):
+    """ Mean over every window consecutive values along the last axis,
+    from a cumulative sum (same as np.convolve with a box, mode='valid') """
+    values = np.asarray(values, dtype=float)
+    totals = np.cumsum(values, axis=-1)
+    totals = np.concatenate([np.zeros(values.shape[:-1] + (1,)), totals], axis=-1)
+    return (totals[..., window:] - totals[..., :-window]) / window
 
 def crossing_info(particle_crossing_list, iterations, subsample, fp_out):
     plt.clf()
@@ -92,9 +248,10 @@ def crossing_info(particle_crossing_list, iterations, subsample, fp_out):
     def poisson(k, lamb):
         return (lamb**k/factorial(k)) * np.exp(-lamb)
 
-    # fit with curve_fit
-    parameters, cov_matrix = curve_fit(poisson, bin_middles, hist)
-    plt.plot(bin_middles, poisson(bin_middles, *parameters), color='black', marker='o', fillstyle = 'none', markersize=4, lw=0, markeredgecolor='black', markeredgewidth=1, label='Poisson PMF Fit')
+    # The maximum likelihood rate is the mean crossing count
+    # (see model/flux_stats.py for the negative binomial and more)
+    lamb = np.mean(particle_crossing_list)
+    plt.plot(bin_middles, poisson(bin_middles, lamb), color='black', marker='o', fillstyle = 'none', markersize=4, lw=0, markeredgecolor='black', markeredgewidth=1, label=f'Poisson PMF Fit ($\\lambda$ = {lamb:.3f})')
 
     plt.legend(loc='upper right',frameon=0)
     filename = 'CrossingDownstreamBoundaryHist.png'
@@ -102,7 +259,7 @@ def crossing_info(particle_crossing_list, iterations, subsample, fp_out):
     fig.savefig(fi_path, format='png', dpi=600)
 
     #####
-    crossing_list_avg = np.convolve(particle_crossing_list, np.ones(subsample)/subsample, mode='valid')
+    crossing_list_avg = moving_average(particle_crossing_list, subsample)
 
     crossing_list = crossing_list_avg[0::subsample]
     Time = np.arange(1,  iterations + 1, subsample)
@@ -132,8 +289,8 @@ def crossing_info2(particle_crossing_list, particle_age_list, n_iterations, subs
     fig = plt.figure(figsize=(8,7))
     ax3 = fig.add_subplot(1, 1, 1)
     #####
-    crossing_list_avg = np.convolve(particle_crossing_list, np.ones(subsample)/subsample, mode='valid')
-    age_list_avg = np.convolve(particle_age_list, np.ones(subsample)/subsample, mode='valid')
+    crossing_list_avg = moving_average(particle_crossing_list, subsample)
+    age_list_avg = moving_average(particle_age_list, subsample)
 
     crossing_list = crossing_list_avg[0::subsample]
     age_list = age_list_avg[0::subsample]
@@ -155,4 +312,54 @@ def crossing_info2(particle_crossing_list, particle_age_list, n_iterations, subs
     fig.tight_layout()
     filename = 'CrossingDownstreamBoundary_Age.png'
     fi_path = fp_out + filename
-    fig.savefig(fi_path, format='png', dpi=600)
\ No newline at end of file
+    fig.savefig(fi_path, format='png', dpi=600)
+
+def ensemble_info(summary_path, series, fp_out, subsample=1):
+    """ Plot the ensemble of runs summarised by model/aggregate.py: the
+    mean and quantile band of series across runs over time, and, for
+    integer series such as the flux, the pooled histogram of values.
+
+    Keyword arguments:
+        summary_path -- path of the summary file
+        series -- series under final_metrics, e.g. 'subregions/subregion-3-flux'
+        fp_out -- directory (with trailing separator) the plots are saved to
+        subsample -- plot every subsample-th iteration of the time series
+    """
+    with h5py.File(summary_path, 'r') as f:
+        grp = f[series]
+        quantiles = f['quantiles'][()]
+        mean = grp['mean'][::subsample]
+        band = grp['quantiles'][:, ::subsample]
+        count = grp['count'][::subsample]
+        histogram = grp['histogram'][()] if 'histogram' in grp else None
+        n_runs = f['runs/file'].shape[0]
+    name = series.split('/')[-1]
+    Time = np.arange(1, mean.size * subsample + 1, subsample)
+
+    plt.clf()
+    fig = plt.figure(figsize=(8,7))
+    ax1 = fig.add_subplot(1,1,1)
+    ax1.fill_between(Time, band[0], band[-1], color='lightgray',
+                     label=f'{quantiles[0]:g} to {quantiles[-1]:g} quantiles')
+    ax1.plot(Time, mean, 'black', label='Mean')
+    plt.title(f'Ensemble of {n_runs} runs: {name}')
+    ax1.set_xlabel('Numerical Step')
+    ax1.set_ylabel(name)
+    if count.min() < count.max():
+        ax2 = ax1.twinx()
+        ax2.plot(Time, count, 'gray', linestyle='dashed', lw=0.8)
+        ax2.set_ylabel('Runs', color='gray', rotation=270, labelpad=15)
+    ax1.legend(loc='upper right', frameon=0)
+    fig.tight_layout()
+    fig.savefig(fp_out + f'Ensemble_{name}.png', format='png', dpi=600)
+
+    if histogram is not None and histogram.sum() > 0:
+        plt.clf()
+        fig = plt.figure(figsize=(8,7))
+        ax = fig.add_subplot(1, 1, 1)
+        values = np.arange(histogram.size)
+        plt.bar(values, histogram / histogram.sum(), color='lightgray')
+        plt.title(f'Histogram of {name}, {n_runs} runs pooled', fontsize=10, style='italic')
+        plt.xlabel(f'{name} (particle count)')
+        plt.ylabel('Fraction')
+        fig.savefig(fp_out + f'Ensemble_{name}_Hist.png', format='png', dpi=600)
@@ -0,0 +1,233 @@
+"""
+Lazy reader of a run's output.
+
+RunReader opens the file (or directory) written by any of the file
+sinks and reads only what is asked for:
+
+    reader.params            the parameters, as a dictionary
+    reader.bed               the bed particles
+    reader.initial_model     the model particles before the first iteration
+    reader.snapshots[k]      the k-th saved snapshot of the model particles
+    reader.snapshots[a:b]    snapshots a to b-1, stacked
+    reader.snapshots.iterations   the iteration of each snapshot
+    reader.state_at(i)       the model particles at the start of iteration i
+    reader.event_ids(i)      the particles entrained in iteration i
+    reader.flux(s)           flux series of subregion s
+    reader.avg_age()         average age series (also age_range, metric)
+
+The standard (hdf5), compact and swmr layouts and the numpy sink's
+directory are all supported. Snapshots and series are kept in a small
+LRU cache, so stepping back and forth over a range does not read the
+same chunk twice.
+"""
+import os
+from collections import OrderedDict
+import numpy as np
+import h5py
+import yaml
+
+
+class RunReader():
+    """ Read the output of a run.
+
+    Keyword arguments:
+        path -- hdf5 file written by the hdf5, compact or swmr sinks,
+                or directory written by the numpy sink
+        cache_size -- number of snapshots and series kept in the cache
+        swmr -- open the file in SWMR read mode, to read a running model
+    """
+    def __init__(self, path, cache_size=64, swmr=False):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.file = None
+        self.arrays = None
+        if os.path.isdir(path):
+            self.layout = 'numpy'
+            self.arrays = np.load(os.path.join(path, 'results.npz'))
+            snapshots_path = os.path.join(path, 'snapshots.npy')
+            self.snapshot_data = (np.load(snapshots_path, mmap_mode='r')
+                                        if os.path.exists(snapshots_path) else None)
+        elif swmr:
+            self.file = h5py.File(path, 'r', libver='latest', swmr=True)
+        else:
+            self.file = h5py.File(path, 'r')
+        if self.file is not None:
+            self.layout = self.file.attrs.get('layout', 'standard')
+        self._params = None
+        self.snapshots = Snapshots(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.arrays is not None:
+            self.arrays.close()
+            self.arrays = None
+            self.snapshot_data = None
+        self.cache.clear()
+
+    def __contains__(self, name):
+        if self.file is not None:
+            return name in self.file
+        return name in self.arrays.files
+
+    def dataset(self, name):
+        """ The dataset (or array) at name, e.g. 'final_metrics/avg_age' """
+        if self.file is not None:
+            return self.file[name]
+        return self.arrays[name]
+
+    def cached(self, key, read):
+        """ Return the cached value of key, calling read() on a miss and
+        evicting the least recently used entry when the cache is full """
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        value = read()
+        if self.cache_size > 0:
+            self.cache[key] = value
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return value
+
+    @property
+    def params(self):
+        """ The run's parameters, with lists and mappings decoded """
+        if self._params is None:
+            if self.file is None:
+                with open(os.path.join(self.path, 'params.yaml')) as p:
+                    self._params = yaml.safe_load(p)
+            else:
+                self._params = {key: read_param(dataset)
+                                    for key, dataset in self.file['params'].items()}
+        return self._params
+
+    @property
+    def bed(self):
+        return self.cached('initial_values/bed',
+                           lambda: np.asarray(self.dataset('initial_values/bed')[()]))
+
+    @property
+    def initial_model(self):
+        return self.cached('initial_values/model',
+                           lambda: np.asarray(self.dataset('initial_values/model')[()]))
+
+    def state_at(self, iteration):
+        """ The model particles at the start of iteration. Snapshots are
+        taken at the end of an iteration, so this is the snapshot of
+        iteration - 1, or the initial model particles for iteration 0. """
+        if iteration == 0:
+            return self.initial_model
+        return self.snapshots[self.snapshots.index(iteration - 1)]
+
+    def event_ids(self, iteration):
+        """ IDs of the particles entrained in iteration """
+        index = self.snapshots.index(iteration)
+        if self.layout == 'standard':
+            return self.cached(('event_ids', index),
+                               lambda: self.file[f'iteration_{iteration}/event_ids'][()])
+        offsets = self.dataset('snapshots/event_offsets')
+        return self.cached(('event_ids', index), lambda: np.asarray(
+                            self.dataset('snapshots/event_ids')[offsets[index]:offsets[index+1]]))
+
+    def metric(self, name, start=None, stop=None):
+        """ Entries start:stop of the final_metrics series name,
+        e.g. 'avg_age' or 'gauges/gauge-0-count' """
+        return self.cached(('final_metrics', name, start, stop),
+                           lambda: np.asarray(self.dataset(f'final_metrics/{name}')[start:stop]))
+
+    def flux(self, subregion=-1, start=None, stop=None):
+        """ Entries start:stop of the flux series of subregion. Negative
+        subregions count from the downstream end. """
+        if subregion < 0:
+            subregion += self.params['num_subregions']
+        return self.metric(f'subregions/subregion-{subregion}-flux', start, stop)
+
+    def avg_age(self, start=None, stop=None):
+        return self.metric('avg_age', start, stop)
+
+    def age_range(self, start=None, stop=None):
+        return self.metric('age_range', start, stop)
+
+
+class Snapshots():
+    """ The saved snapshots of a run, indexed by position (not by
+    iteration). Integer indexes return one (n_particles, 7) array,
+    slices return them stacked. """
+    def __init__(self, reader):
+        self.reader = reader
+        self._iterations = None
+
+    @property
+    def iterations(self):
+        """ The iteration of each snapshot, ascending """
+        if self._iterations is None:
+            reader = self.reader
+            if reader.layout == 'standard':
+                self._iterations = np.array(sorted(int(name[len('iteration_'):])
+                                    for name in reader.file if name.startswith('iteration_')),
+                                    dtype=np.int64)
+            elif 'snapshots/iteration' in reader:
+                self._iterations = np.asarray(reader.dataset('snapshots/iteration')[()],
+                                              dtype=np.int64)
+            else:
+                self._iterations = np.zeros(0, dtype=np.int64)
+        return self._iterations
+
+    def __len__(self):
+        return self.iterations.size
+
+    def index(self, iteration):
+        """ Position of the snapshot of iteration """
+        index = np.searchsorted(self.iterations, iteration)
+        if index == len(self) or self.iterations[index] != iteration:
+            raise KeyError(f'No snapshot of iteration {iteration} in {self.reader.path}')
+        return int(index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            indexes = range(*key.indices(len(self)))
+            missing = [index for index in indexes if ('snapshot', index) not in self.reader.cache]
+            if missing and self.reader.layout != 'standard' and key.step in (None, 1):
+                # Read the missing block in one call and cache it per snapshot
+                block = self.read_block(missing[0], missing[-1] + 1)
+                for offset, snapshot in enumerate(block):
+                    self.reader.cached(('snapshot', missing[0] + offset), lambda: snapshot)
+            return np.stack([self[index] for index in indexes]) if indexes else \
+                        np.zeros((0,) + self.reader.initial_model.shape)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(f'Snapshot {key} out of range, {len(self)} snapshots')
+        return self.reader.cached(('snapshot', key), lambda: self.read_block(key, key + 1)[0])
+
+    def read_block(self, start, stop):
+        """ Read snapshots start to stop-1 from the file """
+        reader = self.reader
+        if reader.layout == 'standard':
+            return [reader.file[f'iteration_{iteration}/model'][()]
+                        for iteration in self.iterations[start:stop]]
+        if reader.layout == 'numpy':
+            return np.array(reader.snapshot_data[start:stop])
+        return reader.dataset('snapshots/model')[start:stop]
+
+
+#############################################################################
+# Helper functions
+#############################################################################
+
+def read_param(dataset):
+    """ Decode a parameter written by sinks.write_params """
+    value = dataset[()]
+    if isinstance(value, bytes):
+        value = value.decode()
+    if dataset.attrs.get('encoding') == 'yaml':
+        return yaml.safe_load(value)
+    return value.item() if isinstance(value, np.generic) else value
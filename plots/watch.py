@@ -0,0 +1,81 @@
+import time
+import argparse
+import numpy as np
+import h5py
+import matplotlib
+from matplotlib import pyplot as plt
+
+
+def main(filename, window, interval, subregion, save_location):
+    """ Tail a run written by the swmr sink, plotting the most recent
+    window of flux and average age every interval seconds until the
+    run finishes or stops early. If save_location is given the plot is written there
+    each refresh instead of being shown. """
+    if save_location is not None:
+        matplotlib.use('Agg')
+    with h5py.File(filename, 'r', libver='latest', swmr=True) as f:
+        n_iterations = f['params']['n_iterations'][()]
+        if subregion is None:
+            subregion = f['params']['num_subregions'][()] - 1
+        flux = f['final_metrics']['subregions'][f'subregion-{subregion}-flux']
+        avg_age = f['final_metrics']['avg_age']
+        live_iteration = f['live']['iteration']
+        # Files written before the finished marker existed only stop at n_iterations
+        live_finished = f['live']['finished'] if 'finished' in f['live'] else None
+
+        fig = plt.figure(figsize=(8,7))
+        ax1 = fig.add_subplot(1,1,1)
+        ax2 = ax1.twinx()
+        last_seen = None
+        while True:
+            for dataset in [live_iteration, flux, avg_age]:
+                dataset.refresh()
+            if live_finished is not None:
+                live_finished.refresh()
+            iteration = live_iteration[0]
+            finished = live_finished is not None and live_finished[0] == 1
+            if iteration >= 0 and iteration != last_seen:
+                start = max(0, iteration + 1 - window)
+                time_steps = np.arange(start + 1, iteration + 2)
+                plot(fig, ax1, ax2, time_steps, flux[start:iteration+1],
+                        avg_age[start:iteration+1], iteration, n_iterations, subregion)
+                if save_location is not None:
+                    fig.savefig(save_location, format='png')
+                print(f'Iteration {iteration + 1}/{n_iterations}')
+                last_seen = iteration
+            if finished or iteration >= n_iterations - 1:
+                print(f'Run finished after {iteration + 1} iterations.')
+                break
+            if save_location is None:
+                plt.pause(interval)
+            else:
+                time.sleep(interval)
+    if save_location is None:
+        plt.show()
+
+def plot(fig, ax1, ax2, time_steps, flux, avg_age, iteration, n_iterations, subregion):
+    ax1.clear()
+    ax2.clear()
+    ax1.plot(time_steps, flux, 'lightgray')
+    ax1.set_title(f'Iteration {iteration + 1} of {n_iterations}')
+    ax1.set_xlabel('Numerical Step')
+    ax1.set_ylabel(f'Particle Crossing (subregion-{subregion})')
+    ax2.plot(time_steps, avg_age, 'black')
+    ax2.set_ylabel('Particle Age (# of iterations)', color='black', rotation=270, labelpad=15)
+    ax2.yaxis.set_label_position('right')
+    fig.tight_layout()
+    fig.canvas.draw_idle()
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Watch the flux and age of a running model written with the swmr sink')
+    parser.add_argument('path_to_file', help='Path to the -live.hdf5 file being written')
+    parser.add_argument('--window', type=int, default=500, help='Number of recent iterations to plot')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between refreshes')
+    parser.add_argument('--subregion', type=int, default=None, help='Subregion whose flux is plotted (default: last)')
+    parser.add_argument('--save', default=None, help='Write the plot to this png on every refresh instead of showing it')
+    args = parser.parse_args()
+    return args.path_to_file, args.window, args.interval, args.subregion, args.save
+
+if __name__ == '__main__':
+    path_to_file, window, interval, subregion, save_location = parse_arguments()
+    main(path_to_file, window, interval, subregion, save_location)
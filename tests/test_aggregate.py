@@ -0,0 +1,123 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import h5py
+
+from model import aggregate
+
+
+def lower_quantile(values, quantiles):
+    """ The value of rank floor(q * (n - 1)) for each quantile q """
+    ranks = np.floor(np.asarray(quantiles) * (values.size - 1)).astype(int)
+    return np.sort(values)[ranks]
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.values = np.concatenate([rng.lognormal(1, 1, 5000), -rng.exponential(2, 500),
+                                      np.zeros(200), [np.nan]])
+
+    def test_quantiles_within_relative_accuracy(self):
+        sketch = aggregate.QuantileSketch(0.01)
+        sketch.add(self.values)
+        quantiles = [0, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 1]
+        expected = lower_quantile(self.values[~np.isnan(self.values)], quantiles)
+        np.testing.assert_allclose(expected, sketch.quantile(quantiles), rtol=0.0101)
+        self.assertEqual(self.values.size - 1, sketch.count)
+
+    def test_merged_sketches_equal_one_sketch(self):
+        whole, first, second = [aggregate.QuantileSketch(0.02) for _ in range(3)]
+        whole.add(self.values)
+        first.add(self.values[:1000])
+        second.add(self.values[1000:])
+        first.merge(second)
+        np.testing.assert_array_equal(whole.quantile(aggregate.QUANTILES),
+                                      first.quantile(aggregate.QUANTILES))
+
+    def test_empty_sketch_returns_nan(self):
+        self.assertTrue(np.all(np.isnan(aggregate.QuantileSketch().quantile([0.5]))))
+
+    def test_different_accuracies_cannot_merge(self):
+        with self.assertRaises(ValueError):
+            aggregate.QuantileSketch(0.01).merge(aggregate.QuantileSketch(0.02))
+
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(2)
+        self.run_files = []
+        self.flux = []
+        self.age = []
+        # Three runs, the last one stopped early
+        for run, n_iterations in enumerate([50, 50, 37]):
+            path = os.path.join(self.tmp.name, f'test-run{run}.hdf5')
+            flux = rng.poisson(2, n_iterations)
+            age = rng.uniform(0, 10, n_iterations)
+            with h5py.File(path, 'w') as f:
+                f['final_metrics/subregions/subregion-0-flux'] = flux
+                f['final_metrics/avg_age'] = age
+            self.run_files.append(path)
+            self.flux.append(flux)
+            self.age.append(age)
+        self.summary_path = os.path.join(self.tmp.name, 'test-summary.hdf5')
+
+    def check_summary(self):
+        with h5py.File(self.summary_path, 'r') as f:
+            grp = f['subregions/subregion-0-flux']
+            full = np.array([flux[:37] for flux in self.flux], dtype=float)
+            np.testing.assert_array_equal([3] * 37 + [2] * 13, grp['count'][()])
+            np.testing.assert_allclose(full.mean(axis=0), grp['mean'][:37])
+            np.testing.assert_allclose(full.var(axis=0, ddof=1), grp['variance'][:37])
+            np.testing.assert_allclose(np.quantile(full, aggregate.QUANTILES, axis=0),
+                                       grp['quantiles'][:, :37])
+            np.testing.assert_allclose(np.mean(self.flux[:2], axis=0)[37:], grp['mean'][37:])
+
+            pooled = np.concatenate(self.flux)
+            self.assertEqual(pooled.size, grp['pooled_count'][()])
+            self.assertAlmostEqual(pooled.mean(), grp['pooled_mean'][()])
+            self.assertAlmostEqual(pooled.var(ddof=1), grp['pooled_variance'][()])
+            np.testing.assert_array_equal(np.bincount(pooled), grp['histogram'][()])
+
+            ages = np.concatenate(self.age)
+            np.testing.assert_allclose(lower_quantile(ages, 0.5),
+                                       f['avg_age/pooled_quantiles'][2], rtol=0.0101)
+            self.assertNotIn('histogram', f['avg_age'])
+
+    def test_summary_matches_numpy(self):
+        aggregate.aggregate(self.run_files, self.summary_path)
+        self.check_summary()
+
+    def test_blocks_and_processes_give_the_same_summary(self):
+        aggregate.aggregate(self.run_files, self.summary_path, processes=2, block_size=7)
+        self.check_summary()
+
+    def test_unflushed_swmr_entries_are_left_out(self):
+        # A swmr run which died after flushing 10 of its 50 iterations
+        path = os.path.join(self.tmp.name, 'test-run-live.hdf5')
+        flux = np.zeros(50, dtype=np.int64)
+        flux[:10] = self.flux[0][:10] + 1
+        age = np.full(50, -1.0)
+        age[:10] = self.age[0][:10]
+        with h5py.File(path, 'w') as f:
+            f['final_metrics/subregions/subregion-0-flux'] = flux
+            f['final_metrics/avg_age'] = age
+            f['live/iteration'] = np.array([9])
+        aggregate.aggregate([self.run_files[0], path], self.summary_path, block_size=7)
+        with h5py.File(self.summary_path, 'r') as f:
+            grp = f['subregions/subregion-0-flux']
+            np.testing.assert_array_equal([2] * 10 + [1] * 40, grp['count'][()])
+            np.testing.assert_array_equal(np.bincount(np.concatenate([self.flux[0], flux[:10]])),
+                                          grp['histogram'][()])
+            self.assertEqual(60, f['avg_age/pooled_count'][()])
+            self.assertGreaterEqual(np.nanmin(f['avg_age/quantiles'][()]), 0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
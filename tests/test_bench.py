@@ -0,0 +1,66 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model')
+
+
+class TestBench(unittest.TestCase):
+    """ Run bench.py on its smallest case (it bare-imports catalog.py and
+    progress.py, so it is driven as a script) """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name, 'bench.json')
+        self.run_ids = []
+
+    def bench(self, *args):
+        result = subprocess.run([sys.executable, 'bench.py', '--cases', 'small-bed',
+                                 '--output', self.output, *args],
+                                cwd=MODEL_DIR, capture_output=True, text=True, timeout=300)
+        with open(self.output) as f:
+            report = json.load(f)
+        self.run_ids += [case['run_id'] for case in report['cases'].values()]
+        return result, report
+
+    def test_regression_against_baseline_fails(self):
+        baseline = {'cases': {'small-bed': {'iterations_per_second': 1e9,
+                                            'peak_rss': 1, 'output_bytes': None}}}
+        baseline_path = os.path.join(self.tmp.name, 'baseline.json')
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f)
+
+        result, report = self.bench('--baseline', baseline_path, '--tolerance', '0.5')
+        self.assertEqual(1, result.returncode, result.stderr)
+        self.assertIn('REGRESSED', result.stdout)
+        case = report['cases']['small-bed']
+        self.assertEqual(2000, case['n_iterations'])
+        self.assertGreater(case['iterations_per_second'], 0)
+        self.assertGreater(case['output_bytes'], 0)
+        if hasattr(os, 'wait4'):
+            self.assertGreater(case['peak_rss'], 2**20)
+        # A metric missing from the baseline is not compared
+        comparison = {row['metric']: row for row in report['comparison']}
+        self.assertEqual({'iterations_per_second', 'peak_rss'}, set(comparison))
+        self.assertTrue(comparison['iterations_per_second']['regressed'])
+
+        # The same run compared with itself does not regress
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f)
+        result, report = self.bench('--baseline', baseline_path, '--tolerance', '10')
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertFalse(any(row['regressed'] for row in report['comparison']))
+
+    def tearDown(self):
+        for run_id in self.run_ids:
+            log_path = os.path.join(MODEL_DIR, 'logs', f'{run_id}.log')
+            if os.path.exists(log_path):
+                os.remove(log_path)
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
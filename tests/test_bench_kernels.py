@@ -0,0 +1,66 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model')
+
+KERNELS = ['compute_available_vertices', 'get_event_particles', 'move_model_particles',
+           'update_flux', 'update_particle_states', 'set_model_particles']
+
+
+class TestBenchKernels(unittest.TestCase):
+    """ Run bench_kernels.py on small beds (it bare-imports logic.py, so
+    it is driven as a script) """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name, 'bench-kernels.json')
+
+    def bench(self, *args):
+        result = subprocess.run([sys.executable, 'bench_kernels.py', '--x-max', '20', '40',
+                                 '--level-limit', '2', '3', '--repeats', '2',
+                                 '--output', self.output, *args],
+                                cwd=MODEL_DIR, capture_output=True, text=True, timeout=300)
+        self.assertEqual(0, result.returncode, result.stderr)
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_every_kernel_is_timed_at_every_size(self):
+        results = self.bench('--budget', '1')
+        measurements = results['measurements']
+        self.assertEqual(2 * 2 * len(KERNELS), len(measurements))
+        self.assertEqual(set(KERNELS), {m['kernel'] for m in measurements})
+        for m in measurements:
+            self.assertFalse(m['skipped'])
+            self.assertGreater(m['median_seconds'], 0)
+            self.assertLessEqual(m['min_seconds'], m['median_seconds'])
+            self.assertIn(m['calls'], [1, 2])
+        for level_limit in [2, 3]:
+            sizes = [m['n_particles'] for m in measurements
+                        if m['kernel'] == 'update_flux' and m['level_limit'] == level_limit]
+            self.assertLess(sizes[0], sizes[1])
+        # Higher stacks hold more particles on the same bed
+        particles = {(m['x_max'], m['level_limit']): m['n_particles'] for m in measurements}
+        self.assertLess(particles[(40, 2)], particles[(40, 3)])
+        self.assertEqual(2 * len(KERNELS), len(results['scaling']))
+        self.assertTrue(all(row['exponent'] is not None for row in results['scaling']))
+
+    def test_sizes_over_budget_are_skipped(self):
+        results = self.bench('--budget', '1e-9', '--kernels', 'update_particle_states')
+        by_size = {(m['x_max'], m['level_limit']): m for m in results['measurements']}
+        for level_limit in [2, 3]:
+            # The smallest size is always timed, larger ones are predicted from it
+            self.assertFalse(by_size[(20, level_limit)]['skipped'])
+            self.assertTrue(by_size[(40, level_limit)]['skipped'])
+            self.assertGreater(by_size[(40, level_limit)]['predicted_seconds'], 1e-9)
+        self.assertEqual([None, None], [row['exponent'] for row in results['scaling']])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
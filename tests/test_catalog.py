@@ -0,0 +1,48 @@
+import unittest
+import os
+import tempfile
+
+from model import catalog
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.catalog = catalog.Catalog(os.path.join(self.tmp.name, 'catalog.sqlite'))
+        for run_id, sigma, n_iterations in [('a', 0.5, 1000), ('b', 0.5, 200000), ('c', 0.25, 200000)]:
+            parameters = {'sigma': sigma, 'level_limit': 3, 'n_iterations': n_iterations,
+                            'normal_dist': False, 'output_sinks': ['hdf5']}
+            self.catalog.register(run_id, parameters, [f'{run_id}.hdf5'], seed=1, engine='python',
+                                    code_version='test', wall_time=1.0, iterations_per_second=10.0,
+                                    metrics={'mean_flux_subregion-0': sigma * 2})
+
+    def test_query_by_parameters(self):
+        files = self.catalog.files(['sigma=0.5', 'level_limit=3', 'n_iterations>100000'])
+        self.assertEqual(['b.hdf5'], files)
+
+    def test_query_by_metric_and_run_column(self):
+        runs = self.catalog.query(['mean_flux_subregion-0<1', 'seed=1'])
+        self.assertEqual(['c'], [run['run_id'] for run in runs])
+        self.assertEqual(0.25, runs[0]['params']['sigma'])
+
+    def test_query_by_boolean_parameter(self):
+        self.assertEqual(3, len(self.catalog.query(['normal_dist=false'])))
+        self.assertEqual([], self.catalog.query(['normal_dist=true']))
+
+    def test_register_replaces_existing_run(self):
+        self.catalog.register('a', {'sigma': 1.0}, ['new.hdf5'], 2, 'python', 'test', 1.0, 10.0, {})
+        self.assertEqual(['new.hdf5'], self.catalog.files(['sigma=1.0']))
+        self.assertEqual(3, len(self.catalog.query()))
+
+    def test_condition_without_operator_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _ = self.catalog.query(['sigma'])
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
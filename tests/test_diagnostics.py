@@ -0,0 +1,43 @@
+import json
+import unittest
+from unittest.mock import Mock
+
+from model import diagnostics
+
+
+class TestDiagnostics(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = Mock()
+
+    def test_counts_are_logged_every_interval_and_reset(self):
+        diag = diagnostics.Diagnostics(2, self.logger)
+        for iteration in range(5):
+            diag.counters['hops'] += 3
+            diag.end_iteration(iteration)
+        self.assertEqual(2, self.logger.info.call_count)
+        line = json.loads(self.logger.info.call_args.args[0])
+        self.assertEqual({'iteration': 3, 'iterations': 2, 'hops': 6}, line)
+        self.assertEqual({'hops': 3}, dict(diag.counters))
+
+        diag.flush(4)
+        self.assertEqual(3, self.logger.info.call_count)
+        self.assertEqual({'hops': 15}, diag.results())
+
+    def test_flush_without_iterations_logs_nothing(self):
+        diag = diagnostics.Diagnostics(0, self.logger)
+        diag.flush(0)
+        self.logger.info.assert_not_called()
+        self.assertEqual({}, diag.results())
+
+    def test_nothing_is_formatted_when_info_is_disabled(self):
+        self.logger.isEnabledFor.return_value = False
+        diag = diagnostics.Diagnostics(1, self.logger)
+        diag.counters['loops'] += 1
+        diag.end_iteration(0)
+        self.logger.info.assert_not_called()
+        self.assertEqual({'loops': 1}, diag.results())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import h5py
+
+from model import ensemble
+
+
+class TestBuildVirtualView(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.run_files = []
+        # Two runs of different lengths and parameters
+        for run, (n_iterations, sigma) in enumerate([(4, 0.25), (3, 0.5)]):
+            path = os.path.join(self.tmp.name, f'test-run{run}.hdf5')
+            with h5py.File(path, 'w') as f:
+                f['params/n_iterations'] = n_iterations
+                f['params/sigma'] = sigma
+                f['params/filename_prefix'] = 'test'
+                flux = np.arange(n_iterations) + run
+                f['final_metrics/subregions/subregion-0-flux'] = flux
+                f['final_metrics/avg_age'] = np.ones(n_iterations) * run
+            self.run_files.append(path)
+        self.master_path = os.path.join(self.tmp.name, 'test-ensemble.hdf5')
+
+    def test_runs_are_stacked_with_fill_values(self):
+        ensemble.build_virtual_view(self.run_files, self.master_path, ['a', 'b'])
+        with h5py.File(self.master_path, 'r') as f:
+            flux = f['final_metrics']['subregions']['subregion-0-flux'][()]
+            np.testing.assert_array_equal([[0, 1, 2, 3], [1, 2, 3, -1]], flux)
+            avg_age = f['final_metrics']['avg_age'][()]
+            np.testing.assert_array_equal([[0, 0, 0, 0], [1, 1, 1, np.nan]], avg_age)
+            self.assertEqual([b'a', b'b'], list(f['runs']['run_id'][()]))
+
+    def test_params_are_tabulated_per_run(self):
+        ensemble.build_virtual_view(self.run_files, self.master_path)
+        with h5py.File(self.master_path, 'r') as f:
+            np.testing.assert_array_equal([0.25, 0.5], f['params']['sigma'][()])
+            np.testing.assert_array_equal([4, 3], f['params']['n_iterations'][()])
+            self.assertEqual([b'test', b'test'], list(f['params']['filename_prefix'][()]))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
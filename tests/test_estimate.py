@@ -0,0 +1,67 @@
+import unittest
+import os
+import re
+import sys
+import tempfile
+import subprocess
+import yaml
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'model')
+
+PARAMETERS = {'x_max': 20, 'num_subregions': 2, 'n_iterations': 200, 'data_save_interval': 10,
+              'seed': 1, 'filename_prefix': 'test', 'output_dir': 'output',
+              'output_sinks': ['hdf5', 'compact'], 'catalog': False, 'progress_interval': 0}
+
+
+class TestDryRun(unittest.TestCase):
+    """ Run the dry run of run.py and multiple_runs.py on a tiny
+    parameter file (the estimator imports run.py's siblings, so it is
+    driven as a script) """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with open(os.path.join(MODEL_DIR, 'parameters', 'param.yaml')) as p:
+            self.parameters = dict(yaml.safe_load(p), **PARAMETERS)
+        self.param_path = os.path.join(self.tmp.name, 'param.yaml')
+        self.write_parameters(self.parameters)
+
+    def write_parameters(self, parameters):
+        with open(self.param_path, 'w') as p:
+            yaml.safe_dump(parameters, p)
+
+    def dry_run(self, *args):
+        return subprocess.run([sys.executable, *args, '--dry-run'], cwd=MODEL_DIR,
+                              capture_output=True, text=True, timeout=300)
+
+    def test_run_estimate(self):
+        result = self.dry_run('run.py', self.param_path)
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertIn('200 iterations, 20 snapshots', result.stdout)
+        self.assertIn('calibrated on 50 iterations', result.stdout)
+        output = re.search(r'predicted output: +([\d.]+) (\w+) in (.+) \(', result.stdout)
+        self.assertIsNotNone(output, result.stdout)
+        self.assertGreater(float(output.group(1)), 0)
+        self.assertEqual(os.path.join(self.tmp.name, 'output'), output.group(3))
+        # Nothing is written where the run would write
+        self.assertEqual(['param.yaml'], os.listdir(self.tmp.name))
+
+    def test_output_larger_than_the_disk_fails(self):
+        self.write_parameters(dict(self.parameters, n_iterations=10**12, data_save_interval=1))
+        result = self.dry_run('run.py', self.param_path)
+        self.assertEqual(1, result.returncode, result.stderr)
+        self.assertIn('would not fit on the disk', result.stdout)
+
+    def test_ensemble_estimate_adds_up_runs(self):
+        result = self.dry_run('multiple_runs.py', '3', self.param_path)
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertIn('Ensemble of 3 runs:', result.stdout)
+        single = re.search(r'predicted peak memory: ([\d.]+) MiB\n', result.stdout)
+        total = re.search(r'Ensemble.*\n.*\n +predicted peak memory: ([\d.]+) MiB', result.stdout)
+        self.assertAlmostEqual(3 * float(single.group(1)), float(total.group(1)), delta=0.2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
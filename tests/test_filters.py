@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+
+from model import filters
+
+ATTR_COUNT = 7 # Number of attributes associated with a Particle
+
+
+class TestBuildFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.num_particles = 10
+        self.model_particles = np.zeros((self.num_particles, ATTR_COUNT))
+        self.model_particles[:,0] = np.arange(self.num_particles) # one particle per mm
+        self.model_particles[:,3] = np.arange(self.num_particles)
+
+    def test_no_filter_parameters_returns_empty_list(self):
+        self.assertEqual([], filters.build_filters({}, self.model_particles))
+
+    def test_window_selects_particles_inside_bounds(self):
+        parameters = {'window_bounds': [[2, 4], [8, 20]], 'window_interval': 3}
+        window_0, window_1 = filters.build_filters(parameters, self.model_particles)
+        self.assertEqual('window-0', window_0.name)
+        np.testing.assert_array_equal([2, 3, 4], window_0.select(self.model_particles)[:,3])
+        np.testing.assert_array_equal([8, 9], window_1.select(self.model_particles)[:,3])
+
+    def test_window_with_reversed_bounds_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _ = filters.build_filters({'window_bounds': [[4, 2]]}, self.model_particles)
+
+    def test_due_every_interval_iterations(self):
+        window = filters.WindowFilter('window', 0, 1, 3)
+        due = [iteration for iteration in range(9) if window.due(iteration)]
+        self.assertEqual([2, 5, 8], due)
+
+    def test_tracer_ids_select_those_particles(self):
+        tracers, = filters.build_filters({'tracer_ids': [7, 1]}, self.model_particles)
+        self.assertEqual('tracers', tracers.name)
+        self.assertEqual(1, tracers.interval)
+        np.testing.assert_array_equal([1, 7], tracers.select(self.model_particles)[:,3])
+
+    def test_out_of_range_tracer_id_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _ = filters.build_filters({'tracer_ids': [self.num_particles]}, self.model_particles)
+
+    def test_tracer_count_picks_distinct_particles(self):
+        tracers, = filters.build_filters({'tracer_count': 4}, self.model_particles)
+        self.assertEqual(4, len(np.unique(tracers.ids)))
+
+        with self.assertRaises(ValueError):
+            _ = filters.build_filters({'tracer_count': self.num_particles + 1}, 
+                                        self.model_particles)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import numpy as np
+
+from model import flux_stats
+
+
+class TestCountFits(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.poisson = rng.poisson(2.5, (3, 20000))
+        # Negative binomial with mean 3 and dispersion 2
+        self.overdispersed = rng.negative_binomial(2, 2 / (2 + 3), (2, 20000))
+
+    def test_poisson_rate_is_the_mean(self):
+        fit = flux_stats.poisson_fit(self.poisson)
+        np.testing.assert_allclose(self.poisson.mean(axis=1), fit['rate'])
+        self.assertEqual((3,), fit['log_likelihood'].shape)
+
+    def test_negative_binomial_recovers_dispersion(self):
+        fit = flux_stats.negative_binomial_fit(self.overdispersed)
+        np.testing.assert_allclose([3, 3], fit['mean'], rtol=0.03)
+        np.testing.assert_allclose([2, 2], fit['dispersion'], rtol=0.1)
+        # Fitted better than a Poisson
+        self.assertTrue(np.all(fit['log_likelihood'] >
+                               flux_stats.poisson_fit(self.overdispersed)['log_likelihood']))
+
+    def test_negative_binomial_of_underdispersed_is_poisson(self):
+        counts = np.tile([1, 2, 1, 2], (2, 50))
+        fit = flux_stats.negative_binomial_fit(counts)
+        self.assertTrue(np.all(np.isinf(fit['dispersion'])))
+        np.testing.assert_allclose(flux_stats.poisson_fit(counts)['log_likelihood'],
+                                   fit['log_likelihood'])
+
+    def test_dispersion_index(self):
+        poisson = flux_stats.dispersion_index(self.poisson)
+        np.testing.assert_allclose([1, 1, 1], poisson['index'], atol=0.05)
+        overdispersed = flux_stats.dispersion_index(self.overdispersed)
+        np.testing.assert_allclose([2.5, 2.5], overdispersed['index'], rtol=0.1)
+        self.assertTrue(np.all(overdispersed['p_value'] < 1e-6))
+
+
+class TestSeries(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.series = rng.normal(size=(2, 3, 500)).cumsum(axis=-1)
+
+    def test_autocorrelation_matches_direct_sum(self):
+        acf = flux_stats.autocorrelation(self.series, max_lag=20)
+        x = self.series[1, 2] - self.series[1, 2].mean()
+        direct = [np.sum(x[:x.size - lag] * x[lag:]) / np.sum(x * x) for lag in range(21)]
+        self.assertEqual((2, 3, 21), acf.shape)
+        np.testing.assert_allclose(direct, acf[1, 2])
+
+    def test_autocorrelation_of_constant_is_nan(self):
+        self.assertTrue(np.all(np.isnan(flux_stats.autocorrelation(np.ones(10)))))
+
+    def test_power_spectrum_sums_to_variance(self):
+        frequency, power = flux_stats.power_spectrum(self.series)
+        self.assertEqual(251, frequency.size)
+        np.testing.assert_allclose(self.series.var(axis=-1), power.sum(axis=-1) / 500)
+
+    def test_binned_spectrum_averages_each_band(self):
+        frequency, power = flux_stats.power_spectrum(self.series)
+        band_frequency, band_power = flux_stats.bin_spectrum(frequency, power, 10)
+        self.assertEqual(band_frequency.shape, band_power.shape[-1:])
+        self.assertLessEqual(band_frequency.size, 10)
+        self.assertTrue(np.all(np.diff(band_frequency) > 0))
+        edges = np.geomspace(frequency[1], frequency[-1], 11)
+        last = (frequency >= edges[-2])
+        np.testing.assert_allclose(power[..., last].mean(axis=-1), band_power[..., -1])
+        np.testing.assert_allclose(frequency[last].mean(), band_frequency[-1])
+
+    def test_block_averages(self):
+        blocks = flux_stats.block_averages(self.series, [1, 10, 300])
+        self.assertEqual([1, 10], sorted(blocks))
+        np.testing.assert_allclose(self.series[..., :10].mean(axis=-1),
+                                   blocks[10]['means'][..., 0])
+        self.assertEqual((2, 3), blocks[10]['standard_error'].shape)
+
+    def test_summarise(self):
+        counts = np.random.default_rng(5).poisson(1, (4, 200))
+        results = flux_stats.summarise(counts, scales=[10], max_lag=5, spectrum_bins=8,
+                                       cumulative_step=50)
+        self.assertEqual((4, 6), results['autocorrelation'].shape)
+        np.testing.assert_array_equal([49, 99, 149, 199], results['cumulative']['iteration'])
+        np.testing.assert_array_equal(counts.cumsum(axis=-1)[:, 49::50],
+                                      results['cumulative']['flux'])
+        np.testing.assert_array_equal(counts.sum(axis=-1), results['cumulative']['total'])
+        self.assertLessEqual(results['spectrum']['power'].shape[-1], 8)
+        self.assertIn('scale-10', results['blocks'])
+        full = flux_stats.summarise(counts, spectrum_bins=0)
+        self.assertEqual((4, 101), full['spectrum']['power'].shape)
+        self.assertNotIn('scale-1', full['blocks'])
+
+
+if __name__ == '__main__':
+    unittest.main()
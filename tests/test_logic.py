@@ -5,6 +5,7 @@ from unittest.case import expectedFailure
 import model 
 import numpy as np
 from unittest.mock import Mock
+from collections import Counter
 
 from model import logic
 
@@ -212,6 +213,59 @@ class TestGetEventParticlesWithNSubregions(unittest.TestCase):
         self.assertEqual(len(list), 1)
 
 # Test Define Subregions
+    def test_rng_selection_is_reproducible(self):
+        model_particles = np.zeros((self.num_particles, ATTR_COUNT))
+        model_particles[:,3] = np.arange(self.num_particles)
+        model_particles[:,4] = np.ones(self.num_particles)
+        model_particles[:,0] = [1, 2, 3, 11, 12, 13]
+
+        selections = [logic.get_event_particles(2, self.mock_sub_list_2, model_particles,
+                                                self.level_limit, rng=np.random.default_rng(4))
+                                                for _ in range(2)]
+        np.testing.assert_array_equal(selections[0], selections[1])
+        self.assertEqual(2, np.sum(selections[0] < 3))
+        self.assertEqual(2, np.sum(selections[0] >= 3))
+
+    def test_counters_count_requested_and_forced_events(self):
+        model_particles = np.zeros((self.num_particles, ATTR_COUNT))
+        model_particles[:,3] = np.arange(self.num_particles)
+        model_particles[:,4] = np.ones(self.num_particles)
+        model_particles[:,0] = [1, 2, 3, 11, 12, 13]
+
+        counters = Counter()
+        logic.get_event_particles(2, self.mock_sub_list_2, model_particles, self.level_limit,
+                                  rng=np.random.default_rng(4), counters=counters)
+        self.assertEqual({'events_requested': 4, 'events': 4}, dict(counters))
+
+        counters = Counter()
+        logic.get_event_particles(0, self.mock_sub_list_2, model_particles, self.level_limit,
+                                  rng=np.random.default_rng(4), counters=counters)
+        self.assertEqual({'events_requested': 0, 'forced_events': 2, 'events': 2},
+                         dict(counters))
+
+    def test_sweep_points_with_the_same_seed_choose_the_same_events(self):
+        model_particles = np.zeros((20, ATTR_COUNT))
+        model_particles[:,3] = np.arange(20)
+        model_particles[:,4] = 1
+        model_particles[:,0] = np.concatenate([np.arange(10) + 0.5, np.arange(10) + 10.5])
+        # Another sweep point whose state has drifted: two particles of
+        # the first subregion are buried
+        drifted = model_particles.copy()
+        drifted[[1, 6], 4] = 0
+
+        for seed in range(20):
+            chosen = [logic.get_event_particles(4, self.mock_sub_list_2, particles.copy(),
+                                                self.level_limit,
+                                                rng=np.random.default_rng([seed, 1, 0]))
+                        for particles in [model_particles, model_particles, drifted]]
+            np.testing.assert_array_equal(chosen[0], chosen[1])
+            # The second subregion does not see the drift at all, the
+            # first loses at most the particles which were buried
+            np.testing.assert_array_equal(chosen[0][chosen[0] >= 10], chosen[2][chosen[2] >= 10])
+            kept = np.setdiff1d(chosen[0][chosen[0] < 10], [1, 6])
+            self.assertTrue(np.all(np.isin(kept, chosen[2])))
+
+
 class TestDefineSubregions(unittest.TestCase):
 
     def setUp(self):
@@ -887,6 +941,30 @@ class TestComputeHops(unittest.TestCase):
         event_particles = logic.compute_hops(event_particles_idx, model_particles, mu, sigma, normal=False)
         self.assertCountEqual(np.round([1.55428104, 1.10521435, 1.27721828], 1), event_particles[:,0])
 
+    def test_rng_draws_common_quantiles(self):
+        model_particles = np.zeros((50, ATTR_COUNT), dtype=float)
+        event_particles_idx = np.arange(50)
+        narrow = logic.compute_hops(event_particles_idx, model_particles, 1, 1, normal=True,
+                                    rng=np.random.default_rng(7))
+        wide = logic.compute_hops(event_particles_idx, model_particles, 1, 2, normal=True,
+                                  rng=np.random.default_rng(7))
+        # Same quantiles: (hop - mu) scales with sigma, up to the rounding to 0.1
+        np.testing.assert_allclose(2 * (narrow[:,0] - 1), wide[:,0] - 1, atol=0.15)
+
+    def test_rng_quantile_of_a_particle_does_not_depend_on_the_other_events(self):
+        model_particles = np.zeros((50, ATTR_COUNT), dtype=float)
+        one = logic.compute_hops(np.array([7]), model_particles, 0, 0.25,
+                                 rng=np.random.default_rng(3))
+        many = logic.compute_hops(np.array([2, 7, 30]), model_particles, 0, 0.35,
+                                  rng=np.random.default_rng(3))
+        np.testing.assert_allclose(np.log(one[0,0]) * 0.35 / 0.25, np.log(many[1,0]), atol=0.2)
+
+    def test_rng_lognormal_hops_are_positive(self):
+        model_particles = np.zeros((50, ATTR_COUNT), dtype=float)
+        event_particles = logic.compute_hops(np.arange(50), model_particles, 0, 0.25,
+                                             rng=np.random.default_rng(0))
+        self.assertTrue(np.all(event_particles[:,0] > 0))
+
 
 class TestMoveModelParticles(unittest.TestCase):
 
@@ -963,6 +1041,63 @@ class TestMoveModelParticles(unittest.TestCase):
         self.assertIsNone(np.testing.assert_array_equal(expected_supports, moved_supports))
         self.assertEqual(expected_counter, moved_model[0][6])
 
+    def test_accumulators_tally_hop_to_closest_vertex(self):
+        placement = 5
+        model_particles = np.zeros((2, ATTR_COUNT), dtype=float)
+        model_particles[:,1] = self.diam
+        model_particles[:,3] = [0, 1]
+        model_particles[1][0] = placement
+
+        two_bed = np.zeros((2, ATTR_COUNT))
+        two_bed[0][3] = -1
+        two_bed[1][3] = -2
+        two_bed[0][0] = placement - (self.diam/2)
+        two_bed[1][0] = placement + (self.diam/2)
+        model_supports = np.zeros((2, 2), dtype=float)
+        available_vertices = np.array([placement])
+
+        one_event = model_particles[[1]].copy()
+        one_event[0][0] = 4.2 # desired hop, the closest vertex is 5
+        model_particles[1][0] = 2
+        accumulators = np.zeros((2, 3))
+        accumulators[1] = [2, 4.0, 2.5]
+        logic.move_model_particles(one_event, model_particles, model_supports,
+                                    two_bed, available_vertices, self.h, accumulators)
+
+        expected_accumulators = np.array([[0, 0, 0], [3, 7.0, 3.0]])
+        self.assertIsNone(np.testing.assert_array_equal(expected_accumulators, accumulators))
+
+    def test_accumulators_tally_desired_hop_of_looped_particle(self):
+        empty_bed = np.empty((0, ATTR_COUNT))
+        available_vertices = np.arange((3))
+
+        model_particles = np.zeros((1, ATTR_COUNT), dtype=float)
+        model_particles[:,0] = 1
+        ghost_event = model_particles[[0]].copy()
+        ghost_event[0][0] = 4.5
+        model_supports = np.array([[1.0, 5.0]], dtype=float)
+        accumulators = np.zeros((1, 3))
+        logic.move_model_particles(ghost_event, model_particles, model_supports,
+                                    empty_bed, available_vertices, self.h, accumulators)
+
+        expected_accumulators = np.array([[1, 3.5, 3.5]])
+        self.assertIsNone(np.testing.assert_array_equal(expected_accumulators, accumulators))
+
+    def test_counters_count_hops_and_loops(self):
+        empty_bed = np.empty((0, ATTR_COUNT))
+        available_vertices = np.arange((3))
+
+        model_particles = np.zeros((1, ATTR_COUNT), dtype=float)
+        model_particles[:,0] = 1
+        ghost_event = model_particles[[0]].copy()
+        ghost_event[0][0] = 4.5
+        model_supports = np.array([[1.0, 5.0]], dtype=float)
+        counters = Counter()
+        logic.move_model_particles(ghost_event, model_particles, model_supports,
+                                    empty_bed, available_vertices, self.h, counters=counters)
+
+        self.assertEqual({'loops': 1}, dict(counters))
+
 
 class TestUpdateFlux(unittest.TestCase): # Easy
 
@@ -1071,6 +1206,36 @@ class TestUpdateFlux(unittest.TestCase): # Easy
         self.mock_subregion_2.reset_mock()
 
 
+class TestGauges(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_subregion = Mock()
+        self.mock_subregion.leftBoundary.return_value = 0
+        self.mock_subregion.rightBoundary.return_value = 10
+        self.gauges = logic.Gauges([2.5, 5, 7.5], 3)
+
+    def test_crossings_are_counted_per_gauge_and_iteration(self):
+        init_pos = np.array([1, 2.5, 4, 6])
+        final_pos = np.array([3, 6, 5, 9])
+        logic.update_flux(init_pos, final_pos, 1, [self.mock_subregion], self.gauges)
+
+        expected_counts = np.array([[0, 1, 0], [0, 2, 0], [0, 1, 0]])
+        self.assertIsNone(np.testing.assert_array_equal(expected_counts, self.gauges.counts))
+
+    def test_particle_leaving_stream_crosses_every_downstream_gauge(self):
+        init_pos = np.array([6])
+        final_pos = np.array([-1])
+        logic.update_flux(init_pos, final_pos, 0, [self.mock_subregion], self.gauges)
+
+        self.assertIsNone(np.testing.assert_array_equal([0, 0, 1], self.gauges.counts[:,0]))
+
+    def test_no_event_particles_counts_nothing(self):
+        logic.update_flux(np.array([]), np.array([]), 0, [self.mock_subregion], self.gauges)
+
+        self.assertEqual(0, self.gauges.counts.sum())
+        self.assertIsNone(np.testing.assert_array_equal([0, 0, 0], self.gauges.getCountList(0)))
+
+
 class TestFindClosestVertex(unittest.TestCase): # Easy 
     
     def test_empty_available_vertices_returns_value_error(self):
@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+from unittest.mock import patch
+
+from model import perf
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    def run_iterations(self, timer, laps, iterations):
+        """ Run iterations with a fake clock, lapping (phase, seconds) pairs """
+        clock = [0.0]
+        with patch('time.perf_counter', side_effect=lambda: clock[0]):
+            for _ in range(iterations):
+                timer.start()
+                for phase, seconds in laps:
+                    clock[0] += seconds
+                    timer.lap(phase)
+                timer.end_iteration()
+
+    def test_laps_are_charged_to_their_phase(self):
+        timer = perf.PhaseTimer(phases=['a', 'b'], block=4)
+        self.run_iterations(timer, [('a', 0.001), ('b', 0.002), ('a', 0.001)], 10)
+        results = timer.results()
+        self.assertEqual(10, results['iterations'])
+        np.testing.assert_allclose([0.02, 0.02], results['total_seconds'])
+        np.testing.assert_allclose([0.002, 0.002], results['max_seconds'])
+        self.assertEqual([10, 10], list(results['histogram'].sum(axis=1)))
+
+    def test_percentiles_bound_the_lap_time(self):
+        timer = perf.PhaseTimer(phases=['a'])
+        self.run_iterations(timer, [('a', 0.0015)], 100)
+        percentiles = timer.percentiles()[0]
+        self.assertTrue(np.all(percentiles >= 0.0015))
+        self.assertTrue(np.all(percentiles <= 0.0015 * 10**0.1 + 1e-12))
+
+    def test_report_lists_every_phase(self):
+        timer = perf.PhaseTimer()
+        report = timer.report()
+        for phase in perf.PHASES:
+            self.assertIn(phase, report)
+
+
+if __name__ == '__main__':
+    unittest.main()
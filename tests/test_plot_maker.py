@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import numpy as np
+
+from model import sinks
+
+PLOTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plots')
+
+ATTR_COUNT = 7 # Number of attributes associated with a Particle
+
+PARAMETERS = {'n_iterations': 6, 'data_save_interval': 1, 'x_max': 10, 'num_subregions': 2,
+                'filename_prefix': 'test', 'output_sinks': ['hdf5']}
+
+
+class TestPlotMaker(unittest.TestCase):
+    """ Render the frames of a short fake run (plot_maker.py bare-imports
+    plotting.py and reader.py, so it is driven as a script) """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'test-run.hdf5')
+        self.out = os.path.join(self.tmp.name, 'plots')
+        bed = np.zeros((10, ATTR_COUNT))
+        bed[:,0] = np.arange(10) + 0.5
+        bed[:,1] = 1.0
+        model = np.zeros((3, ATTR_COUNT))
+        model[:,1] = 1.0
+        model[:,3] = np.arange(3)
+        sink = sinks.HDF5Sink(self.path)
+        sink.open('run', PARAMETERS, bed, model)
+        for iteration in range(PARAMETERS['n_iterations']):
+            model[:,0] = iteration + np.arange(3)
+            sink.write_snapshot(iteration, model, np.arange(3))
+        sink.write_results({'final_metrics': {'subregions': {'subregion-0-flux': np.zeros(6),
+                                                             'subregion-1-flux': np.arange(6)},
+                                              'avg_age': np.ones(6),
+                                              'age_range': np.ones(6)}})
+        sink.close()
+
+    def python(self, code, **kwargs):
+        return subprocess.run([sys.executable, '-c', code], cwd=PLOTS_DIR, capture_output=True,
+                              text=True, timeout=300, **kwargs)
+
+    def test_pool_returns_frames_in_order(self):
+        os.mkdir(self.out)
+        result = self.python('import json, plot_maker\n'
+                             f'paths = plot_maker.render_stream({self.path!r}, {self.out + os.sep!r}, '
+                             'range(0, 6), 10, processes=2)\n'
+                             'print(json.dumps(paths))')
+        self.assertEqual(0, result.returncode, result.stderr)
+        paths = json.loads(result.stdout)
+        self.assertEqual([os.path.join(self.out, f'iter{i}.png') for i in range(6)], paths)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_existing_output_aborts_without_a_terminal(self):
+        os.mkdir(self.out)
+        result = subprocess.run([sys.executable, 'plot_maker.py', self.path, self.out, '0', '5'],
+                                cwd=PLOTS_DIR, capture_output=True, text=True, timeout=300,
+                                stdin=subprocess.DEVNULL)
+        self.assertEqual(0, result.returncode, result.stderr)
+        self.assertIn('Exiting plotting script', result.stdout)
+        self.assertEqual([], os.listdir(self.out))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
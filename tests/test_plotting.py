@@ -0,0 +1,117 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import matplotlib
+from PIL import Image
+
+from plots import plotting
+
+
+class TestMovingAverage(unittest.TestCase):
+
+    def test_matches_convolution(self):
+        values = np.random.default_rng(1).poisson(2, 100)
+        np.testing.assert_allclose(np.convolve(values, np.ones(7) / 7, mode='valid'),
+                                   plotting.moving_average(values, 7))
+
+    def test_averages_each_series(self):
+        series = np.random.default_rng(2).poisson(2, (2, 3, 50))
+        averages = plotting.moving_average(series, 5)
+        self.assertEqual((2, 3, 46), averages.shape)
+        np.testing.assert_allclose(plotting.moving_average(series[1, 2], 5), averages[1, 2])
+
+
+class TestStreamRenderer(unittest.TestCase):
+
+    def setUp(self):
+        matplotlib.use('Agg')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bed = np.zeros((10, 7))
+        self.bed[:,0] = np.arange(10) + 0.5
+        self.bed[:,1] = 1.0
+        self.model = np.zeros((4, 7))
+        self.model[:,0] = [1, 3, 5, 7]
+        self.model[:,1] = 1.0
+        self.model[:,2] = 0.9
+        self.model[:,5] = [0, 1, 2, 3]
+        self.renderer = plotting.StreamRenderer(self.bed, 10, 5, self.tmp.name + os.sep)
+
+    def test_frames_reuse_the_figure_and_bed(self):
+        renderer = self.renderer
+        fig, ax = renderer.fig, renderer.ax
+        paths = [renderer.render(0, self.model)]
+        bed, models, colorbar = ax.collections[0], renderer.models, renderer.colorbar
+        offsets = np.array(models.get_offsets())
+        colours = np.array(models.get_facecolors())
+
+        moved = self.model.copy()
+        moved[:,0] += 1
+        moved[:,5] = [3, 2, 1, 0]
+        paths.append(renderer.render(1, moved))
+        self.assertIs(fig, renderer.fig)
+        self.assertIs(ax, renderer.ax)
+        self.assertIs(bed, ax.collections[0])
+        self.assertIs(models, renderer.models)
+        self.assertIs(colorbar, renderer.colorbar)
+        self.assertEqual(2, len(ax.collections))
+        np.testing.assert_allclose(offsets + [1, 0], models.get_offsets())
+        self.assertFalse(np.allclose(colours, models.get_facecolors()))
+        np.testing.assert_allclose(colours[::-1], models.get_facecolors())
+        self.assertEqual('Iteration 1', renderer.title.get_text())
+        self.assertEqual([os.path.join(self.tmp.name, f'iter{i}.png') for i in [0, 1]], paths)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_frame_returns_rgb_image(self):
+        first = self.renderer.frame(0, self.model)
+        moved = self.model.copy()
+        moved[:,0] += 1
+        second = self.renderer.frame(1, moved)
+        self.assertEqual('RGB', first.mode)
+        self.assertEqual(first.size, second.size)
+        self.assertFalse(np.array_equal(np.asarray(first), np.asarray(second)))
+        self.assertEqual([], os.listdir(self.tmp.name))
+
+    def tearDown(self):
+        self.renderer.close()
+        self.tmp.cleanup()
+
+
+class TestAnimationWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.frames = [np.full((8, 10, 3), value, dtype=np.uint8) for value in [0, 100, 200]]
+
+    def test_webp_and_apng_keep_full_colour(self):
+        for name in ['test.webp', 'test.png']:
+            path = os.path.join(self.tmp.name, name)
+            with plotting.AnimationWriter(path) as writer:
+                for frame in self.frames:
+                    writer.add(frame)
+                self.assertTrue(all(frame.mode == 'RGB' for frame in writer.frames))
+            with Image.open(path) as im:
+                self.assertEqual(3, im.n_frames)
+
+    def test_too_many_buffered_frames_raise_value_error(self):
+        path = os.path.join(self.tmp.name, 'test.webp')
+        with self.assertRaises(ValueError):
+            with plotting.AnimationWriter(path, max_frames=2) as writer:
+                for frame in self.frames:
+                    writer.add(frame)
+        self.assertFalse(os.path.exists(path))
+
+    def test_gif_has_no_frame_limit(self):
+        path = os.path.join(self.tmp.name, 'test.gif')
+        with plotting.AnimationWriter(path, max_frames=2) as writer:
+            for frame in self.frames:
+                writer.add(frame)
+        with Image.open(path) as im:
+            self.assertEqual(3, im.n_frames)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
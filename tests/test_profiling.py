@@ -0,0 +1,52 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from model import profiling
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_writes_pstats_and_collapsed_stacks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            stem = os.path.join(tmp, 'run')
+            with profiling.Profiler(stem, interval=0.001) as profiler:
+                for _ in range(50):
+                    busy(20000)
+            self.assertEqual([f'{stem}.pstats', f'{stem}.collapsed'], profiler.paths)
+            stats = pstats.Stats(f'{stem}.pstats')
+            self.assertTrue(any(func[2] == 'busy' for func in stats.stats))
+            with open(f'{stem}.collapsed') as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines)
+            for line in lines:
+                stack, count = line.rsplit(' ', 1)
+                self.assertGreater(int(count), 0)
+            self.assertTrue(any('busy' in line for line in lines))
+
+    def test_memory_tracer_records_growth_per_phase(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            stem = os.path.join(tmp, 'run')
+            profiler = profiling.Profiler(stem, trace_memory=True, memory_interval=2)
+            profiler.start()
+            kept = []
+            for iteration in range(3):
+                kept.append(bytearray(100000))
+                profiler.memory.observe('alloc', iteration)
+                profiler.memory.observe('noop', iteration)
+            paths = profiler.stop()
+            self.assertGreaterEqual(profiler.memory.growth['alloc'], 100000)
+            # start, end and two boundaries in each of iterations 0 and 2
+            snapshots = [path for path in paths if path.endswith('.tracemalloc')]
+            self.assertEqual(6, len(snapshots))
+            self.assertEqual(len(snapshots), len(set(snapshots)))
+            self.assertIn(f'{stem}-memory.txt', paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
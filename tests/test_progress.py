@@ -0,0 +1,90 @@
+import os
+import json
+import unittest
+import tempfile
+from unittest.mock import Mock, patch
+
+from model import progress
+
+
+class ProgressTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stem = os.path.join(self.tmp.name, 'test-run')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class TestProgressReporter(ProgressTestCase):
+
+    def test_writes_rates_and_eta(self):
+        clock = [100.0]
+        with patch('time.monotonic', side_effect=lambda: clock[0]):
+            reporter = progress.ProgressReporter(self.stem, 'run', 100, interval=5,
+                                                 formats=['json', 'prometheus'])
+            clock[0] = 102.0
+            reporter.update(9)
+            self.assertFalse(os.path.exists(f'{self.stem}-progress.json'))
+            clock[0] = 105.0
+            reporter.update(19)
+        with open(f'{self.stem}-progress.json') as f:
+            values = json.load(f)
+        self.assertEqual('running', values['state'])
+        self.assertEqual(19, values['iteration'])
+        self.assertAlmostEqual(4.0, values['iterations_per_second'])
+        self.assertAlmostEqual(20.0, values['eta_seconds'])
+        self.assertGreater(values['rss_bytes'], 0)
+        with open(f'{self.stem}.prom') as f:
+            text = f.read()
+        self.assertIn('belt_iteration{run_id="run"} 19', text)
+        self.assertIn('belt_state{run_id="run",state="running"} 1', text)
+        self.assertEqual([], [name for name in os.listdir(self.tmp.name) if name.endswith('.tmp')])
+
+    def test_finish_counts_bytes_written(self):
+        output = os.path.join(self.tmp.name, 'output.bin')
+        with open(output, 'wb') as f:
+            f.write(b'0' * 10)
+        reporter = progress.ProgressReporter(self.stem, 'run', 10, output_paths=lambda: [output])
+        reporter.finish(3, 'failed')
+        values = progress.read_progress(f'{self.stem}-progress.json')
+        self.assertEqual('failed', values['state'])
+        self.assertEqual(10, values['bytes_written'])
+        self.assertEqual(0, values['eta_seconds'])
+
+    def test_rss_is_none_without_proc_or_resource(self):
+        with patch('builtins.open', side_effect=OSError), \
+                patch.dict('sys.modules', {'resource': None}):
+            self.assertIsNone(progress.current_rss())
+
+    def test_unknown_format_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            progress.ProgressReporter(self.stem, 'run', 10, formats=['csv'])
+
+
+class TestEnsembleProgress(ProgressTestCase):
+
+    def test_runs_are_added_up(self):
+        ensemble = progress.EnsembleProgress(self.stem, 'ensemble')
+        for run_id, returncode, iteration in [('a', None, 9), ('b', 0, 19), ('c', 1, 4)]:
+            path = os.path.join(self.tmp.name, f'{run_id}-progress.json')
+            with open(path, 'w') as f:
+                json.dump({'iteration': iteration, 'iterations_per_second': 2.0,
+                           'eta_seconds': 5.0, 'rss_bytes': 100, 'bytes_written': 10}, f)
+            ensemble.add(run_id, Mock(**{'poll.return_value': returncode}), path)
+        ensemble.add('d', Mock(**{'poll.return_value': None}), 'missing-progress.json')
+        ensemble.write()
+
+        values = progress.read_progress(f'{self.stem}-progress.json')
+        self.assertEqual('running', values['state'])
+        self.assertEqual((4, 2, 1, 1), (values['runs'], values['runs_running'],
+                                        values['runs_finished'], values['runs_failed']))
+        self.assertEqual(35, values['iterations'])
+        self.assertEqual(2.0, values['iterations_per_second'])
+        self.assertEqual(100, values['rss_bytes'])
+        self.assertEqual(30, values['bytes_written'])
+
+
+if __name__ == '__main__':
+    unittest.main()
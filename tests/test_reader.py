@@ -0,0 +1,150 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+
+from model import sinks
+from plots import reader
+
+ATTR_COUNT = 7 # Number of attributes associated with a Particle
+
+PARAMETERS = {'n_iterations': 6, 'data_save_interval': 1, 'x_max': 10, 'num_subregions': 2,
+                'filename_prefix': 'test', 'output_sinks': ['hdf5']}
+
+
+class ReaderTestCase(unittest.TestCase):
+    """ Write a short fake run through a sink and read it back """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bed = np.zeros((5, ATTR_COUNT))
+        self.bed[:,0] = np.arange(5)
+        self.model = np.zeros((3, ATTR_COUNT))
+        self.model[:,3] = np.arange(3)
+        self.initial_model = self.model.copy()
+        self.snapshots = []
+        self.results = {'final_metrics': {'subregions': {'subregion-0-flux': np.arange(6),
+                                                         'subregion-1-flux': np.arange(6) * 2},
+                                          'avg_age': np.linspace(0, 1, 6),
+                                          'age_range': np.ones(6)}}
+
+    def run_sink(self, sink):
+        sink.open('run', PARAMETERS, self.bed, self.model)
+        for iteration in range(PARAMETERS['n_iterations']):
+            self.model[:,0] = iteration
+            self.model[:,5] = iteration / 2
+            sink.write_snapshot(iteration, self.model, np.array([0, iteration]))
+            self.snapshots.append(self.model.copy())
+        sink.write_results(self.results)
+        sink.close()
+
+    def check_reader(self, path):
+        with reader.RunReader(path, cache_size=16) as run:
+            self.assertEqual(6, run.params['n_iterations'])
+            self.assertEqual(2, run.params['num_subregions'])
+            np.testing.assert_array_equal(self.bed, run.bed)
+            np.testing.assert_array_equal(self.initial_model, run.initial_model)
+
+            np.testing.assert_array_equal(np.arange(6), run.snapshots.iterations)
+            self.assertEqual(6, len(run.snapshots))
+            np.testing.assert_array_equal(self.snapshots[2], run.snapshots[2])
+            np.testing.assert_array_equal(self.snapshots[-1], run.snapshots[-1])
+            np.testing.assert_array_equal(np.stack(self.snapshots[1:4]), run.snapshots[1:4])
+            np.testing.assert_array_equal(np.stack(self.snapshots[::2]), run.snapshots[::2])
+            self.assertEqual((0, 3, ATTR_COUNT), run.snapshots[4:4].shape)
+            with self.assertRaises(IndexError):
+                run.snapshots[6]
+
+            np.testing.assert_array_equal(self.initial_model, run.state_at(0))
+            np.testing.assert_array_equal(self.snapshots[3], run.state_at(4))
+            np.testing.assert_array_equal([0, 3], run.event_ids(3))
+            with self.assertRaises(KeyError):
+                run.state_at(7)
+
+            final_metrics = self.results['final_metrics']
+            np.testing.assert_array_equal(final_metrics['subregions']['subregion-1-flux'],
+                                          run.flux())
+            np.testing.assert_array_equal(final_metrics['subregions']['subregion-0-flux'][2:5],
+                                          run.flux(0, 2, 5))
+            np.testing.assert_array_equal(final_metrics['avg_age'], run.avg_age())
+            np.testing.assert_array_equal(final_metrics['age_range'], run.age_range())
+
+    def check_cache_hits(self, path):
+        with reader.RunReader(path, cache_size=16) as run:
+            reads = []
+            read_block = run.snapshots.read_block
+            def counting_read_block(start, stop):
+                reads.append((start, stop))
+                return read_block(start, stop)
+            run.snapshots.read_block = counting_read_block
+
+            first = run.snapshots[2]
+            self.assertIs(first, run.snapshots[2])
+            self.assertIs(run.flux(), run.flux())
+            self.assertEqual([(2, 3)], reads)
+            # Snapshots 1 and 3 are missing: read one by one from the
+            # standard layout, as one block from the others
+            run.snapshots[1:4]
+            run.snapshots[1:4]
+            expected = [(2, 3), (1, 2), (3, 4)] if run.layout == 'standard' else [(2, 3), (1, 4)]
+            self.assertEqual(expected, reads)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class TestReaderLayouts(ReaderTestCase):
+
+    def test_standard_hdf5(self):
+        path = os.path.join(self.tmp.name, 'test-run.hdf5')
+        self.run_sink(sinks.HDF5Sink(path))
+        with reader.RunReader(path) as run:
+            self.assertEqual('standard', run.layout)
+        self.check_reader(path)
+        self.check_cache_hits(path)
+
+    def test_compact_hdf5(self):
+        path = os.path.join(self.tmp.name, 'test-run.hdf5')
+        self.run_sink(sinks.CompactHDF5Sink(path))
+        with reader.RunReader(path) as run:
+            self.assertEqual('compact', run.layout)
+        self.check_reader(path)
+        self.check_cache_hits(path)
+
+    def test_swmr_hdf5(self):
+        path = os.path.join(self.tmp.name, 'test-run-live.hdf5')
+        self.run_sink(sinks.SWMRHDF5Sink(path))
+        self.check_reader(path)
+        self.check_cache_hits(path)
+        with reader.RunReader(path, swmr=True) as run:
+            np.testing.assert_array_equal(self.snapshots[-1], run.snapshots[-1])
+
+    def test_numpy(self):
+        path = os.path.join(self.tmp.name, 'test-run')
+        self.run_sink(sinks.NumpySink(path))
+        with reader.RunReader(path) as run:
+            self.assertEqual('numpy', run.layout)
+            arrays = run.arrays
+        # The results.npz archive is closed with the reader
+        self.assertIsNone(arrays.zip)
+        self.check_reader(path)
+        self.check_cache_hits(path)
+
+
+class TestReaderCache(ReaderTestCase):
+
+    def test_cache_evicts_least_recently_used(self):
+        path = os.path.join(self.tmp.name, 'test-run.hdf5')
+        self.run_sink(sinks.HDF5Sink(path))
+        with reader.RunReader(path, cache_size=2) as run:
+            run.snapshots[0]
+            run.snapshots[1]
+            run.snapshots[0]
+            run.snapshots[2]
+            self.assertIn(('snapshot', 0), run.cache)
+            self.assertNotIn(('snapshot', 1), run.cache)
+            self.assertEqual(2, len(run.cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
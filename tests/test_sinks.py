@@ -0,0 +1,231 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import h5py
+from unittest.mock import Mock
+from multiprocessing import resource_tracker
+
+from model import sinks
+
+ATTR_COUNT = 7 # Number of attributes associated with a Particle
+
+PARAMETERS = {'n_iterations': 4, 'data_save_interval': 2, 'x_max': 10, 'num_subregions': 1,
+                'filename_prefix': 'test', 'output_sinks': ['hdf5', 'null']}
+
+
+class SinkTestCase(unittest.TestCase):
+    """ Drive a sink through a short fake run """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bed = np.zeros((5, ATTR_COUNT))
+        self.model = np.zeros((3, ATTR_COUNT))
+        self.model[:,3] = np.arange(3)
+        self.results = {'final_metrics': {'subregions': {'subregion-0-flux': np.arange(4)},
+                                            'avg_age': np.ones(4),
+                                            'age_range': np.zeros(4)}}
+
+    def run_sink(self, sink):
+        sink.open('run', PARAMETERS, self.bed, self.model)
+        for iteration in [1, 3]:
+            self.model[:,0] = iteration
+            sink.write_snapshot(iteration, self.model, np.array([0, iteration - 1]))
+            sink.write_record('tracers', iteration, self.model[:iteration])
+        sink.write_results(self.results)
+        sink.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class TestMemorySink(SinkTestCase):
+
+    def test_snapshots_are_copies(self):
+        sink = sinks.MemorySink()
+        self.run_sink(sink)
+        self.assertCountEqual([1, 3], sink.snapshots.keys())
+        self.assertTrue(np.all(sink.snapshots[1][0][:,0] == 1))
+        self.assertTrue(np.all(sink.snapshots[3][0][:,0] == 3))
+        self.assertEqual((1, ATTR_COUNT), sink.records['tracers'][1].shape)
+        self.assertEqual(PARAMETERS['x_max'], sink.parameters['x_max'])
+        np.testing.assert_array_equal(np.arange(4),
+                    sink.results['final_metrics']['subregions']['subregion-0-flux'])
+
+
+class TestMultiSink(SinkTestCase):
+
+    def test_every_sink_receives_every_write(self):
+        first, second = Mock(), Mock()
+        self.run_sink(sinks.MultiSink([first, second]))
+        for mock_sink in [first, second]:
+            mock_sink.open.assert_called_once()
+            self.assertEqual(2, mock_sink.write_snapshot.call_count)
+            mock_sink.write_results.assert_called_once_with(self.results)
+            mock_sink.close.assert_called_once()
+
+    def test_snapshots_skipped_for_sinks_not_wanting_them(self):
+        memory = sinks.MemorySink(snapshots=False)
+        multi = sinks.MultiSink([sinks.NullSink(), memory])
+        self.assertFalse(multi.wants_snapshots)
+        self.run_sink(multi)
+        self.assertEqual({}, memory.snapshots)
+        self.assertIn('final_metrics', memory.results)
+
+
+class TestCallbackSink(SinkTestCase):
+
+    def test_callback_receives_kinds_in_order(self):
+        callback = Mock()
+        self.run_sink(sinks.CallbackSink(callback))
+        kinds = [call.args[0] for call in callback.call_args_list]
+        self.assertEqual(['open', 'snapshot', 'record', 'snapshot', 'record', 'results', 'close'], 
+                            kinds)
+
+
+class TestHDF5Sinks(SinkTestCase):
+
+    def test_standard_layout(self):
+        path = os.path.join(self.tmp.name, 'run.hdf5')
+        self.run_sink(sinks.HDF5Sink(path))
+        with h5py.File(path, 'r') as f:
+            self.assertEqual(4, f['params']['n_iterations'][()])
+            self.assertEqual('yaml', f['params']['output_sinks'].attrs['encoding'])
+            np.testing.assert_array_equal(self.bed, f['initial_values']['bed'][()])
+            self.assertTrue(np.all(f['iteration_3']['model'][:,0] == 3))
+            np.testing.assert_array_equal([0, 2], f['iteration_3']['event_ids'][()])
+            self.assertEqual((3, ATTR_COUNT), f['records']['tracers']['iteration_3'].shape)
+            np.testing.assert_array_equal(np.arange(4),
+                            f['final_metrics']['subregions']['subregion-0-flux'][()])
+
+    def test_compact_layout(self):
+        path = os.path.join(self.tmp.name, 'run-compact.hdf5')
+        self.run_sink(sinks.CompactHDF5Sink(path))
+        with h5py.File(path, 'r') as f:
+            self.assertEqual('compact', f.attrs['layout'])
+            self.assertEqual((2, 3, ATTR_COUNT), f['snapshots']['model'].shape)
+            np.testing.assert_array_equal([1, 3], f['snapshots']['iteration'][()])
+            np.testing.assert_array_equal([0, 2, 4], f['snapshots']['event_offsets'][()])
+            np.testing.assert_array_equal([0, 0, 0, 2], f['snapshots']['event_ids'][()])
+            np.testing.assert_array_equal([0, 1, 4], f['records']['tracers']['offsets'][()])
+            np.testing.assert_array_equal([1, 3], f['records']['tracers']['iteration'][()])
+            np.testing.assert_array_equal(np.ones(4), f['final_metrics']['avg_age'][()])
+
+    def test_swmr_progress_is_flushed_before_results(self):
+        path = os.path.join(self.tmp.name, 'run-live.hdf5')
+        sink = sinks.SWMRHDF5Sink(path)
+        sink.declare_record('tracers', ATTR_COUNT)
+        sink.open('run', PARAMETERS, self.bed, self.model)
+        live = {'subregions': {'subregion-0-flux': np.array([2, 1, 0, 0])},
+                'avg_age': np.array([1.0, 2.0, -1, -1]),
+                'age_range': np.array([0.0, 1.0, -1, -1])}
+        sink.write_record('tracers', 1, self.model[:2])
+        sink.write_progress(1, live)
+        with h5py.File(path, 'r', libver='latest', swmr=True) as f:
+            self.assertEqual(1, f['live']['iteration'][0])
+            np.testing.assert_array_equal([1.0, 2.0, -1, -1], f['final_metrics']['avg_age'][()])
+            self.assertEqual((2, ATTR_COUNT), f['records']['tracers']['rows'].shape)
+        sink.write_results(self.results)
+        sink.close()
+        with h5py.File(path, 'r') as f:
+            np.testing.assert_array_equal(np.ones(4), f['final_metrics']['avg_age'][()])
+            np.testing.assert_array_equal(np.arange(4),
+                            f['final_metrics']['subregions']['subregion-0-flux'][()])
+
+    def test_swmr_marks_early_stop_as_finished(self):
+        path = os.path.join(self.tmp.name, 'run-live.hdf5')
+        sink = sinks.SWMRHDF5Sink(path)
+        sink.open('run', PARAMETERS, self.bed, self.model)
+        live = {'subregions': {'subregion-0-flux': np.array([2, 1, 0, 0])},
+                'avg_age': np.array([1.0, 2.0, -1, -1]),
+                'age_range': np.array([0.0, 1.0, -1, -1])}
+        sink.write_progress(1, live)
+        with h5py.File(path, 'r', libver='latest', swmr=True) as f:
+            self.assertEqual(0, f['live']['finished'][0])
+        # The run stops after 2 of its 4 iterations
+        sink.write_results({'final_metrics': {'avg_age': np.array([1.0, 2.0])}})
+        sink.close()
+        with h5py.File(path, 'r') as f:
+            self.assertEqual(1, f['live']['finished'][0])
+            self.assertEqual(2, f['live']['n_iterations_run'][0])
+            self.assertTrue(f.attrs['finished'])
+            self.assertEqual(2, f.attrs['n_iterations_run'])
+            np.testing.assert_array_equal([1.0, 2.0], f['final_metrics']['avg_age'][()])
+
+
+class TestNumpySink(SinkTestCase):
+
+    def test_memmap_and_results(self):
+        path = os.path.join(self.tmp.name, 'run-npy')
+        self.run_sink(sinks.NumpySink(path))
+        snapshots = np.load(os.path.join(path, 'snapshots.npy'), mmap_mode='r')
+        self.assertEqual((2, 3, ATTR_COUNT), snapshots.shape)
+        self.assertTrue(np.all(snapshots[1][:,0] == 3))
+        with np.load(os.path.join(path, 'results.npz')) as results:
+            np.testing.assert_array_equal(np.ones(4), results['final_metrics/avg_age'])
+            np.testing.assert_array_equal([1, 3], results['snapshots/iteration'])
+            np.testing.assert_array_equal([0, 1, 4], results['records/tracers/offsets'])
+
+    def test_close_without_open_writes_nothing(self):
+        path = os.path.join(self.tmp.name, 'run-npy')
+        sinks.NumpySink(path).close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_early_stop_leaves_no_empty_snapshots(self):
+        path = os.path.join(self.tmp.name, 'run-npy')
+        sink = sinks.NumpySink(path)
+        sink.open('run', dict(PARAMETERS, n_iterations=2000, data_save_interval=1),
+                  self.bed, self.model)
+        for iteration in range(3):
+            self.model[:,0] = iteration + 1
+            sink.write_snapshot(iteration, self.model, np.array([iteration]))
+        sink.close()
+        snapshots = np.load(os.path.join(path, 'snapshots.npy'), mmap_mode='r')
+        self.assertEqual((3, 3, ATTR_COUNT), snapshots.shape)
+        np.testing.assert_array_equal([1, 2, 3], snapshots[:, 0, 0])
+        self.assertEqual(os.path.getsize(os.path.join(path, 'snapshots.npy')),
+                         snapshots.offset + snapshots.nbytes)
+
+
+class TestSharedMemorySink(SinkTestCase):
+
+    def test_progress_is_written_to_row(self):
+        arrays = sinks.SharedArrays(f'test-{os.getpid()}', 2, 2, 4, create=True)
+        try:
+            sink = sinks.SharedMemorySink(arrays.name, 1)
+            sink.open('run', PARAMETERS, self.bed, self.model)
+            live = {'subregions': {'subregion-0-flux': np.arange(4)},
+                    'avg_age': np.full(4, 2.5), 'age_range': np.ones(4)}
+            sink.write_progress(1, live)
+            self.assertEqual(1, arrays.progress[1])
+            np.testing.assert_array_equal([0, 1, 0, 0], arrays.flux[1, 0])
+            np.testing.assert_array_equal([2.5, 2.5], arrays.age[1, 0, :2])
+            self.assertTrue(np.isnan(arrays.age[1, 0, 2]))
+            sink.write_progress(3, live)
+            sink.close()
+            # The sink stopped this process tracking the blocks, as a run
+            # would; track them again so the creator can unlink them
+            for block in arrays.blocks:
+                resource_tracker.register(block._name, 'shared_memory')
+            np.testing.assert_array_equal(np.arange(4), arrays.flux[1, 0])
+            self.assertEqual(-1, arrays.progress[0])
+        finally:
+            arrays.close()
+
+
+class TestBuildSinks(unittest.TestCase):
+
+    def test_unknown_sink_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            _ = sinks.build_sinks(['shelf'], '.', 'stem')
+
+    def test_names_map_to_sink_types(self):
+        built = sinks.build_sinks(['hdf5', 'compact', 'swmr', 'numpy', 'memory', 'null'], 
+                                    '.', 'stem')
+        expected = [sinks.HDF5Sink, sinks.CompactHDF5Sink, sinks.SWMRHDF5Sink, sinks.NumpySink,
+                    sinks.MemorySink, sinks.NullSink]
+        self.assertEqual(expected, [type(sink) for sink in built])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import unittest
+import numpy as np
+from unittest.mock import Mock
+
+from model import stats
+
+
+def random_particles(num_particles, x_max, rng):
+    particles = np.zeros((num_particles, 7))
+    particles[:,0] = rng.uniform(0, x_max, num_particles)
+    particles[:,3] = np.arange(num_particles)
+    particles[:,4] = rng.integers(0, 2, num_particles)
+    particles[:,5] = rng.integers(0, 60, num_particles)
+    return particles
+
+
+class TestAgeStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.boundaries = [10.0, 20.0]
+        self.edges = [0, 10, 25]
+
+    def build(self, interval, n_iterations):
+        return stats.AgeStatistics(['subregion-0', 'subregion-1'], self.boundaries,
+                                   self.edges, interval, n_iterations)
+
+    def test_record_matches_direct_computation(self):
+        age_stats = self.build(interval=3, n_iterations=6)
+        history = []
+        for iteration in range(6):
+            particles = random_particles(50, 20, self.rng)
+            particles[0,0] = -1  # out of the stream, ignored
+            history.append(particles)
+            age_stats.update(particles, iteration)
+        results = age_stats.results()
+        np.testing.assert_array_equal([2, 5], results['iteration'])
+
+        for row, window in enumerate([history[:3], history[3:]]):
+            pooled = np.concatenate([p[1:] for p in window])
+            for sub, (left, right) in enumerate([(0, 10), (10, 20)]):
+                inside = pooled[(pooled[:,0] >= left) & (pooled[:,0] < right)]
+                ages = inside[:,5]
+                expected_hist = [np.sum(ages < 10), np.sum((ages >= 10) & (ages < 25)),
+                                 np.sum(ages >= 25)]
+                np.testing.assert_array_equal(expected_hist, results['histogram'][row, sub])
+                self.assertAlmostEqual(ages.mean(), results['mean'][row, sub])
+                self.assertAlmostEqual(ages.var(ddof=1), results['variance'][row, sub])
+                self.assertAlmostEqual(inside[:,4].mean(), results['active_fraction'][row, sub])
+
+        pooled = np.concatenate([p[1:] for p in history])
+        inside = pooled[pooled[:,0] >= 10]
+        self.assertAlmostEqual(inside[:,5].mean(), results['running_mean'][-1, 1])
+        self.assertAlmostEqual(inside[:,5].var(ddof=1), results['running_variance'][-1, 1])
+
+    def test_particle_on_last_boundary_is_in_last_subregion(self):
+        age_stats = self.build(interval=1, n_iterations=1)
+        particles = random_particles(1, 20, self.rng)
+        particles[0,0] = 20.0
+        age_stats.update(particles, 0)
+        self.assertEqual(1, age_stats.results()['histogram'][0, 1].sum())
+
+    def test_empty_subregion_is_nan(self):
+        age_stats = self.build(interval=1, n_iterations=1)
+        particles = random_particles(5, 10, self.rng)
+        age_stats.update(particles, 0)
+        results = age_stats.results()
+        self.assertTrue(np.isnan(results['mean'][0, 1]))
+        self.assertTrue(np.isnan(results['active_fraction'][0, 1]))
+
+    def test_unsorted_bin_edges_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            stats.AgeStatistics(['a'], [10], [0, 20, 10], 1, 1)
+
+    def test_build_without_age_bins_returns_none(self):
+        self.assertIsNone(stats.build_age_statistics({'n_iterations': 10}, []))
+
+    def test_build_uses_subregion_boundaries(self):
+        subregion = Mock()
+        subregion.getName.return_value = 'subregion-0'
+        subregion.rightBoundary.return_value = 50.0
+        age_stats = stats.build_age_statistics({'n_iterations': 10, 'age_bins': [0, 5],
+                                                'age_stats_interval': 5}, [subregion])
+        self.assertEqual(['subregion-0'], age_stats.names)
+        self.assertEqual(2, age_stats.iteration.size)
+
+
+class TestStationarityMonitor(unittest.TestCase):
+
+    def feed(self, monitor, series):
+        for iteration, values in enumerate(series):
+            monitor.update(iteration, values)
+
+    def test_step_then_noise_detects_end_of_burn_in(self):
+        rng = np.random.default_rng(1)
+        monitor = stats.StationarityMonitor(['flux', 'age'], batch_size=10, window=8)
+        burn_in = np.column_stack([np.linspace(0, 50, 200), np.linspace(0, 20, 200)])
+        steady = np.column_stack([rng.normal(50, 2, 800), rng.normal(20, 1, 800)])
+        self.feed(monitor, np.concatenate([burn_in, steady]))
+        self.assertTrue(monitor.stationary)
+        self.assertGreaterEqual(monitor.burn_in_iteration, 150)
+        self.assertEqual(0, monitor.burn_in_iteration % 10)
+        self.assertEqual(1000 - monitor.burn_in_iteration, monitor.stationary_iterations(999))
+
+    def test_trend_is_not_stationary(self):
+        monitor = stats.StationarityMonitor(['flux'], batch_size=5, window=6)
+        self.feed(monitor, np.linspace(0, 100, 300)[:,None] 
+                            + np.random.default_rng(2).normal(0, 0.1, (300, 1)))
+        self.assertFalse(monitor.stationary)
+        self.assertEqual(0, monitor.stationary_iterations(299))
+        self.assertEqual((60,), monitor.results()['batch_means']['flux'].shape)
+
+    def test_small_window_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            stats.StationarityMonitor(['flux'], batch_size=5, window=3)
+
+    def test_build_without_stationarity_batch_returns_none(self):
+        self.assertIsNone(stats.build_stationarity_monitor({'n_iterations': 10}, []))
+
+    def test_build_watches_flux_and_average_age(self):
+        subregion = Mock()
+        subregion.getName.return_value = 'subregion-0'
+        monitor = stats.build_stationarity_monitor({'stationarity_batch': 20}, [subregion])
+        self.assertEqual(['subregion-0-flux', 'avg_age'], monitor.names)
+        self.assertEqual(10, monitor.window)
+
+
+class TestEnsembleMoments(unittest.TestCase):
+
+    def test_pieces_match_moments_across_runs(self):
+        rng = np.random.default_rng(3)
+        runs = rng.normal(5, 2, (4, 2, 10))
+        moments = stats.EnsembleMoments(2, 10)
+        for run in runs:
+            for start, stop in [(0, 3), (3, 3), (3, 10)]:
+                moments.update(run, start, stop)
+        results = moments.results()
+        np.testing.assert_array_equal(np.full(10, 4), results['count'])
+        np.testing.assert_allclose(runs.mean(axis=0), results['mean'])
+        np.testing.assert_allclose(runs.var(axis=0, ddof=1), results['variance'])
+
+    def test_runs_with_fewer_series_leave_the_others_alone(self):
+        moments = stats.EnsembleMoments(3, 4)
+        moments.update(np.full((3, 4), 2.0), 0, 4)
+        moments.update(np.full((3, 4), 4.0), 0, 4, n_series=1)
+        results = moments.results()
+        np.testing.assert_array_equal([[2] * 4, [1] * 4, [1] * 4], results['series_count'])
+        np.testing.assert_array_equal([3.0, 2.0, 2.0], results['mean'][:, 0])
+        np.testing.assert_array_equal([2.0, np.nan, np.nan], results['variance'][:, 0])
+
+    def test_unreached_iterations_are_nan(self):
+        moments = stats.EnsembleMoments(1, 4)
+        moments.update(np.ones((1, 4)), 0, 2)
+        results = moments.results()
+        np.testing.assert_array_equal([1, 1, 0, 0], results['count'])
+        self.assertTrue(np.isnan(results['mean'][0, 3]))
+        self.assertTrue(np.all(np.isnan(results['variance'])))
+
+
+class TestConfidenceInterval(unittest.TestCase):
+
+    def test_matches_student_t_interval(self):
+        values = [4.0, 5.0, 6.0, 5.5]
+        mean, half_width = stats.confidence_interval(values, 0.95)
+        self.assertAlmostEqual(5.125, mean)
+        # t(0.975, 3) = 3.182446
+        self.assertAlmostEqual(3.182446 * np.std(values, ddof=1) / 2, half_width, places=5)
+        self.assertAlmostEqual(half_width / mean, stats.relative_half_width(values, 0.95))
+
+    def test_single_value_has_infinite_width(self):
+        self.assertEqual(np.inf, stats.confidence_interval([3.0])[1])
+        self.assertEqual(np.inf, stats.relative_half_width([3.0]))
+
+    def test_zero_mean(self):
+        self.assertEqual(0.0, stats.relative_half_width([0.0, 0.0, 0.0]))
+        self.assertEqual(np.inf, stats.relative_half_width([-1.0, 1.0]))
+
+
+if __name__ == '__main__':
+    unittest.main()